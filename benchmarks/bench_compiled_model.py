@@ -0,0 +1,86 @@
+"""
+Compare the pickled AveragingModels against its compiled NumPy artifact:
+cold start (a fresh interpreter importing, loading and predicting one piece),
+single piece latency and batch throughput of an already loaded model.
+
+python benchmarks/bench_compiled_model.py [model] [--features CSV]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import compiled_model
+import scoring
+
+COLD_START = """
+import time
+start = time.perf_counter()
+import sys
+sys.path.insert(0, {root!r})
+{load}
+model.predict([[0.5] * 10])
+print(time.perf_counter() - start)
+"""
+
+
+def cold_start(load, repeat=3):
+    """Best time of a fresh python process to import, load and predict once"""
+    times = []
+    for _ in range(repeat):
+        code = COLD_START.format(root=ROOT, load=load)
+        output = subprocess.run([sys.executable, "-W", "ignore", "-c", code], capture_output=True, text=True, check=True)
+        times.append(float(output.stdout.split()[-1]))
+    return min(times)
+
+
+def latency(model, X, repeat=20):
+    model.predict(X)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        model.predict(X)
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the pickled and the compiled model")
+    parser.add_argument("model", type=str, nargs="?", default="models/averaged_models.pkl", help="Pickled AveragingModels")
+    parser.add_argument("--features", type=str, default="data/all_song_features.csv", help="CSV of features")
+    args = parser.parse_args()
+
+    pickled = scoring.load_model(args.model, compiled=False)
+    with tempfile.TemporaryDirectory() as directory:
+        artifact = os.path.join(directory, "model.npz")
+        compiled_model.export(pickled, artifact, source=args.model)
+        compiled = compiled_model.load(artifact)
+        print(f"{args.model}: {os.path.getsize(args.model) / 1e6:.1f} MB pickle, "
+              f"{os.path.getsize(artifact) / 1e6:.1f} MB compiled")
+
+        X = pd.read_csv(args.features).loc[:, scoring.FEATURES_KEPT].to_numpy()
+        if getattr(pickled, "scaler", None) is not None:
+            X = pickled.scaler.transform(X)
+        else:
+            X = X / np.nanmax(X, axis=0)
+        expected, result = pickled.predict(X), compiled.predict(X)
+        print(f"max difference {np.max(np.abs(expected - result)):.3g}, "
+              f"same rounded predictions: {np.array_equal(np.round(expected * 2), np.round(result * 2))}")
+
+        path = os.path.abspath(args.model)
+        rows = [
+            ("cold start (s)",
+             cold_start(f"import scoring; model = scoring.load_model({path!r}, compiled=False)"),
+             cold_start(f"import compiled_model; model = compiled_model.load({artifact!r})")),
+            ("1 piece (ms)", latency(pickled, X[:1]) * 1000, latency(compiled, X[:1]) * 1000),
+            (f"{len(X)} pieces (ms)", latency(pickled, X, 5) * 1000, latency(compiled, X, 5) * 1000),
+        ]
+    print(f"{'':20} {'pickle':>9} {'compiled':>9}")
+    for label, before, after in rows:
+        print(f"{label:20} {before:>9.3f} {after:>9.3f}")
@@ -0,0 +1,74 @@
+"""
+Compare the work display_difficulty_ranges did on every rerun of the app
+(copy predictions, filter each range, one st.write per piece) with the range
+views precomputed once by DifficultyIndex.range_views (one table page per
+range on a rerun), and check which pieces each of them leaves out.
+
+python benchmarks/bench_difficulty_ranges.py [predictions]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import recommendations
+import scoring
+
+# the (low, high) ranges display_difficulty_ranges filtered, both ends included
+LEGACY_RANGES = [(1.0, 1.5), (2.0, 2.5), (3.0, 3.0), (3.5, 3.5), (4.0, 4.5), (5.0, 5.0)]
+
+
+def legacy_ranges(predictions):
+    """The strings the previous display_difficulty_ranges passed to st.write"""
+    df = predictions.copy()
+    written = []
+    for low, high in LEGACY_RANGES:
+        filtered = df[(df["predicted_difficulty"] >= low) & (df["predicted_difficulty"] <= high)]
+        for _, row in filtered.iterrows():
+            written.append(f"{row['file'][:-4]} — Difficulty: {row['predicted_difficulty']:.2f}")
+    return written
+
+
+def rerun(views):
+    """What a rerun renders now: the first page of every range"""
+    return [view.page(0) for view in views]
+
+
+def timed(func, *args, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(*args)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def report(name, predictions):
+    index = recommendations.DifficultyIndex(predictions['file'], predictions['predicted_difficulty'])
+    legacy, written = timed(legacy_ranges, predictions)
+    build, views = timed(index.range_views)
+    render, pages = timed(rerun, views, repeat=100)
+    print(f"{name}: {len(predictions)} pieces")
+    print(f"  before: {legacy * 1000:.1f}ms per rerun, {len(written)} st.write calls, "
+          f"{len(predictions) - len(written)} pieces in no range")
+    print(f"  after:  {build * 1000:.1f}ms once, {render * 1000:.2f}ms per rerun, {len(pages)} tables "
+          f"of at most {recommendations.PAGE_SIZE} rows, {len(predictions) - sum(map(len, views))} pieces in no range")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the difficulty range rendering work")
+    parser.add_argument("predictions", type=str, nargs="?", default="predictions.csv", help="predictions.csv")
+    parser.add_argument("--features", type=str, default="data/all_song_features.csv", help="CSV of features")
+    args = parser.parse_args()
+
+    predictions = pd.read_csv(args.predictions)
+    report("predictions.csv", predictions)
+
+    # predictions before rounding to half steps fall between the old ranges
+    model = scoring.load_model()
+    features = pd.read_csv(args.features)
+    raw = model.predict(model.scaler.transform(features.loc[:, scoring.FEATURES_KEPT].to_numpy()))
+    report("unrounded predictions", pd.DataFrame({'file': features['file'], 'predicted_difficulty': np.round(raw, 2)}))
@@ -0,0 +1,106 @@
+"""
+Compare loading pieces (and extracting their features) from CSV files against
+the memory mapped event store, with the files evicted from the page cache
+(cold) and already cached (warm), then check every feature read from the
+store is the same as from the CSV. Exits with status 1 on any difference.
+
+python benchmarks/bench_event_store.py [directory]
+"""
+import argparse
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import csv_processing
+import event_store
+import feature_engine
+
+
+def evict(paths):
+    """Drop the files from the OS page cache so the next read comes from disk"""
+    for path in paths:
+        with open(path, "rb") as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def load_csv(path):
+    df = pd.read_csv(path, low_memory=False, usecols=lambda col: col in feature_engine.EVENT_COLUMNS)
+    events = feature_engine.sort_events(feature_engine.events_from_dataframe(df))
+    return events
+
+
+def load_store(directory):
+    store = event_store.EventStore(directory)
+    loaded = []
+    for _, events in store:
+        # touch every value so the pages are actually read
+        for values in events.values():
+            np.add.reduce(values, dtype=np.int64)
+        loaded.append(events)
+    return loaded
+
+
+def features_csv(files):
+    return [csv_processing.get_features(path) for path in files]
+
+
+def features_store(directory):
+    store = event_store.EventStore(directory)
+    return [event_store.get_stored_features(store, i) for i in range(len(store))]
+
+
+def differences(files, directory):
+    """(file, feature, from the csv, from the store) for every feature that differs"""
+    expected = [features for features in features_csv(files) if features is not None]
+    found = []
+    for csv_features, store_features in zip(expected, features_store(directory)):
+        for name, value in csv_features.items():
+            stored = store_features[name]
+            if not (value == stored or (isinstance(value, float) and math.isnan(value) and math.isnan(stored))):
+                found.append((csv_features['file'], name, value, stored))
+    return found
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare CSV loading against the event store")
+    parser.add_argument("directory", type=str, nargs="?", default="data/liszt", help="Directory containing CSV files")
+    args = parser.parse_args()
+
+    files = sorted(csv_processing.get_files_in_directory(args.directory))
+    with tempfile.TemporaryDirectory() as store_dir:
+        event_store.ingest(files, store_dir)
+        store_files = [os.path.join(store_dir, name) for name in os.listdir(store_dir)]
+        csv_size = sum(os.path.getsize(path) for path in files)
+        store_size = sum(os.path.getsize(path) for path in store_files)
+        print(f"{len(files)} files, csv {csv_size / 1e6:.1f} MB, store {store_size / 1e6:.1f} MB")
+
+        print(f"{'':22} {'cold (s)':>9} {'warm (s)':>9}")
+        for label, func, arg, paths in [
+            ("csv load", lambda fs: [load_csv(p) for p in fs], files, files),
+            ("store load", load_store, store_dir, store_files),
+            ("csv load + features", features_csv, files, files),
+            ("store load + features", features_store, store_dir, store_files),
+        ]:
+            evict(paths)
+            cold = timed(func, arg)
+            warm = timed(func, arg)
+            print(f"{label:22} {cold:>9.3f} {warm:>9.3f}")
+
+        found = differences(files, store_dir)
+    for name, feature, expected, stored in found:
+        print(f"{name} {feature}: csv {expected!r}, store {stored!r}")
+    print(f"{len(found)} features differ between the CSV files and the store")
+    sys.exit(1 if found else 0)
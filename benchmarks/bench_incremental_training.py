@@ -0,0 +1,106 @@
+"""
+Compare AveragingModels.update (more boosting rounds and trees for newly
+labeled pieces) with refitting the ensemble from scratch: time taken and
+accuracy on a held-out split. The labeled pieces are split into a test set,
+the pieces the model was first trained on and the pieces that arrive later.
+
+python benchmarks/bench_incremental_training.py [--data data/training.npz] [--splits 5]
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.svm import SVR
+from xgboost import XGBRegressor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "streamlit"))
+
+from AveragingModels import AveragingModels
+from scoring import FEATURES_KEPT
+from train import read_table
+
+
+def ensemble(params):
+    """The XGB + RandomForest + SVR ensemble of the app with the tuned parameters"""
+    return AveragingModels(models=[
+        XGBRegressor(random_state=42, **params['XGB']['best_params']),
+        RandomForestRegressor(random_state=42, **params['RandomForest']['best_params']),
+        SVR(**params['SVR']['best_params']),
+    ], scaler=MinMaxScaler())
+
+
+def fit(model, X, y):
+    model.scaler.fit(X)
+    return model.fit(model.scaler.transform(X), y)
+
+
+def evaluate(model, X, y):
+    predicted = model.predict(model.scaler.transform(X))
+    return mean_absolute_error(y, np.round(predicted * 2) / 2), r2_score(y, predicted)
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare incremental updates with retraining from scratch")
+    parser.add_argument("--data", type=str, default=os.path.join(ROOT, "data/training.npz"), help="Labeled pieces")
+    parser.add_argument("--params", type=str, default=os.path.join(ROOT, "model_params.json"), help="Tuned parameters")
+    parser.add_argument("--splits", type=int, default=5, help="Number of random splits")
+    parser.add_argument("--new", type=float, default=0.2, help="Share of the training pieces that arrive later")
+    parser.add_argument("--rounds", type=int, default=50, help="Boosting rounds added to XGBoost")
+    parser.add_argument("--trees", type=int, default=50, help="Trees added to RandomForest")
+    args = parser.parse_args()
+
+    with open(args.params, encoding="utf-8") as f:
+        params = json.load(f)
+    df = read_table(args.data)
+    X = df.loc[:, FEATURES_KEPT].to_numpy(dtype=np.float64)
+    y = df['difficulty'].to_numpy()
+
+    rows = []
+    for seed in range(args.splits):
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=seed)
+        X_old, X_new, y_old, y_new = train_test_split(X_train, y_train, test_size=args.new, random_state=seed)
+
+        old = fit(ensemble(params), X_old, y_old)
+        full, full_time = timed(fit, ensemble(params), X_train, y_train)
+        incremental = copy.deepcopy(old)
+        updated, update_time = timed(incremental.update, X_train, y_train, args.rounds, args.trees)
+        rows.append({
+            'split': seed,
+            'new pieces': len(y_new),
+            'updated': updated,
+            'full (s)': full_time,
+            'update (s)': update_time,
+            'old MAE': evaluate(old, X_test, y_test)[0],
+            'full MAE': evaluate(full, X_test, y_test)[0],
+            'update MAE': evaluate(incremental, X_test, y_test)[0],
+            'old R^2': evaluate(old, X_test, y_test)[1],
+            'full R^2': evaluate(full, X_test, y_test)[1],
+            'update R^2': evaluate(incremental, X_test, y_test)[1],
+        })
+
+    table = pd.DataFrame(rows)
+    pd.set_option("display.width", 200)
+    print(table.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    print(f"{table['updated'].sum()} of {len(table)} splits updated in place, the others refitted from scratch")
+    updated = table[table['updated']]
+    if len(updated):
+        print(f"when updated: {updated['update (s)'].mean():.3f}s vs {updated['full (s)'].mean():.3f}s from scratch, "
+              f"MAE {updated['update MAE'].mean():.3f} vs {updated['full MAE'].mean():.3f} "
+              f"(old model {updated['old MAE'].mean():.3f})")
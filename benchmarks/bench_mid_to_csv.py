@@ -0,0 +1,93 @@
+"""
+Benchmark the array based convert_midi_to_csv.mid_to_csv against the previous
+implementation that concatenated one row per midi message.
+
+python benchmarks/bench_mid_to_csv.py [directory]
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+from mido import MidiFile, MetaMessage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "streamlit"))
+
+import convert_midi_to_csv as convert
+import feature_engine
+
+# features used by the model, these do not depend on the order of events sharing a tick
+FEATURES_KEPT = ['note_count', 'note_density', 'unique_note_count', 'notes_per_second',
+    'pitch_range', 'tempo_change_count', 'note_to_note_transition',
+    'note_to_chord_transition', 'chord_to_note_transition',
+    'chord_to_chord_transition']
+
+
+def legacy_mid_to_csv(mid):
+    """The previous mid_to_csv, one pd.concat per message and one pd.merge per track"""
+    df = pd.DataFrame()
+
+    for n_track, track in enumerate(mid.tracks):
+        track_df = pd.DataFrame()
+        time = 0
+
+        for msg in track:
+            msg_dict = dict(msg.__dict__)
+            msg_dict["meta"] = int(isinstance(msg, MetaMessage))
+            msg_dict["track"] = n_track
+
+            time += int(msg_dict["time"])
+            msg_dict["tick"] = time
+
+            for k in ["name", "text"]:
+                if k in msg_dict:
+                    del msg_dict[k]
+
+            track_df = pd.concat(
+                [track_df, pd.DataFrame([msg_dict])], ignore_index=True
+            )
+
+        if df.shape[0] > 0:
+            df = pd.merge(df, track_df, how="outer")
+        else:
+            df = track_df
+
+    for col in df.columns:
+        if df[col].dtype == "float64":
+            df[col] = df[col].astype("Int64")
+
+    df.set_index("tick", inplace=True)
+    df.sort_index(inplace=True)
+
+    return df
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare mid_to_csv against the previous implementation")
+    parser.add_argument("directory", type=str, nargs="?", default="data/test", help="Directory containing MIDI files")
+    args = parser.parse_args()
+
+    print(f"{'file':45} {'messages':>9} {'legacy (s)':>11} {'new (s)':>9} {'speedup':>8}  features")
+    for path in sorted(Path(args.directory).glob("*.mid")):
+        # load the file for each run so neither gets the other's parsed messages
+        legacy_df, legacy_time = timed(legacy_mid_to_csv, MidiFile(path))
+        new_df, new_time = timed(convert.mid_to_csv, MidiFile(path))
+
+        legacy_features = feature_engine.compute_features(
+            feature_engine.sort_events(feature_engine.events_from_dataframe(legacy_df.reset_index())))
+        new_features = feature_engine.compute_features(
+            feature_engine.sort_events(feature_engine.events_from_dataframe(new_df.reset_index())))
+        same = all(legacy_features[k] == new_features[k] for k in FEATURES_KEPT)
+
+        print(f"{path.name[:45]:45} {len(new_df):>9} {legacy_time:>11.3f} {new_time:>9.3f} "
+              f"{legacy_time / new_time:>7.0f}x  {'match' if same else 'DIFFER'}")
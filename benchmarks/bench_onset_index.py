@@ -0,0 +1,113 @@
+"""
+Compare the chord and polyphony features computed from the shared onset index
+against each feature filtering and grouping the note_on events on its own,
+in time and peak memory, on the largest CSV files of a directory.
+
+python benchmarks/bench_onset_index.py [directory] [--count N]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import csv_processing
+import feature_engine
+from feature_engine import NOTE_ON, _group_sizes, _group_starts, _nanstd, _sequential_sum
+
+ONSET_FEATURES = [
+    'hand_independence', 'consecutive_note_std', 'average_polyphony', 'max_polyphony',
+    'note_to_note_transition', 'note_to_chord_transition',
+    'chord_to_note_transition', 'chord_to_chord_transition',
+]
+
+
+def separate_masks(events):
+    """The same features with every function filtering and grouping the events itself"""
+    def note_on_ticks():
+        return events["tick"][events["type"] == NOTE_ON]
+
+    def hand_independence():
+        is_note_on = events["type"] == NOTE_ON
+        track = events["track"][is_note_on]
+        starts = _group_starts(events["tick"][is_note_on])
+        independent = np.count_nonzero(np.minimum.reduceat(track, starts) != np.maximum.reduceat(track, starts))
+        return int(independent) / len(starts)
+
+    def average_polyphony():
+        ticks = note_on_ticks()
+        return len(ticks) / len(_group_starts(ticks))
+
+    def max_polyphony():
+        ticks = note_on_ticks()
+        return _group_sizes(_group_starts(ticks), len(ticks)).max()
+
+    def transitions():
+        sounding = (events["type"] == NOTE_ON) & (events["velocity"] > 0)
+        ticks = events["tick"][sounding]
+        notes = events["note"][sounding].astype(np.float64)
+        starts = _group_starts(ticks)
+        sizes = _group_sizes(starts, len(ticks))
+        centroids = np.add.reduceat(notes, starts) / sizes
+        is_chord = sizes > 1
+        intervals = np.abs(np.diff(centroids))
+        from_chord, to_chord = is_chord[:-1], is_chord[1:]
+        return (
+            _sequential_sum(intervals[~from_chord & ~to_chord]),
+            _sequential_sum(intervals[~from_chord & to_chord]),
+            _sequential_sum(intervals[from_chord & ~to_chord]),
+            _sequential_sum(intervals[from_chord & to_chord]),
+        )
+
+    return [
+        hand_independence(),
+        _nanstd(np.diff(note_on_ticks()).astype(np.float64)),
+        average_polyphony(),
+        max_polyphony(),
+        *transitions(),
+    ]
+
+
+def onset_index(events):
+    return list(feature_engine.compute_features(events, ONSET_FEATURES).values())
+
+
+def measure(func, events, repeat=5):
+    """Best wall time and peak traced memory of func(events)"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(events)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    result = func(events)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the onset index against per feature filtering")
+    parser.add_argument("directory", type=str, nargs="?", default="data", help="Directory containing CSV files")
+    parser.add_argument("--count", type=int, default=5, help="Number of files, largest first")
+    args = parser.parse_args()
+
+    # skip the feature tables, only event CSVs have a tick column
+    files = [path for path in csv_processing.get_files_in_directory(args.directory, recursive=True)
+             if pd.read_csv(path, nrows=0).columns.isin(['tick']).any()]
+    files = sorted(files, key=os.path.getsize, reverse=True)[:args.count]
+
+    print(f"{'file':40} {'events':>8} {'separate (ms)':>14} {'index (ms)':>11} {'separate (KB)':>14} {'index (KB)':>11}")
+    for path in files:
+        df = pd.read_csv(path, low_memory=False, usecols=lambda col: col in feature_engine.EVENT_COLUMNS)
+        events = feature_engine.sort_events(feature_engine.events_from_dataframe(df))
+        before, before_peak, expected = measure(separate_masks, events)
+        after, after_peak, result = measure(onset_index, events)
+        assert np.allclose(expected, result, rtol=0, atol=0), path
+        print(f"{path.name[:40]:40} {len(events['tick']):>8} {before * 1000:>14.2f} {after * 1000:>11.2f} "
+              f"{before_peak / 1024:>14.0f} {after_peak / 1024:>11.0f}")
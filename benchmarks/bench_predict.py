@@ -0,0 +1,50 @@
+"""
+Compare AveragingModels.predict running the base models one after the other
+against running them in a thread pool, on the features table repeated to the
+size of a large library.
+
+python benchmarks/bench_predict.py [features] [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import scoring
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare serial and threaded base model inference")
+    parser.add_argument("features", type=str, nargs="?", default="data/all_song_features.csv", help="CSV of features")
+    parser.add_argument("--repeat", type=int, default=10, help="Number of copies of the table to score")
+    args = parser.parse_args()
+
+    features = pd.read_csv(args.features)
+    reference = scoring.load_model()
+    X = reference.scaler.transform(features.loc[:, scoring.FEATURES_KEPT].to_numpy())
+    X = np.tile(X, (args.repeat, 1))
+    print(f"{len(X)} rows, {os.cpu_count()} cpus")
+
+    # the app's ensemble has several base models, the notebook's only the random forest
+    for path in ["models/averaged_models.pkl", "streamlit/averaged_models.pkl"]:
+        model = scoring.load_model(os.path.join(ROOT, path))
+        names = ", ".join(type(m).__name__ for m in model.models_)
+        serial, expected = timed(model.predict, X)
+        with ThreadPoolExecutor(len(model.models_)) as executor:
+            model.predict(X[:10], executor=executor)
+            threaded, result = timed(model.predict, X, executor=executor)
+        assert np.array_equal(expected, result)
+        print(f"{path} ({names}): serial {serial:.3f}s, threaded {threaded:.3f}s, {serial / threaded:.2f}x")
@@ -0,0 +1,60 @@
+"""
+Compare the recommendation latency of the difficulty index with the
+rejection sampling the app used before, which re-read predictions.csv and
+drew random rows until three fell in the window. tests/test_recommendations.py
+checks its results.
+
+python benchmarks/bench_recommendations.py [predictions] [--features CSV]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import recommendations
+
+
+def rejection_sampling(path, difficulty, tries=100_000):
+    """The previous make_recommendations, with randint kept in range and the loop bounded"""
+    predictions = pd.read_csv(path)
+    found = []
+    for _ in range(tries):
+        if len(found) == 3:
+            break
+        piece = predictions.iloc[random.randint(0, len(predictions) - 1)]
+        if difficulty - 0.3 < piece["predicted_difficulty"] < difficulty + 0.5:
+            found.append(piece)
+    return found
+
+
+def timed(func, *args, repeat=200, **kwargs):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args, **kwargs)
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the difficulty index")
+    parser.add_argument("predictions", type=str, nargs="?", default="predictions.csv", help="predictions.csv")
+    parser.add_argument("--features", type=str, default="data/all_song_features.csv", help="CSV of features")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = recommendations.DifficultyIndex.from_csv(args.predictions, args.features)
+    print(f"indexed {len(index)} pieces in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    predictions = pd.read_csv(args.predictions)
+    query = index.features_of(predictions['file'].iloc[0])
+    print(f"{'difficulty':>10} {'window':>7} {'rejection (ms)':>15} {'index (ms)':>11} {'similar (ms)':>13}")
+    for difficulty in [1.5, 3.0, 4.5, 5.0]:
+        start, end = index.bounds(difficulty - 0.3, difficulty + 0.5, inclusive=False)
+        before = timed(rejection_sampling, args.predictions, difficulty, repeat=5)
+        after = timed(index.recommend, difficulty)
+        similar = timed(index.recommend, difficulty, features=query)
+        print(f"{difficulty:>10} {end - start:>7} {before * 1000:>15.2f} {after * 1000:>11.4f} {similar * 1000:>13.4f}")
@@ -0,0 +1,91 @@
+"""
+Windowed features of the midi files of a directory: checks every source
+(MIDI read in chunks, a tick ordered CSV read in chunks, a CSV listing one
+track after the other that has to be sorted whole, a DataFrame) and chunk
+size gives the same windows, then compares the time and peak memory of
+reading in chunks with loading the piece whole, next to
+csv_processing.get_features.
+
+python benchmarks/bench_segment_features.py [directory] [--bars 4 | --seconds 10] [--hop H]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+from mido import MidiFile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "streamlit"))
+
+import convert_midi_to_csv as convert
+import csv_processing
+import segment_features
+
+
+def measure(func, *args, **kwargs):
+    """Best time of 3 runs and peak memory of one"""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def whole(path, window, ticks_per_beat):
+    """The piece loaded in one DataFrame, then windowed in one chunk"""
+    df = pd.read_csv(path, low_memory=False, usecols=lambda col: col in segment_features.COLUMNS)
+    return segment_features.get_segment_features(df, *window, ticks_per_beat=ticks_per_beat, chunk_size=len(df))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and time the windowed features")
+    parser.add_argument("directory", type=str, nargs="?", default="data/test", help="Directory of midi files")
+    unit = parser.add_mutually_exclusive_group()
+    unit.add_argument("--bars", type=float, help="Window length in bars (4 bars by default)")
+    unit.add_argument("--seconds", type=float, help="Window length in seconds")
+    parser.add_argument("--hop", type=float, help="How far the window moves each step (its length by default)")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="Events read at a time")
+    args = parser.parse_args()
+    window = ("seconds", args.seconds, args.hop) if args.seconds else ("bars", args.bars or 4, args.hop)
+
+    files = sorted(Path(args.directory).rglob("*.mid"), key=os.path.getsize, reverse=True)
+    print(f"{'file':36} {'events':>7} {'windows':>7} {'chunks (ms)':>11} {'whole (ms)':>10} "
+          f"{'chunks (KB)':>11} {'whole (KB)':>10} {'get_features (ms)':>17}")
+    with tempfile.TemporaryDirectory() as directory:
+        for path in files:
+            mid = MidiFile(path)
+            df = convert.mid_to_csv(mid)
+            csv_path = os.path.join(directory, path.stem + ".csv")
+            df.to_csv(csv_path)
+            by_track_path = os.path.join(directory, path.stem + ".tracks.csv")
+            df.reset_index().sort_values("track", kind="stable").to_csv(by_track_path, index=False)
+
+            options = {'ticks_per_beat': mid.ticks_per_beat}
+            expected = segment_features.get_segment_features(mid, *window, chunk_size=len(df))
+            sources = {
+                'MIDI, 100 events at a time': segment_features.get_segment_features(mid, *window, chunk_size=100),
+                'CSV, 100 events at a time': segment_features.get_segment_features(csv_path, *window, chunk_size=100, **options),
+                'CSV by track': segment_features.get_segment_features(by_track_path, *window, **options),
+                'DataFrame': segment_features.get_segment_features(df, *window, **options),
+            }
+            for name, segments in sources.items():
+                pd.testing.assert_frame_equal(expected, segments, check_dtype=False, obj=f"{path.name} ({name})")
+
+            chunked, chunked_peak, _ = measure(
+                segment_features.get_segment_features, csv_path, *window, chunk_size=args.chunk_size, **options)
+            loaded, loaded_peak, _ = measure(whole, csv_path, window, mid.ticks_per_beat)
+            features, _, _ = measure(csv_processing.get_features, csv_path)
+            print(f"{path.name[:36]:36} {len(df):>7} {len(expected):>7} {chunked * 1000:>11.1f} {loaded * 1000:>10.1f} "
+                  f"{chunked_peak / 1024:>11.0f} {loaded_peak / 1024:>10.0f} {features * 1000:>17.1f}")
+    print("every source and chunk size gave the same windows")
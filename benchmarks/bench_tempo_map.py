@@ -0,0 +1,86 @@
+"""
+Check the tempo map against mido's own playback time (MidiFile.length) on
+the midi files of a directory, then time the tempo statistics and duration
+from the tempo map against the tempo statistics of the forward filled tempo
+of every event, and converting every note_on to seconds.
+
+python benchmarks/bench_tempo_map.py [directory] [--count N]
+"""
+import argparse
+import math
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from mido import MidiFile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, "streamlit"))
+
+import convert_midi_to_csv as convert
+import csv_processing
+import feature_engine
+from feature_engine import NOTE_ON, SET_TEMPO
+from tempo_map import TempoMap
+
+
+def best_of(func, *args, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def filled_tempo_stats(events):
+    """average_tempo and tempo_deviation as they were always computed, from the forward filled tempo"""
+    tempo = feature_engine._ffill(events["tempo"].astype(np.float64))
+    return feature_engine._nanmean(tempo), feature_engine._nanstd(tempo)
+
+
+def tempo_map_stats(events, ticks_per_beat):
+    return feature_engine.compute_features(events, TIMED, ticks_per_beat)
+
+
+def tempo_map_seconds(events, ticks_per_beat):
+    """The tempo map of a piece and the seconds of all its note_on events"""
+    is_tempo = events["type"] == SET_TEMPO
+    tempo_map = TempoMap.from_changes(events["tick"][is_tempo], events["tempo"][is_tempo], ticks_per_beat)
+    return tempo_map.seconds(events["tick"][events["type"] == NOTE_ON])
+
+
+TIMED = ['weighted_average_tempo', 'weighted_tempo_deviation', 'duration_seconds', 'timed_notes_per_second']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and time the tempo map")
+    parser.add_argument("directory", type=str, nargs="?", default="data/test", help="Directory of midi files")
+    parser.add_argument("--count", type=int, default=10, help="Number of files, largest first")
+    args = parser.parse_args()
+
+    files = sorted(Path(args.directory).rglob("*.mid"), key=os.path.getsize, reverse=True)[:args.count]
+    print(f"{'file':36} {'events':>7} {'tempos':>6} {'length (s)':>10} {'map (s)':>10} {'ffill stats (ms)':>16} "
+          f"{'map stats (ms)':>14} {'onsets (ms)':>11} {'notes/s':>8} {'old notes/s':>11}")
+    worst = 0.0
+    for path in files:
+        mid = MidiFile(path)
+        df = convert.mid_to_csv(mid).reset_index()
+        events = feature_engine.sort_events(feature_engine.events_from_dataframe(df), fill=False)
+        features = csv_processing.get_features(mid)
+        # mido adds up the seconds of every message as it plays the file
+        worst = max(worst, abs(features['duration_seconds'] - mid.length))
+
+        filled, _ = best_of(filled_tempo_stats, events)
+        mapped, _ = best_of(tempo_map_stats, events, mid.ticks_per_beat)
+        onsets, seconds = best_of(tempo_map_seconds, events, mid.ticks_per_beat)
+        assert not np.isnan(seconds).any() and (np.diff(seconds) >= 0).all(), path
+        tempos = int(np.count_nonzero(events["type"] == SET_TEMPO))
+        print(f"{path.name[:36]:36} {len(df):>7} {tempos:>6} {mid.length:>10.2f} {features['duration_seconds']:>10.2f} "
+              f"{filled * 1000:>16.3f} {mapped * 1000:>14.3f} {onsets * 1000:>11.3f} {features['timed_notes_per_second']:>8.2f} "
+              f"{features['notes_per_second']:>11.2f}")
+    print(f"largest difference with MidiFile.length: {worst:.2e}s")
+    sys.exit(0 if worst < 1e-6 or math.isnan(worst) else 1)
@@ -0,0 +1,86 @@
+"""
+Send midi files to a running inference_server.py from many clients at once
+and report the latency percentiles and the throughput.
+
+python inference_server.py &
+python benchmarks/load_test.py data/test --requests 200 --concurrency 8
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+
+def post(url, path, data):
+    """Status and seconds of one /predict request"""
+    request = urllib.request.Request(
+        f"{url}/predict?name={urllib.parse.quote(path.name)}",
+        data=data,
+        headers={"Content-Type": "audio/midi"},
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    return status, time.perf_counter() - start
+
+
+def health(url):
+    with urllib.request.urlopen(f"{url}/health", timeout=10) as response:
+        return json.load(response)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test a local inference server")
+    parser.add_argument("directory", type=str, help="Directory of midi files sent round robin")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8000", help="Address of the server")
+    parser.add_argument("--requests", "-n", type=int, default=200, help="Number of requests")
+    parser.add_argument("--concurrency", "-c", type=int, default=8, help="Number of clients sending at once")
+    args = parser.parse_args()
+
+    files = sorted(Path(args.directory).glob("*.mid"))
+    if not files:
+        sys.exit(f"no midi files in {args.directory}")
+    payloads = [(path, path.read_bytes()) for path in files]
+    before = health(args.url)
+
+    results = []
+    lock = threading.Lock()
+
+    def client(i):
+        path, data = payloads[i % len(payloads)]
+        result = post(args.url, path, data)
+        with lock:
+            results.append(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        list(executor.map(client, range(args.requests)))
+    wall = time.perf_counter() - start
+    after = health(args.url)
+
+    statuses = np.array([status for status, _ in results])
+    latencies = np.array([seconds for status, seconds in results if status == 200]) * 1000
+    print(f"{args.requests} requests, {args.concurrency} clients, {len(files)} files, {wall:.2f}s")
+    print(f"  ok: {np.count_nonzero(statuses == 200)}, rejected (503): {np.count_nonzero(statuses == 503)}, "
+          f"other errors: {np.count_nonzero((statuses != 200) & (statuses != 503))}")
+    if len(latencies):
+        print(f"  latency p50 {np.percentile(latencies, 50):.1f}ms, p99 {np.percentile(latencies, 99):.1f}ms, "
+              f"max {latencies.max():.1f}ms")
+    print(f"  throughput {len(latencies) / wall:.1f} requests/sec")
+    batches = after['batches'] - before['batches']
+    rows = after['served'] - before['served']
+    print(f"  {batches} predict calls, {rows / max(batches, 1):.1f} rows per call")
@@ -0,0 +1,284 @@
+import argparse
+import hashlib
+import json
+
+import numpy as np
+
+# rows evaluated at a time, keeps the (rows x trees) and (rows x support vectors) arrays small
+CHUNK_ROWS = 1024
+
+
+def file_hash(filepath):
+    """
+    Hash of the content of a file
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _depth(left, right):
+    depth = 0
+    stack = [(0, 0)]
+    while stack:
+        node, node_depth = stack.pop()
+        depth = max(depth, node_depth)
+        if left[node] >= 0:
+            stack.append((left[node], node_depth + 1))
+            stack.append((right[node], node_depth + 1))
+    return depth
+
+
+def _pack_trees(trees):
+    """
+    Concatenate trees given as (feature, threshold, left, right, default_left, value)
+    into one set of node arrays, children pointing into the concatenated arrays.
+    Leaves point to themselves, so every row can take max_depth steps down its
+    trees without checking where it stopped.
+    """
+    arrays = {key: [] for key in ["feature", "threshold", "left", "right", "default_left", "value"]}
+    roots = []
+    max_depth = 0
+    offset = 0
+    for feature, threshold, left, right, default_left, value in trees:
+        roots.append(offset)
+        leaf = left < 0
+        nodes = np.arange(len(left)) + offset
+        arrays["feature"].append(np.where(leaf, 0, feature))
+        arrays["threshold"].append(threshold)
+        arrays["left"].append(np.where(leaf, nodes, left + offset))
+        arrays["right"].append(np.where(leaf, nodes, right + offset))
+        arrays["default_left"].append(default_left)
+        arrays["value"].append(value)
+        max_depth = max(max_depth, _depth(left, right))
+        offset += len(left)
+    packed = {key: np.concatenate(values) for key, values in arrays.items()}
+    packed["feature"] = packed["feature"].astype(np.int32)
+    packed["left"] = packed["left"].astype(np.int32)
+    packed["right"] = packed["right"].astype(np.int32)
+    packed["default_left"] = packed["default_left"].astype(bool)
+    packed["roots"] = np.array(roots, dtype=np.int32)
+    packed["max_depth"] = max_depth
+    return packed
+
+
+def _export_random_forest(model):
+    trees = []
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        trees.append((
+            tree.feature, tree.threshold, tree.children_left, tree.children_right,
+            tree.missing_go_to_left, tree.value[:, 0, 0],
+        ))
+    # sklearn compares float32 features with float64 thresholds, x <= threshold goes left,
+    # and averages the trees
+    return {"kind": "forest", "strict": False, "dtype": "float64", "base": 0.0,
+            "average": True, **_pack_trees(trees)}
+
+
+def _export_xgboost(model):
+    learner = json.loads(model.get_booster().save_raw("json"))["learner"]
+    if learner["objective"]["name"] != "reg:squarederror" or learner["gradient_booster"]["name"] != "gbtree":
+        raise ValueError("only gbtree models with the reg:squarederror objective can be compiled")
+    trees = learner["gradient_booster"]["model"]["trees"]
+    try:
+        # predict only uses the trees up to the best iteration after early stopping
+        trees = trees[:model.best_iteration + 1]
+    except AttributeError:
+        pass
+
+    packed = []
+    for tree in trees:
+        left = np.array(tree["left_children"])
+        # leaves keep their value in split_conditions
+        split = np.array(tree["split_conditions"], dtype=np.float32)
+        packed.append((
+            np.array(tree["split_indices"]), split, left, np.array(tree["right_children"]),
+            np.array(tree["default_left"]), split,
+        ))
+    base_score = float(learner["learner_model_param"]["base_score"].strip("[]"))
+    # xgboost works in float32, x < threshold goes left and the trees are summed onto base_score
+    return {"kind": "forest", "strict": True, "dtype": "float32", "base": base_score,
+            "average": False, **_pack_trees(packed)}
+
+
+def _export_svr(model):
+    if model.kernel != "rbf":
+        raise ValueError(f"only rbf SVR can be compiled, not {model.kernel}")
+    return {
+        "kind": "svr",
+        "support_vectors": model.support_vectors_,
+        "dual_coef": model.dual_coef_[0],
+        "intercept": float(model.intercept_[0]),
+        "gamma": float(model._gamma),
+    }
+
+
+def _export_linear(model):
+    return {"kind": "linear", "coef": np.ravel(model.coef_), "intercept": float(np.ravel(model.intercept_)[0])}
+
+
+EXPORTERS = {
+    "RandomForestRegressor": _export_random_forest,
+    "XGBRegressor": _export_xgboost,
+    "SVR": _export_svr,
+    "LinearRegression": _export_linear,
+    "Ridge": _export_linear,
+    "Lasso": _export_linear,
+    "ElasticNet": _export_linear,
+}
+
+
+def export(model, path, source=None):
+    """
+    Write a fitted AveragingModels (its scaler and base models) to a .npz of
+    plain arrays that CompiledModel loads without sklearn, xgboost or pickle.
+    source is the pickle the model came from, its hash is stored so a stale
+    artifact can be detected.
+    """
+    arrays = {}
+    meta = {"models": [], "source_sha256": file_hash(source) if source else None, "scaler": None}
+
+    scaler = getattr(model, "scaler", None)
+    if scaler is not None:
+        arrays["scaler_scale"] = scaler.scale_
+        arrays["scaler_min"] = scaler.min_
+        meta["scaler"] = {"clip": bool(scaler.clip), "feature_range": list(scaler.feature_range)}
+
+    for i, base in enumerate(model.models_):
+        name = type(base).__name__
+        if name not in EXPORTERS:
+            raise ValueError(f"{name} cannot be compiled")
+        exported = EXPORTERS[name](base)
+        info = {"name": name}
+        for key, value in exported.items():
+            if isinstance(value, np.ndarray):
+                arrays[f"{i}_{key}"] = value
+            else:
+                info[key] = value
+        meta["models"].append(info)
+
+    np.savez(path, meta=np.array(json.dumps(meta)), **arrays)
+
+
+class CompiledScaler:
+    """
+    MinMaxScaler.transform
+    """
+    def __init__(self, scale, minimum, clip=False, feature_range=(0, 1)):
+        self.scale_ = scale
+        self.min_ = minimum
+        self.clip = clip
+        self.feature_range = feature_range
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float64)
+        X *= self.scale_
+        X += self.min_
+        if self.clip:
+            np.clip(X, self.feature_range[0], self.feature_range[1], out=X)
+        return X
+
+
+def _forest_predict(model, X):
+    dtype = np.dtype(model["dtype"])
+    # both libraries evaluate the trees on float32 features
+    X = X.astype(np.float32).astype(dtype)
+    feature, threshold = model["feature"], model["threshold"]
+    left, right, default_left = model["left"], model["right"], model["default_left"]
+    missing = np.isnan(X).any()
+
+    # index of the first feature of every row in the flattened X
+    flat = X.ravel()
+    row_start = (np.arange(len(X)) * X.shape[1])[:, None]
+    node = np.repeat(model["roots"][None, :], len(X), axis=0)
+    for _ in range(model["max_depth"]):
+        x = flat[row_start + feature[node]]
+        go_left = x < threshold[node] if model["strict"] else x <= threshold[node]
+        if missing:
+            go_left = np.where(np.isnan(x), default_left[node], go_left)
+        node = np.where(go_left, left[node], right[node])
+
+    # trees are added one after the other, in order
+    leaves = model["value"][node]
+    if model["average"]:
+        return np.cumsum(leaves, axis=1)[:, -1] / leaves.shape[1]
+    leaves = np.concatenate([np.full((len(X), 1), model["base"], dtype=dtype), leaves], axis=1)
+    return np.cumsum(leaves, axis=1, dtype=dtype)[:, -1]
+
+
+def _svr_predict(model, X):
+    diff = X[:, None, :] - model["support_vectors"][None, :, :]
+    distance = np.cumsum(diff * diff, axis=2)[:, :, -1]
+    kernel = np.exp(-model["gamma"] * distance)
+    return np.cumsum(model["dual_coef"] * kernel, axis=1)[:, -1] + model["intercept"]
+
+
+def _linear_predict(model, X):
+    return X @ model["coef"] + model["intercept"]
+
+
+PREDICTORS = {"forest": _forest_predict, "svr": _svr_predict, "linear": _linear_predict}
+
+
+class CompiledModel:
+    """
+    Loads an artifact written by export and predicts like the AveragingModels it
+    came from (same scaler attribute and predict method), using only NumPy
+    """
+    def __init__(self, path):
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {key: data[key] for key in data.files}
+        meta = json.loads(str(arrays.pop("meta")))
+        self.source_sha256 = meta["source_sha256"]
+
+        self.scaler = None
+        if meta["scaler"] is not None:
+            self.scaler = CompiledScaler(
+                arrays["scaler_scale"], arrays["scaler_min"],
+                meta["scaler"]["clip"], meta["scaler"]["feature_range"],
+            )
+
+        self.models_ = []
+        for i, info in enumerate(meta["models"]):
+            model = dict(info)
+            prefix = f"{i}_"
+            model.update({key[len(prefix):]: value for key, value in arrays.items() if key.startswith(prefix)})
+            self.models_.append(model)
+
+    def is_compiled_from(self, source):
+        """
+        Whether the artifact was exported from this exact pickle
+        """
+        return self.source_sha256 == file_hash(source)
+
+    def _predict_model(self, model, X):
+        predict = PREDICTORS[model["kind"]]
+        return np.concatenate([predict(model, X[i:i + CHUNK_ROWS]) for i in range(0, max(len(X), 1), CHUNK_ROWS)])
+
+    def predict(self, X, executor=None):
+        X = np.asarray(X, dtype=np.float64)
+        if executor is None or len(self.models_) == 1:
+            predictions = [self._predict_model(model, X) for model in self.models_]
+        else:
+            predictions = list(executor.map(lambda model: self._predict_model(model, X), self.models_))
+        return np.mean(np.column_stack(predictions), axis=1)
+
+
+def load(path):
+    return CompiledModel(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a pickled AveragingModels into a NumPy only artifact")
+    parser.add_argument("model", type=str, nargs="?", default="models/averaged_models.pkl", help="Pickled AveragingModels")
+    parser.add_argument("--output", "-o", type=str, help="Output .npz (next to the model by default)")
+    args = parser.parse_args()
+
+    import scoring
+
+    output = args.output or scoring.compiled_path(args.model)
+    export(scoring.load_model(args.model, compiled=False), output, source=args.model)
+    print(f"Compiled {args.model} to {output}")
@@ -2,239 +2,195 @@ import pandas as pd
 import numpy as np
 import argparse
 import os
+import time
+from collections import defaultdict
+from functools import partial
 from multiprocessing import Pool
 from pathlib import Path
 
-def get_features(filepath):
-    """
-    Extract features from a CSV file containing music data.
-    """
-    # Load CSV file
-    df = pd.read_csv(filepath, low_memory=False)
-     
-    if 'tempo' not in df.columns:
-        print('file does not contain tempo column', filepath)
-        return None
-        
-    
-    df = df.sort_values(by="tick")
-    df["tempo"] = df["tempo"].ffill() # fill blank tempo values
-
-    tempo_deviation = df["tempo"].std()
-
-    average_tempo = df["tempo"].mean()
-    average_bpm = (60_000_000 / average_tempo)
+from mido import MidiFile
 
-    total_duration = df['time'].sum()
-    
-    unique_note_count = df['note'].nunique()
-
-    note_on_count = df[df['type'] == 'note_on'].shape[0]
-    
-    average_note_density = note_on_count
+import feature_cache
+import feature_engine
+import feature_writer
+import midi_features
+import profiling
+from tempo_map import DEFAULT_TICKS_PER_BEAT
 
-    # for each note_on, compare to the tick on the next row on how big the difference is between the two 
+MIDI_SUFFIXES = (".mid", ".midi")
 
-    tick_count = df['tick'].max()
+def get_features(source, names=None, ticks_per_beat=None, progress=None):
+    """
+    Extract features from a piece of music, the one implementation used by
+    the cli, the app and the scoring tools. source is the path of a CSV or
+    MIDI file, a mido MidiFile, a DataFrame of midi events (the CSV columns)
+    or event arrays from feature_engine. MIDI is read straight into the event
+    arrays its CSV would give, so a piece gets the same features whichever
+    way it comes in. 'file' is only included when source is a path.
+    names restricts the extraction to those features (all of them by default).
+    ticks_per_beat converts ticks to seconds for the sources that do not
+    record it (all but MIDI), DEFAULT_TICKS_PER_BEAT when not given.
+    progress is called with the number of messages read and the total while
+    a MIDI source is read.
+    """
+    if isinstance(source, MidiFile):
+        return _midi_features(source, names, progress)
+    if isinstance(source, pd.DataFrame):
+        # convert_midi_to_csv.mid_to_csv keeps the tick as the index
+        if 'tick' not in source.columns and source.index.name == 'tick':
+            source = source.reset_index()
+        return _event_features(feature_engine.events_from_dataframe(source), names, ticks_per_beat=ticks_per_beat)
+    if isinstance(source, dict):
+        return _event_features(source, names, ticks_per_beat=ticks_per_beat)
 
-    note_density = note_on_count / tick_count
+    filepath = source
+    if Path(filepath).suffix.lower() in MIDI_SUFFIXES:
+        with profiling.stage("load"):
+            mid = MidiFile(filepath)
+        return {
+          'file': Path(filepath).name,
+          **_midi_features(mid, names, progress),
+        }
 
-    # determine if the time signature has an odd numerator
-    if 'numerator' in df.columns:
-        odd_time_signature_count = df[(df['type'] == 'time_signature') & (df['numerator'] % 2 != 0)].shape[0]
-    else:
-        odd_time_signature_count = 0
-    
-    overlapping_notes = get_overlapping_notes(df)
+    # Load CSV file, only the columns used by the features
+    with profiling.stage("load"):
+        df = pd.read_csv(filepath, low_memory=False, usecols=lambda col: col in feature_engine.EVENT_COLUMNS)
+        events = feature_engine.events_from_dataframe(df)
 
-    chord_density = overlapping_notes / note_on_count
-    
-    duration_per_note = unique_note_count / total_duration
-    
-    tempo_complexity = tempo_deviation / average_tempo
-    
-    notes_per_second = note_on_count / (total_duration / 1000)
-    
-    pitch_range = df['note'].max() - df['note'].min()
-    
-    tempo_change_count = df[df['type'] == 'set_tempo'].shape[0]
-    
-    max_polyphony = df[df['type'] == 'note_on'].groupby('tick').size().max()
-    
-    note_transitions =  note_transition(df)
-    
-    average_polyphony = get_average_polyphony(df)
-    consecutive_notes_std = get_consecutive_note_std(df)
-    hand_independence_score = get_hand_independence_score(df)
-    
-    high_difficulty_df = pd.DataFrame({
-        'note_density': [note_density],
-        'tempo_change_count': [tempo_change_count],
-        'max_polyphony': [max_polyphony],
-        'pitch_range': [pitch_range],
-        'consecutive_note_std': [consecutive_notes_std],
-        'hand_independence': [hand_independence_score],
-        'note_to_chord_transition': [note_transitions[1]],
-        'chord_to_note_transition': [note_transitions[2]],
-        'average_polyphony': [average_polyphony]
-    })
-    
+    features = _event_features(events, names, filepath, ticks_per_beat)
+    if features is None:
+        return None
     return {
-      'file': str(filepath).split('\\')[1],
-      'average_tempo': average_tempo,
-      'average_bpm': average_bpm,
-      'note_count': note_on_count,
-      'tick_count': tick_count,
-      'note_density': note_density,
-      'tempo_deviation': tempo_deviation,
-      'unique_note_count': unique_note_count,
-      'total_duration': total_duration,
-      'overlapping_notes': overlapping_notes,
-      'chord_density': chord_density,
-      'duration_per_note': duration_per_note,
-      'tempo_complexity': tempo_complexity,
-      'notes_per_second': notes_per_second,
-      'hand_independence': hand_independence_score,
-      'odd_time_signature_count': odd_time_signature_count,
-      'consecutive_note_std': consecutive_notes_std,
-      'pitch_range': pitch_range,
-      'average_polyphony': average_polyphony,
-      'tempo_change_count': tempo_change_count,
-      'max_polyphony': max_polyphony,
-      'note_to_note_transition': note_transitions[0],
-      'note_to_chord_transition': note_transitions[1],
-      'chord_to_note_transition': note_transitions[2],
-      'chord_to_chord_transition': note_transitions[3],
-      'leap_frequency': get_leap_frequency(df),
+      'file': Path(filepath).name,
+      **features,
     }
-    
-    
-def get_leap_frequency(df):
-    leap_count = 0
-    note_count = len(df[df['type'] == 'note_on'])
-    for i in range(1, len(df)):
-        current_row = df.iloc[i-1]
-        next_row = df.iloc[i]
-        if abs(current_row['note'] - next_row['note']) > 12:
-            leap_count += 1
-    return leap_count / note_count
-    
 
-def get_overlapping_notes(df):
-    overlapping_notes = 0
-    for i in range(1, len(df)):
-        current_row = df.iloc[i-1]
-        next_row = df.iloc[i]
-        if current_row['type'] == 'note_on' and next_row['type'] == 'note_on':
-            if current_row['tick'] == next_row['tick'] and current_row['note'] != next_row['note']:
-                overlapping_notes += 1
-    return overlapping_notes
+def _midi_features(mid, names=None, progress=None):
+    with profiling.stage("load"):
+        events = midi_features.midi_events(mid, progress)
+    return _event_features(events, names, ticks_per_beat=mid.ticks_per_beat)
 
-def get_hand_independence_score(df):
-    df = df[df['type'] == 'note_on']
-    
-    grouped = df.groupby('tick')
+def _event_features(events, names=None, filepath=None, ticks_per_beat=None):
+    if 'tempo' not in events:
+        if filepath is not None:
+            print('file does not contain tempo column', filepath)
+        return None
 
-    independent_ticks = 0
-    for _, group in grouped:
-        if group['track'].nunique() > 1:
-            independent_ticks += 1
-    
-    total_ticks_with_notes = grouped.ngroups
-    
-    return independent_ticks / total_ticks_with_notes
-    
-def get_consecutive_note_std(df):
-    note_ons = df[df['type'] == 'note_on'].copy()
-    note_ons['tick_diff'] =  note_ons['tick'].diff()
-    
-    tick_diffs = note_ons['tick_diff'].dropna()
-    
-    return tick_diffs.std()
+    # the tempo is only forward filled when a feature needs it
+    events = feature_engine.sort_events(events, fill=False)
 
-def get_average_polyphony(df):
-    note_ons = df[df['type'] == 'note_on']
-    grouped = note_ons.groupby('tick').size()
-    return grouped.mean()
-    
-def process_directory(file_list):
-    """
-    Process all CSV files in the given directory and extract features.
-    """
-    print('getting files...')
-    files = list(file_list)
-    total_files = len(files)
-    results = []
-    print(f'found {total_files} files, processing...')
-    with Pool() as pool:
-        for i in range(0, total_files, 100):
-            chunk = files[i:i+100]
-            chunk_results = pool.map(get_features, chunk)
-            print(f"Processed {i} files of {total_files} files")
-            results.extend(chunk_results)
-    
-    #remove None values from results
-    return [result for result in results if result is not None]
+    with profiling.stage("features"):
+        return feature_engine.compute_features(events, names, ticks_per_beat or DEFAULT_TICKS_PER_BEAT)
 
-def get_files_in_directory(directory, recursive=False):
+def _batch_by_size(files, n_workers):
     """
-    Get all CSV files in the given directory
+    Split the files into tasks, largest files first so a huge sonata never starts
+    last, and small files grouped together so every task is roughly the same
+    amount of work.
     """
-    if recursive:
-        return Path(directory).rglob("*.csv")
-    else:
-        return Path(directory).glob("*.csv")
-    
-def note_transition(df):
-
+    sizes = {f: os.path.getsize(f) if os.path.exists(f) else 0 for f in files}
+    ordered = sorted(files, key=lambda f: sizes[f], reverse=True)
+    target = max(sum(sizes.values()) // (n_workers * 16), 1)
 
-    # Filter for "note_on" events with velocity > 0 (to exclude note_offs)
-    note_df = df[(df["type"] == "note_on") & (df["velocity"] > 0)]
+    batches = []
+    batch = []
+    batch_size = 0
+    for f in ordered:
+        batch.append(f)
+        batch_size += sizes[f]
+        if batch_size >= target:
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+    if batch:
+        batches.append(batch)
+    return batches
 
-    # Group by tick to find notes played simultaneously (i.e., chords)
-    grouped = note_df.groupby("tick")["note"].apply(list).reset_index()
 
+def _process_batch(extract, batch):
+    start = time.perf_counter()
+    results = []
+    for f in batch:
+        # one broken file should not take the whole batch down with it
+        try:
+            results.append((f, extract(f), None))
+        except Exception as e:
+            results.append((f, None, f"{type(e).__name__}: {e}"))
+    return os.getpid(), time.perf_counter() - start, results, profiling.collect()
 
-    # Helper functions
-    def get_type(notes):
-        return "chord" if len(notes) > 1 else "note"
-
-    def get_centroid(notes):
-        return sum(notes) / len(notes)
 
-    # Calculate weighted intervals between events
-    note_to_note = 0
-    note_to_chord = 0
-    chord_to_note = 0
-    chord_to_chord = 0
+def iter_features(file_list, cache_dir=None, rebuild=False, workers=None, names=None, ticks_per_beat=None):
+    """
+    Extract features from every file in parallel, yielding (file, features, error)
+    as soon as each task finishes. features is None for files that were skipped
+    or failed, error is the message of the exception for files that failed.
+    When cache_dir is given, files whose content has not changed since the
+    last run are read from the feature cache instead of being processed again.
+    names restricts the extraction to those features, ticks_per_beat is the
+    resolution of the CSV files (see get_features).
+    """
+    extract = partial(get_features, names=names, ticks_per_beat=ticks_per_beat)
+    if cache_dir is not None:
+        extract = feature_cache.FeatureCache(
+            cache_dir, get_features, rebuild=rebuild, names=names, ticks_per_beat=ticks_per_beat,
+        )
 
-    for i in range(len(grouped) - 1):
-        current_notes = grouped.iloc[i]["note"]
-        next_notes = grouped.iloc[i + 1]["note"]
+    files = list(file_list)
+    total_files = len(files)
+    workers = workers or os.cpu_count()
+    batches = _batch_by_size(files, workers)
 
-        current_type = get_type(current_notes)
-        next_type = get_type(next_notes)
+    busy = defaultdict(float)
+    files_done = defaultdict(int)
+    done = 0
+    start = time.perf_counter()
+    # workers record their own profile and send it back with every task
+    initializer = profiling.enable if profiling.is_enabled() else None
+    with Pool(workers, initializer=initializer) as pool:
+        # idle workers pick up the next task as soon as they finish one
+        for pid, elapsed, results, profile in pool.imap_unordered(partial(_process_batch, extract), batches):
+            profiling.merge(profile)
+            busy[pid] += elapsed
+            files_done[pid] += len(results)
+            for result in results:
+                yield result
+            if (done + len(results)) // 100 > done // 100 or done + len(results) == total_files:
+                print(f"Processed {done + len(results)} files of {total_files} files")
+            done += len(results)
+    wall = time.perf_counter() - start
 
-        current_centroid = get_centroid(current_notes)
-        next_centroid = get_centroid(next_notes)
+    print(f"{len(busy)} workers, {wall:.2f}s wall clock")
+    for pid in sorted(busy):
+        print(f"  worker {pid}: {files_done[pid]} files, {busy[pid]:.2f}s busy, {busy[pid] / wall:.0%} utilization")
 
-        interval = abs(next_centroid - current_centroid)
 
-        if current_type == "note":
-            if next_type == "note":
-                note_to_note += interval
-            else:
-                note_to_chord += interval
-        else:
-            if next_type == "note":
-                chord_to_note += interval
-            else:
-                chord_to_chord += interval
+def process_directory(file_list, cache_dir=None, rebuild=False, names=None, ticks_per_beat=None):
+    """
+    Process all CSV files in the given directory and extract features.
+    """
+    print('getting files...')
+    files = list(file_list)
+    print(f'found {len(files)} files, processing...')
 
+    position = {f: i for i, f in reversed(list(enumerate(files)))}
+    results = sorted(iter_features(files, cache_dir, rebuild, names=names, ticks_per_beat=ticks_per_beat), key=lambda result: position[result[0]])
 
-    return note_to_note, note_to_chord, chord_to_note, chord_to_chord
+    for filepath, _, error in results:
+        if error is not None:
+            print(f"Error processing {filepath}: {error}")
 
+    #remove None values from results
+    return [features for _, features, _ in results if features is not None]
 
+def get_files_in_directory(directory, recursive=False, pattern="*.csv"):
+    """
+    Get all CSV files (or files matching pattern) in the given directory
+    """
+    if recursive:
+        return Path(directory).rglob(pattern)
+    else:
+        return Path(directory).glob(pattern)
+    
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Extract features from CSV files present in a directory")
     parser.add_argument("directory", type=str, help="Directory containing CSV files")
@@ -251,27 +207,91 @@ if __name__ == "__main__":
         action='store_true',
         help="Whether to search recursively in subdirectories"
     )
+    parser.add_argument(
+        "--midi",
+        action='store_true',
+        help="Process the MIDI files in the directory instead of CSV files"
+    )
     parser.add_argument(
         "--filepath",
         type=str,
         help="Path to a file that lists CSV files to process",
     )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default="data/feature_cache",
+        help="Directory of the feature cache",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action='store_true',
+        help="Do not read or write the feature cache"
+    )
+    parser.add_argument(
+        "--rebuild",
+        action='store_true',
+        help="Recompute the features of every file and overwrite the cache"
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        nargs="?",
+        const="data/profile.csv",
+        help="Record time and peak memory of every stage and feature function, "
+             "written to the given .csv or .json file (data/profile.csv by default)"
+    )
+    parser.add_argument(
+        "--features",
+        type=str,
+        help="Comma separated list of the features to extract (all of them by default), "
+             "only what those features depend on is computed"
+    )
+    parser.add_argument(
+        "--ticks-per-beat",
+        type=int,
+        help=f"Resolution of the midi files the CSVs were made from ({DEFAULT_TICKS_PER_BEAT} by default), "
+             "MIDI files record their own"
+    )
+    parser.add_argument(
+        "--restart",
+        action='store_true',
+        help="Ignore the checkpoint of a previous run and write the output from scratch"
+    )
     args = parser.parse_args()
-    features = []
     if args.filepath:
         with open(args.filepath, 'r', encoding="utf-8") as f:
             file_list = [os.path.join(args.directory, line.strip()) for line in f.readlines()]
     else:
-        file_list = list(get_files_in_directory(args.directory, args.recursive))
+        pattern = "*.mid" if args.midi else "*.csv"
+        file_list = list(get_files_in_directory(args.directory, args.recursive, pattern))
     
-    try:
-        features = process_directory(file_list)
-    except Exception as e:
-        print(f"Error processing files: {e}")
-    finally:
-        if features:
-            df = pd.DataFrame(features)
-            df.to_csv(f"{args.output}", index=False)
-        else:
-            print("No features found")
-            
+    names = None
+    if args.features:
+        names = [name.strip() for name in args.features.split(",")]
+        feature_engine.dependencies(names)
+
+    if args.profile:
+        profiling.enable()
+
+    cache_dir = None if args.no_cache else args.cache_dir
+    with feature_writer.FeatureWriter(args.output, restart=args.restart) as writer:
+        remaining = [f for f in file_list if str(f) not in writer.completed]
+        if len(remaining) < len(file_list):
+            print(f"resuming, {len(file_list) - len(remaining)} files already done")
+
+        print(f'found {len(remaining)} files, processing...')
+        for filepath, features, error in iter_features(remaining, cache_dir, args.rebuild, names=names, ticks_per_beat=args.ticks_per_beat):
+            if error is not None:
+                print(f"Error processing {filepath}: {error}")
+                writer.log_error(filepath, error)
+            else:
+                writer.write(filepath, features)
+
+    if writer.errors:
+        print(f"{writer.errors} files failed, see {writer.error_path}")
+    if not writer.written and not writer.has_header:
+        print("No features found")
+    if args.profile:
+        profiling.write_report(args.profile)
+        print(f"Profile written to {args.profile}")
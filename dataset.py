@@ -0,0 +1,142 @@
+import argparse
+import os
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+FEATURES_PATH = "data/features.csv"
+LABELS_PATH = "data/difficulty.csv"
+DATASET_PATH = "data/training.npz"
+
+EXTENSIONS = (".csv", ".mid", ".midi")
+# encodings utf-8 file names were wrongly decoded with, "Albéniz" read as cp437 is "Alb├⌐niz"
+MOJIBAKE_ENCODINGS = ("cp437", "cp1252")
+
+
+def normalize_key(name):
+    """
+    Key a piece is matched on: the file name with mojibake repaired, without
+    its extension, accents or extra whitespace, case folded
+    """
+    name = str(name).strip()
+    for encoding in MOJIBAKE_ENCODINGS:
+        try:
+            repaired = name.encode(encoding).decode("utf-8")
+        except UnicodeError:
+            continue
+        if repaired != name:
+            name = repaired
+            break
+    stem, extension = os.path.splitext(name)
+    if extension.lower() in EXTENSIONS:
+        name = stem
+    name = "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c))
+    return " ".join(name.split()).casefold()
+
+
+def _keys(files):
+    # every distinct name is normalized once
+    unique = pd.unique(files)
+    return pd.Index(files.map(dict(zip(unique, map(normalize_key, unique)))), name="key")
+
+
+def build_dataset(features, labels, segments=None):
+    """
+    Join a features table (csv_processing output) and a labels table (file,
+    difficulty) on normalized file names, and the windowed features of
+    segment_features.py when segments is given. A piece with several labels
+    keeps the last one, like a piece extracted twice keeps its last features.
+    Returns the training table (file, difficulty and the features, one row
+    per piece) and a report of the rows left out (source, file, reason).
+    """
+    features = features.set_axis(_keys(features['file']))
+    labels = labels.set_axis(_keys(labels['file']))
+    labels = labels.assign(difficulty=pd.to_numeric(labels['difficulty'], errors="coerce"))
+
+    report = []
+
+    def leave_out(source, rows, reason):
+        report.append(pd.DataFrame({'source': source, 'file': rows['file'].to_numpy(), 'reason': reason}))
+
+    leave_out("labels", labels[labels['difficulty'].isna()], "no difficulty")
+    labels = labels[labels['difficulty'].notna()]
+
+    repeated = labels.index.duplicated(keep="last")
+    last = labels[~repeated]['difficulty']
+    conflicting = repeated & (labels['difficulty'].to_numpy() != last.reindex(labels.index).to_numpy())
+    leave_out("labels", labels[conflicting], "conflicting label, the last one is kept")
+    leave_out("labels", labels[repeated & ~conflicting], "duplicate label")
+    labels = labels[~repeated]
+
+    repeated = features.index.duplicated(keep="last")
+    leave_out("features", features[repeated], "duplicate features, the last ones are kept")
+    features = features[~repeated]
+
+    leave_out("labels", labels[~labels.index.isin(features.index)], "no features")
+    leave_out("features", features[~features.index.isin(labels.index)], "no label")
+
+    if segments is not None:
+        segments = segments.set_axis(_keys(segments['file']))
+        segments = segments[~segments.index.duplicated(keep="last")].drop(columns=['file'])
+        labeled = features[features.index.isin(labels.index)]
+        leave_out("features", labeled[~labeled.index.isin(segments.index)], "no segment features")
+        features = features.join(segments, how="inner")
+
+    table = labels[['difficulty']].join(features, how="inner")
+    table = table[['file', 'difficulty', *table.columns.drop(['file', 'difficulty'])]].reset_index(drop=True)
+    return table, pd.concat(report, ignore_index=True)
+
+
+def save_dataset(table, path=DATASET_PATH):
+    """
+    Write the table as a few typed arrays: the numeric columns of each dtype
+    in one 2D block, text as fixed width unicode so it loads without pickle
+    """
+    arrays = {"columns": np.array(table.columns, dtype=str)}
+    for dtype, columns in table.columns.groupby(table.dtypes).items():
+        if dtype == object:
+            for column in columns:
+                arrays[f"text_{column}"] = table[column].to_numpy(dtype=str)
+        else:
+            arrays[f"block_{dtype}"] = table[columns].to_numpy()
+            arrays[f"names_{dtype}"] = np.array(columns, dtype=str)
+    np.savez(path, **arrays)
+
+
+def load_dataset(path=DATASET_PATH):
+    """
+    The training table written by save_dataset as a DataFrame
+    """
+    with np.load(path, allow_pickle=False) as data:
+        columns = {}
+        for key in data.files:
+            if key.startswith("text_"):
+                columns[key[len("text_"):]] = data[key]
+            elif key.startswith("block_"):
+                block = data[key]
+                names = data["names_" + key[len("block_"):]]
+                columns.update({name: block[:, i] for i, name in enumerate(names)})
+        return pd.DataFrame(columns, columns=data["columns"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the labeled training table from features and difficulties")
+    parser.add_argument("--features", type=str, default=FEATURES_PATH, help="CSV of features made by csv_processing.py")
+    parser.add_argument("--labels", type=str, default=LABELS_PATH, help="CSV of file,difficulty")
+    parser.add_argument("--segments", type=str, help="CSV of windowed features made by segment_features.py")
+    parser.add_argument("--output", "-o", type=str, default=DATASET_PATH, help="Training table (.npz)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    segments = pd.read_csv(args.segments) if args.segments else None
+    table, report = build_dataset(pd.read_csv(args.features), pd.read_csv(args.labels, skipinitialspace=True), segments)
+    save_dataset(table, args.output)
+    report_path = f"{args.output}.unmatched.csv"
+    report.to_csv(report_path, index=False)
+    print(f"Wrote {len(table)} labeled pieces to {args.output} in {time.perf_counter() - start:.2f}s")
+    for (source, reason), rows in report.groupby(['source', 'reason'], sort=False):
+        print(f"  {len(rows)} {source} rows left out: {reason}")
+    if len(report):
+        print(f"see {report_path}")
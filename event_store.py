@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+from functools import partial
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from mido import MidiFile
+
+import csv_processing
+import feature_engine
+import midi_features
+from tempo_map import DEFAULT_TICKS_PER_BEAT
+
+# dtype of every column in the store, integer columns use -1 for blanks
+STORE_COLUMNS = {
+    "tick": np.int32,
+    "type": np.int8,
+    "time": np.int32,
+    "track": np.int16,
+    "note": np.int8,
+    "velocity": np.int8,
+    "tempo": np.int32,
+    "numerator": np.int8,
+}
+
+MANIFEST = "manifest.json"
+
+
+def _read_csv_events(filepath):
+    df = pd.read_csv(filepath, low_memory=False, usecols=lambda col: col in feature_engine.EVENT_COLUMNS)
+    if 'tempo' not in df.columns:
+        print('file does not contain tempo column', filepath)
+        return None
+    return feature_engine.events_from_dataframe(df)
+
+
+def read_events(filepath, ticks_per_beat=None):
+    """
+    Read a CSV or MIDI file into sorted events with the store's dtypes.
+    Returns (file name, columns, ticks per beat), MIDI files record their
+    own resolution, ticks_per_beat (DEFAULT_TICKS_PER_BEAT when not given)
+    is used for CSVs.
+    """
+    ticks_per_beat = ticks_per_beat or DEFAULT_TICKS_PER_BEAT
+    if Path(filepath).suffix.lower() in csv_processing.MIDI_SUFFIXES:
+        mid = MidiFile(filepath)
+        ticks_per_beat = mid.ticks_per_beat
+        events = midi_features.midi_events(mid)
+    else:
+        events = _read_csv_events(filepath)
+        if events is None:
+            return None
+    # sorted like csv_processing.get_features sorts them, for the same features
+    events = feature_engine.sort_events(events)
+
+    columns = {}
+    for col, dtype in STORE_COLUMNS.items():
+        if col not in events:
+            columns[col] = np.full(len(events["tick"]), -1, dtype=dtype)
+            continue
+        values = events[col]
+        if values.dtype.kind == "f":
+            values = np.where(np.isnan(values), -1, values)
+        columns[col] = values.astype(dtype)
+    return Path(filepath).name, columns, ticks_per_beat
+
+
+def ingest(file_list, directory, ticks_per_beat=None):
+    """
+    Convert CSV/MIDI files into an event store: one raw binary file per column
+    with all the pieces back to back, and a manifest with each piece's offset
+    and ticks per beat (ticks_per_beat for CSVs, see read_events).
+    """
+    files = list(file_list)
+    os.makedirs(directory, exist_ok=True)
+    outputs = {col: open(os.path.join(directory, f"{col}.bin"), "wb") for col in STORE_COLUMNS}
+    names = []
+    offsets = [0]
+    resolutions = []
+    print(f'found {len(files)} files, ingesting...')
+    try:
+        with Pool() as pool:
+            read = partial(read_events, ticks_per_beat=ticks_per_beat)
+            for i, result in enumerate(pool.imap(read, files, chunksize=8)):
+                if result is None:
+                    continue
+                name, columns, resolution = result
+                for col, values in columns.items():
+                    outputs[col].write(values.tobytes())
+                names.append(name)
+                resolutions.append(resolution)
+                offsets.append(offsets[-1] + len(columns["tick"]))
+                if (i + 1) % 100 == 0:
+                    print(f"Ingested {i + 1} files of {len(files)} files")
+    finally:
+        for output in outputs.values():
+            output.close()
+
+    manifest = {
+        "columns": {col: np.dtype(dtype).name for col, dtype in STORE_COLUMNS.items()},
+        "files": names,
+        "offsets": offsets,
+        "ticks_per_beat": resolutions,
+    }
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    print(f"Stored {offsets[-1]} events from {len(names)} files in {directory}")
+
+
+class EventStore:
+    """
+    Read only view of an event store, the columns are memory mapped so events
+    for a piece are slices of the files on disk and nothing is parsed or copied.
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.files = manifest["files"]
+        self.offsets = manifest["offsets"]
+        # stores written before the resolution was recorded
+        self.ticks_per_beat = manifest.get("ticks_per_beat", [DEFAULT_TICKS_PER_BEAT] * len(self.files))
+        self.index = {name: i for i, name in enumerate(self.files)}
+        self.columns = {
+            col: np.memmap(os.path.join(directory, f"{col}.bin"), dtype=dtype, mode="r")
+            if self.offsets[-1] > 0 else np.zeros(0, dtype=dtype)
+            for col, dtype in manifest["columns"].items()
+        }
+
+    def __len__(self):
+        return len(self.files)
+
+    def events(self, piece):
+        """
+        Sorted events of a piece, by file name or position in the store
+        """
+        i = self.index[piece] if isinstance(piece, str) else piece
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return {col: values[start:stop] for col, values in self.columns.items()}
+
+    def __iter__(self):
+        for i, name in enumerate(self.files):
+            yield name, self.events(i)
+
+
+def get_stored_features(store, piece):
+    """
+    Same output as csv_processing.get_features, computed from the store
+    """
+    i = store.index[piece] if isinstance(piece, str) else piece
+    return {
+      'file': store.files[i],
+      **feature_engine.compute_features(store.events(i), ticks_per_beat=store.ticks_per_beat[i]),
+    }
+
+
+_store = None
+
+
+def _init_worker(directory):
+    global _store
+    _store = EventStore(directory)
+
+
+def _worker_features(i):
+    return get_stored_features(_store, i)
+
+
+def process_store(directory):
+    """
+    Extract features for every piece in the store
+    """
+    n_files = len(EventStore(directory))
+    print(f'found {n_files} files in the store, processing...')
+    with Pool(initializer=_init_worker, initargs=(directory,)) as pool:
+        return pool.map(_worker_features, range(n_files), chunksize=32)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store CSV/MIDI files as memory mapped columns and extract features from them")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Convert the CSV/MIDI files of a directory into an event store")
+    ingest_parser.add_argument("directory", type=str, help="Directory containing CSV or MIDI files")
+    ingest_parser.add_argument("--output", "-o", type=str, default="data/events", help="Directory of the event store")
+    ingest_parser.add_argument("--recursive", "-r", action='store_true', help="Whether to search recursively in subdirectories")
+    ingest_parser.add_argument("--midi", action='store_true', help="Ingest the MIDI files in the directory instead of CSV files")
+    ingest_parser.add_argument("--filepath", type=str, help="Path to a file that lists the files to ingest")
+    ingest_parser.add_argument("--ticks-per-beat", type=int,
+                               help=f"Resolution of the midi files the CSVs were made from ({DEFAULT_TICKS_PER_BEAT} by default), "
+                                    "MIDI files record their own")
+
+    features_parser = subparsers.add_parser("features", help="Extract features from an event store")
+    features_parser.add_argument("store", type=str, help="Directory of the event store")
+    features_parser.add_argument("--output", "-o", type=str, default="data/features.csv", help="Output CSV file for features")
+
+    args = parser.parse_args()
+    if args.command == "ingest":
+        if args.filepath:
+            with open(args.filepath, 'r', encoding="utf-8") as f:
+                file_list = [os.path.join(args.directory, line.strip()) for line in f.readlines()]
+        else:
+            pattern = "*.mid" if args.midi else "*.csv"
+            file_list = list(csv_processing.get_files_in_directory(args.directory, args.recursive, pattern))
+        ingest(file_list, args.output, args.ticks_per_beat)
+    else:
+        features = process_store(args.store)
+        if features:
+            pd.DataFrame(features).to_csv(args.output, index=False)
+        else:
+            print("No features found")
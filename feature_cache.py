@@ -0,0 +1,107 @@
+import hashlib
+import inspect
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+import feature_engine
+import midi_features
+import tempo_map
+
+# modules whose code decides the feature values, editing any of them invalidates the cache
+FEATURE_MODULES = [feature_engine, midi_features, tempo_map]
+
+
+def extractor_version(func, names=None, ticks_per_beat=None):
+    """
+    Hash of the feature extraction code, changes whenever a feature function is
+    edited. The whole module of func is hashed with FEATURE_MODULES, not only
+    func, since the helpers it calls (sorting the events, reading the tempo)
+    decide the values too. Extracting a subset of the features, or with another
+    resolution for the CSV files, gets its own version.
+    """
+    digest = hashlib.sha256()
+    for module in FEATURE_MODULES:
+        digest.update(inspect.getsource(module).encode())
+    digest.update(inspect.getsource(inspect.getmodule(func)).encode())
+    if names is not None:
+        digest.update(",".join(names).encode())
+    if ticks_per_beat is not None:
+        digest.update(f"ticks_per_beat={ticks_per_beat}".encode())
+    return digest.hexdigest()[:16]
+
+
+def file_hash(filepath):
+    """
+    Hash of the content of a file
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _to_json(value):
+    # numpy scalars coming out of the feature functions
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value)} is not JSON serializable")
+
+
+class FeatureCache:
+    """
+    On disk cache of the features of a file, keyed by the file's content and the
+    version of the feature code. Wraps a get_features like function and can be
+    passed to Pool.map in its place, names and ticks_per_beat are passed on to func.
+    """
+    def __init__(self, directory, func, rebuild=False, names=None, ticks_per_beat=None):
+        self.func = func
+        self.rebuild = rebuild
+        self.names = names
+        self.ticks_per_beat = ticks_per_beat
+        self.version = extractor_version(func, names, ticks_per_beat)
+        self.directory = os.path.join(directory, self.version)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _entry(self, content_hash):
+        return os.path.join(self.directory, f"{content_hash}.json")
+
+    def get(self, content_hash):
+        """
+        Cached features, or None when the file has not been processed with this version
+        """
+        try:
+            with open(self._entry(content_hash), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, content_hash, features):
+        entry = self._entry(content_hash)
+        # write to a temporary file first so other workers never read half an entry
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"features": features}, f, default=_to_json)
+        os.replace(tmp, entry)
+
+    def __call__(self, filepath):
+        content_hash = file_hash(filepath)
+        cached = None if self.rebuild else self.get(content_hash)
+        if cached is not None:
+            features = cached["features"]
+        else:
+            features = self.func(filepath, names=self.names, ticks_per_beat=self.ticks_per_beat)
+            if features is not None:
+                # the same content can live under several names
+                features = {k: v for k, v in features.items() if k != 'file'}
+            self.put(content_hash, features)
+
+        if features is None:
+            return None
+        return {
+          'file': Path(filepath).name,
+          **features,
+        }
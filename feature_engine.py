@@ -0,0 +1,545 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype
+
+import profiling
+from tempo_map import DEFAULT_TICKS_PER_BEAT, TempoMap
+
+# integer codes for the event types the features care about, everything else is 0
+OTHER = 0
+NOTE_ON = 1
+NOTE_OFF = 2
+SET_TEMPO = 3
+TIME_SIGNATURE = 4
+
+TYPE_CODES = {
+    "note_on": NOTE_ON,
+    "note_off": NOTE_OFF,
+    "set_tempo": SET_TEMPO,
+    "time_signature": TIME_SIGNATURE,
+}
+
+# columns of the midi csv that are needed to compute the features
+EVENT_COLUMNS = ["tick", "type", "time", "track", "note", "velocity", "tempo", "numerator"]
+
+
+def encode_types(types):
+    """
+    Convert an array of event type names into the integer codes above.
+    """
+    if isinstance(types, pd.Categorical):
+        # only the categories need looking up, the codes index into them
+        lookup = np.array([TYPE_CODES.get(name, OTHER) for name in types.categories], dtype=np.int8)
+        return lookup[types.codes]
+    types = np.asarray(types)
+    codes = np.zeros(len(types), dtype=np.int8)
+    for name, code in TYPE_CODES.items():
+        codes[types == name] = code
+    return codes
+
+
+def _column(series):
+    """
+    Get a column as a numpy array, integers stay integers if nothing is missing,
+    otherwise everything becomes float64 with NaN for blanks.
+    """
+    if is_integer_dtype(series.dtype) and not series.hasnans:
+        return series.to_numpy(dtype=np.int64)
+    return series.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def events_from_dataframe(df, columns=EVENT_COLUMNS):
+    """
+    Build the event arrays used by the feature engine from a midi csv dataframe.
+    """
+    events = {}
+    for col in columns:
+        if col not in df.columns:
+            continue
+        if col == "type":
+            events[col] = encode_types(df[col].array)
+        else:
+            events[col] = _column(df[col])
+    return events
+
+
+def sort_events(events, fill=True):
+    """
+    Sort the events by tick and forward fill the tempo, same as
+    df.sort_values(by="tick") followed by df["tempo"].ffill()
+    compute_features fills the tempo itself when a feature needs it, fill=False skips it here.
+    """
+    with profiling.stage("sort"):
+        # same (unstable) quicksort pandas uses so rows sharing a tick keep the same order
+        order = np.argsort(events["tick"], kind="quicksort")
+        events = {col: values[order] for col, values in events.items()}
+    return fill_tempo(events) if fill else events
+
+
+def fill_tempo(events):
+    """
+    Forward fill the tempo of events that are already in tick order
+    """
+    if "tempo" in events:
+        with profiling.stage("ffill"):
+            events = {**events, "tempo": _filled(events["tempo"])}
+    return events
+
+
+def _missing(values):
+    """
+    Mask of blank values, NaN in float columns and negative numbers in
+    integer columns (the event store uses -1 for blanks)
+    """
+    if values.dtype.kind == "f":
+        return np.isnan(values)
+    return values < 0
+
+
+def _filled(tempo):
+    """
+    Forward filled float64 copy of a tempo column, blanks (NaN, or -1 from
+    the event store) are filled from the tempo before them
+    """
+    values = tempo.astype(np.float64)
+    values[_missing(tempo)] = np.nan
+    return _ffill(values)
+
+
+def _ffill(values):
+    valid = ~np.isnan(values)
+    idx = np.where(valid, np.arange(len(values)), 0)
+    np.maximum.accumulate(idx, out=idx)
+    return values[idx]
+
+
+def _nansum(values):
+    if values.dtype.kind == "f":
+        values = np.where(np.isnan(values), 0.0, values)
+    return values.sum()
+
+
+def _nanmean(values):
+    """
+    Mean skipping NaN, summed the same way pandas does so the result is identical
+    """
+    mask = _missing(values)
+    values = values.astype(np.float64, copy=False)
+    count = float(values.size - mask.sum())
+    if count == 0:
+        return np.nan
+    return np.where(mask, 0.0, values).sum() / count
+
+
+def _nanstd(values, ddof=1):
+    """
+    Sample standard deviation skipping NaN, two pass like pandas
+    """
+    mask = _missing(values)
+    values = values.astype(np.float64, copy=False)
+    count = float(values.size - mask.sum())
+    if count <= ddof:
+        return np.nan
+    values = np.where(mask, 0.0, values)
+    avg = values.sum() / count
+    sqr = (avg - values) ** 2
+    sqr[mask] = 0
+    return np.sqrt(sqr.sum() / (count - ddof))
+
+
+def _sequential_sum(values):
+    # cumsum adds left to right, like the += loop it replaces
+    if len(values) == 0:
+        return 0
+    return np.cumsum(values)[-1]
+
+
+def _group_starts(ticks):
+    """
+    Offsets where a new tick starts in a sorted array of ticks
+    """
+    if len(ticks) == 0:
+        return np.zeros(0, dtype=np.intp)
+    return np.flatnonzero(np.concatenate(([True], ticks[1:] != ticks[:-1])))
+
+
+def _group_sizes(starts, total):
+    return np.diff(np.append(starts, total))
+
+
+class OnsetIndex:
+    """
+    The note_on events of a piece grouped by tick. Built once per piece and
+    shared by the polyphony, hand independence and note/chord transition
+    features instead of each of them filtering and grouping the events again.
+    The events of group i are [starts[i], starts[i] + sizes[i]) of the arrays.
+    """
+    def __init__(self, ticks, notes, tracks=None, sounding_mask=None):
+        self.ticks = ticks
+        self.notes = notes
+        self.tracks = tracks
+        # velocity > 0, note_offs written as note_on with velocity 0 are not sounding
+        self.sounding_mask = sounding_mask
+        self.starts = _group_starts(ticks)
+        self.sizes = _group_sizes(self.starts, len(ticks))
+
+    @classmethod
+    def from_events(cls, events, is_note_on):
+        return cls(
+            events["tick"][is_note_on],
+            events["note"][is_note_on].astype(np.float64),
+            # track numbers are small, like in the event store
+            events["track"][is_note_on].astype(np.int16),
+            events["velocity"][is_note_on] > 0,
+        )
+
+    def __len__(self):
+        return len(self.ticks)
+
+    @property
+    def group_count(self):
+        return len(self.starts)
+
+    def sounding(self):
+        """
+        Index of the sounding note_on events only, without tracks
+        """
+        # most files end their notes with note_off, nothing to filter then
+        if self.sounding_mask.all():
+            return self
+        return OnsetIndex(self.ticks[self.sounding_mask], self.notes[self.sounding_mask])
+
+
+# name -> (function, names of the values it is computed from)
+FEATURE_REGISTRY = {}
+
+# every feature of csv_processing.get_features, in output order. total_duration
+# sums the tick deltas of the events and average_tempo averages the forward
+# filled tempo of every event, the model was trained on them as they are. The
+# timed_ and weighted_ features convert ticks to seconds with the tempo map.
+FEATURE_NAMES = [
+    'average_tempo', 'average_bpm', 'note_count', 'tick_count', 'note_density',
+    'tempo_deviation', 'unique_note_count', 'total_duration', 'overlapping_notes',
+    'chord_density', 'duration_per_note', 'tempo_complexity', 'notes_per_second',
+    'hand_independence', 'odd_time_signature_count', 'consecutive_note_std',
+    'pitch_range', 'average_polyphony', 'tempo_change_count', 'max_polyphony',
+    'note_to_note_transition', 'note_to_chord_transition', 'chord_to_note_transition',
+    'chord_to_chord_transition', 'leap_frequency',
+    'duration_seconds', 'timed_notes_per_second', 'timed_duration_per_note',
+    'weighted_average_tempo', 'weighted_average_bpm', 'weighted_tempo_deviation',
+    'weighted_tempo_complexity', 'timed_consecutive_note_std',
+]
+
+# values compute_features is given rather than computes
+INPUTS = ("events", "ticks_per_beat")
+
+
+def register(name, *requires):
+    """
+    Register a feature (or an intermediate value shared by features) computed
+    from the values named in requires. "events" is the sorted event arrays
+    and "ticks_per_beat" the resolution of the piece.
+    """
+    def decorator(func):
+        FEATURE_REGISTRY[name] = (func, requires)
+        return func
+    return decorator
+
+
+def dependencies(names):
+    """
+    Every registered value needed to compute the given features
+    """
+    needed = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name in needed or name in INPUTS:
+            continue
+        if name not in FEATURE_REGISTRY:
+            raise ValueError(f"unknown feature {name}")
+        needed.add(name)
+        pending.extend(FEATURE_REGISTRY[name][1])
+    return needed
+
+
+def _resolve(name, values):
+    if name not in values:
+        if name not in FEATURE_REGISTRY:
+            raise ValueError(f"unknown feature {name}")
+        func, requires = FEATURE_REGISTRY[name]
+        values[name] = func(*[_resolve(dep, values) for dep in requires])
+    return values[name]
+
+
+# shared intermediates
+
+@register("is_note_on", "events")
+def _is_note_on(events):
+    return events["type"] == NOTE_ON
+
+
+@register("notes_played", "events")
+def _notes_played(events):
+    note = events["note"]
+    return note[~_missing(note)].astype(np.float64)
+
+
+@register("onsets", "events", "is_note_on")
+def _onsets(events, is_note_on):
+    with profiling.stage("onset_index"):
+        return OnsetIndex.from_events(events, is_note_on)
+
+
+@register("sounding_onsets", "onsets")
+def _sounding_onsets(onsets):
+    return onsets.sounding()
+
+
+@register("filled_tempo", "events")
+def _filled_tempo(events):
+    # only the tempo statistics need the tempo of every event
+    with profiling.stage("ffill"):
+        return _filled(events["tempo"])
+
+
+@register("tempo_map", "events", "ticks_per_beat")
+def _tempo_map(events, ticks_per_beat):
+    with profiling.stage("tempo_map"):
+        is_tempo = events["type"] == SET_TEMPO
+        return TempoMap.from_changes(events["tick"][is_tempo], events["tempo"][is_tempo], ticks_per_beat)
+
+
+@register("weighted_tempo", "tempo_map", "tick_count")
+def _weighted_tempo(tempo_map, tick_count):
+    return tempo_map.tempo_stats(int(tick_count))
+
+
+# features
+
+@register("average_tempo", "filled_tempo")
+def _average_tempo(filled_tempo):
+    return _nanmean(filled_tempo)
+
+
+@register("average_bpm", "average_tempo")
+def _average_bpm(average_tempo):
+    return (60_000_000 / average_tempo)
+
+
+@register("tempo_deviation", "filled_tempo")
+def _tempo_deviation(filled_tempo):
+    return _nanstd(filled_tempo)
+
+
+@register("tempo_complexity", "tempo_deviation", "average_tempo")
+def _tempo_complexity(tempo_deviation, average_tempo):
+    return tempo_deviation / average_tempo
+
+
+@register("tempo_change_count", "events")
+def _tempo_change_count(events):
+    return int(np.count_nonzero(events["type"] == SET_TEMPO))
+
+
+@register("total_duration", "events")
+def _total_duration(events):
+    return _nansum(events["time"])
+
+
+@register("note_count", "is_note_on")
+def _note_count(is_note_on):
+    return int(np.count_nonzero(is_note_on))
+
+
+@register("tick_count", "events")
+def _tick_count(events):
+    return events["tick"].max()
+
+
+@register("note_density", "note_count", "tick_count")
+def _note_density(note_count, tick_count):
+    return note_count / tick_count
+
+
+@register("notes_per_second", "note_count", "total_duration")
+def _notes_per_second(note_count, total_duration):
+    return note_count / (total_duration / 1000)
+
+
+@register("unique_note_count", "notes_played")
+def _unique_note_count(notes_played):
+    return len(np.unique(notes_played))
+
+
+@register("duration_per_note", "unique_note_count", "total_duration")
+def _duration_per_note(unique_note_count, total_duration):
+    return unique_note_count / total_duration
+
+
+@register("pitch_range", "notes_played")
+def _pitch_range(notes_played):
+    return notes_played.max() - notes_played.min() if len(notes_played) else np.nan
+
+
+@register("odd_time_signature_count", "events")
+def _odd_time_signature_count(events):
+    # determine if the time signature has an odd numerator
+    if "numerator" not in events:
+        return 0
+    return int(np.count_nonzero(
+        (events["type"] == TIME_SIGNATURE) & (events["numerator"] % 2 != 0)
+    ))
+
+
+@register("leap_frequency", "events", "note_count")
+@profiling.profiled
+def get_leap_frequency(events, note_count):
+    """
+    Fraction of consecutive events that jump more than an octave, relative to the note count
+    """
+    note = events["note"]
+    has_note = ~_missing(note)
+    leaps = np.abs(np.diff(note.astype(np.float64))) > 12
+    leap_count = np.count_nonzero(leaps & has_note[1:] & has_note[:-1])
+    return leap_count / note_count
+
+
+@register("overlapping_notes", "events", "is_note_on")
+@profiling.profiled
+def get_overlapping_notes(events, is_note_on):
+    """
+    Count consecutive note_on events that start on the same tick with a different note
+    """
+    tick = events["tick"]
+    note = events["note"]
+    overlapping = (
+        is_note_on[:-1] & is_note_on[1:]
+        & (tick[:-1] == tick[1:])
+        & (note[:-1] != note[1:])
+    )
+    return int(np.count_nonzero(overlapping))
+
+
+@register("chord_density", "overlapping_notes", "note_count")
+def _chord_density(overlapping_notes, note_count):
+    return overlapping_notes / note_count
+
+
+@register("hand_independence", "onsets")
+@profiling.profiled
+def get_hand_independence_score(onsets):
+    """
+    Fraction of note_on ticks where more than one track plays
+    """
+    independent_ticks = np.count_nonzero(
+        np.minimum.reduceat(onsets.tracks, onsets.starts) != np.maximum.reduceat(onsets.tracks, onsets.starts)
+    )
+    return int(independent_ticks) / onsets.group_count
+
+
+@register("consecutive_note_std", "onsets")
+@profiling.profiled
+def get_consecutive_note_std(onsets):
+    """
+    Standard deviation of the tick difference between consecutive note_on events
+    """
+    return _nanstd(np.diff(onsets.ticks).astype(np.float64))
+
+
+@register("average_polyphony", "onsets")
+@profiling.profiled
+def get_average_polyphony(onsets):
+    """
+    Average number of note_on events per tick that has any
+    """
+    return len(onsets) / onsets.group_count
+
+
+@register("max_polyphony", "onsets")
+@profiling.profiled
+def get_max_polyphony(onsets):
+    if onsets.group_count == 0:
+        return np.nan
+    return onsets.sizes.max()
+
+
+@register("note_transitions", "sounding_onsets")
+@profiling.profiled
+def note_transition(sounding):
+    """
+    Sum of the pitch distance between consecutive notes/chords, split by
+    note to note, note to chord, chord to note and chord to chord
+    """
+    # notes played on the same tick are a chord
+    if sounding.group_count == 0:
+        return 0, 0, 0, 0
+    centroids = np.add.reduceat(sounding.notes, sounding.starts) / sounding.sizes
+    is_chord = sounding.sizes > 1
+
+    intervals = np.abs(np.diff(centroids))
+    from_chord = is_chord[:-1]
+    to_chord = is_chord[1:]
+
+    note_to_note = _sequential_sum(intervals[~from_chord & ~to_chord])
+    note_to_chord = _sequential_sum(intervals[~from_chord & to_chord])
+    chord_to_note = _sequential_sum(intervals[from_chord & ~to_chord])
+    chord_to_chord = _sequential_sum(intervals[from_chord & to_chord])
+
+    return note_to_note, note_to_chord, chord_to_note, chord_to_chord
+
+
+register("note_to_note_transition", "note_transitions")(lambda transitions: transitions[0])
+register("note_to_chord_transition", "note_transitions")(lambda transitions: transitions[1])
+register("chord_to_note_transition", "note_transitions")(lambda transitions: transitions[2])
+register("chord_to_chord_transition", "note_transitions")(lambda transitions: transitions[3])
+
+
+@register("duration_seconds", "tempo_map", "tick_count")
+def _duration_seconds(tempo_map, tick_count):
+    return tempo_map.seconds_at(int(tick_count))
+
+
+@register("timed_notes_per_second", "note_count", "duration_seconds")
+def _timed_notes_per_second(note_count, duration_seconds):
+    return note_count / duration_seconds if duration_seconds else np.nan
+
+
+@register("timed_duration_per_note", "unique_note_count", "duration_seconds")
+def _timed_duration_per_note(unique_note_count, duration_seconds):
+    return unique_note_count / duration_seconds if duration_seconds else np.nan
+
+
+register("weighted_average_tempo", "weighted_tempo")(lambda stats: stats[0])
+register("weighted_tempo_deviation", "weighted_tempo")(lambda stats: stats[1])
+
+
+@register("weighted_average_bpm", "weighted_average_tempo")
+def _weighted_average_bpm(weighted_average_tempo):
+    return 60_000_000 / weighted_average_tempo
+
+
+@register("weighted_tempo_complexity", "weighted_tempo_deviation", "weighted_average_tempo")
+def _weighted_tempo_complexity(weighted_tempo_deviation, weighted_average_tempo):
+    return weighted_tempo_deviation / weighted_average_tempo
+
+
+@register("timed_consecutive_note_std", "onsets", "tempo_map")
+@profiling.profiled
+def get_timed_consecutive_note_std(onsets, tempo_map):
+    """
+    Standard deviation of the seconds between consecutive note_on events
+    """
+    # ticks sharing a group share their seconds, only the first of each is looked up
+    seconds = np.repeat(tempo_map.seconds(onsets.ticks[onsets.starts]), onsets.sizes)
+    return _nanstd(np.diff(seconds))
+
+
+def compute_features(events, names=None, ticks_per_beat=DEFAULT_TICKS_PER_BEAT):
+    """
+    Compute the requested features (all of csv_processing.get_features by default)
+    from sorted event arrays (see sort_events). Only what the requested features
+    depend on is computed, and every intermediate is computed once.
+    """
+    values = {"events": events, "ticks_per_beat": ticks_per_beat}
+    return {name: _resolve(name, values) for name in (names or FEATURE_NAMES)}
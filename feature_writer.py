@@ -0,0 +1,92 @@
+import csv
+import math
+import os
+
+import numpy as np
+
+
+def _format(value):
+    # same output as DataFrame.to_csv: plain numbers and blanks for NaN
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return ""
+    return value
+
+
+class FeatureWriter:
+    """
+    Appends feature rows to a CSV as soon as they are produced. Every completed
+    file is recorded in a checkpoint manifest next to the output along with the
+    size of the output at that point, so an interrupted run can be resumed
+    without redoing or duplicating anything. Files that fail are logged to a
+    separate CSV instead of stopping the run.
+    """
+    def __init__(self, output, restart=False):
+        self.output = output
+        self.manifest_path = f"{output}.manifest"
+        self.error_path = f"{output}.errors.csv"
+        self.completed = set()
+        self.written = 0
+        self.errors = 0
+
+        offset = 0
+        if not restart and os.path.exists(output) and os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as f:
+                for line in f:
+                    # a line without newline was cut off by a crash
+                    if not line.endswith("\n"):
+                        break
+                    filepath, _, size = line[:-1].rpartition("\t")
+                    self.completed.add(filepath)
+                    offset = int(size)
+            # drop rows written after the last checkpoint
+            os.truncate(output, offset)
+            self.manifest = open(self.manifest_path, "a", encoding="utf-8")
+            self.error_log = open(self.error_path, "a", encoding="utf-8", newline="")
+        else:
+            open(output, "w").close()
+            self.manifest = open(self.manifest_path, "w", encoding="utf-8")
+            self.error_log = open(self.error_path, "w", encoding="utf-8", newline="")
+
+        self.file = open(output, "a", encoding="utf-8", newline="")
+        self.rows = csv.writer(self.file)
+        self.errors_csv = csv.writer(self.error_log)
+        self.has_header = offset > 0
+        if self.error_log.tell() == 0:
+            self.errors_csv.writerow(["file", "error"])
+
+    def _checkpoint(self, filepath):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.manifest.write(f"{filepath}\t{self.file.tell()}\n")
+        self.manifest.flush()
+        self.completed.add(str(filepath))
+
+    def write(self, filepath, features):
+        """
+        Append the features of a file, None means the file was skipped
+        """
+        if features is not None:
+            if not self.has_header:
+                self.rows.writerow(features.keys())
+                self.has_header = True
+            self.rows.writerow([_format(value) for value in features.values()])
+            self.written += 1
+        self._checkpoint(filepath)
+
+    def log_error(self, filepath, error):
+        self.errors_csv.writerow([str(filepath), error])
+        self.error_log.flush()
+        self.errors += 1
+
+    def close(self):
+        self.file.close()
+        self.manifest.close()
+        self.error_log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
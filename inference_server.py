@@ -0,0 +1,285 @@
+import argparse
+import io
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from mido import MidiFile
+
+import csv_processing
+import scoring
+from scoring import FEATURES_KEPT
+
+MAX_BYTES = 10 * 1024 * 1024
+
+
+class UnreadableMidi(Exception):
+    pass
+
+
+class Overloaded(Exception):
+    pass
+
+
+def extract_features(data):
+    """
+    Model features of the bytes of a midi file, run in the worker processes,
+    raises UnreadableMidi when they cannot be read as a midi file
+    """
+    try:
+        return csv_processing.get_features(MidiFile(file=io.BytesIO(data)), FEATURES_KEPT)
+    except Exception as e:
+        raise UnreadableMidi(f"{type(e).__name__}: {e}") from None
+
+
+class PredictionBatcher:
+    """
+    Collects the feature rows of concurrent requests in a bounded queue and
+    predicts them with one call of the model. A batch is sent once max_batch
+    rows are waiting or max_wait seconds after its first row arrived.
+    """
+    def __init__(self, model, max_batch=32, max_wait=0.005, queue_size=64):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue(queue_size)
+        self.batches = 0
+        self.rows = 0
+        self.thread = threading.Thread(target=self._run, name="batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, features):
+        """
+        Future of the predicted difficulty of one row of model features, raises Overloaded when the queue is full
+        """
+        future = Future()
+        try:
+            self.queue.put_nowait(([features[name] for name in FEATURES_KEPT], future))
+        except queue.Full:
+            raise Overloaded("prediction queue is full")
+        return future
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            rows = np.array([row for row, _ in batch], dtype=np.float64)
+            try:
+                predictions = self.model.predict(self.model.scaler.transform(rows))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.rows += len(batch)
+            for (_, future), prediction in zip(batch, predictions):
+                future.set_result(float(prediction))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class InferenceService:
+    """
+    Midi bytes to predicted difficulty: features are extracted in a pool of
+    worker processes and predicted in micro-batches. At most max_pending
+    requests are admitted at a time, the ones above are rejected right away
+    so a burst cannot pile up unbounded work behind the pool.
+    """
+    def __init__(self, model, workers=None, max_pending=64, max_batch=32, max_wait=0.005):
+        self.model = model
+        self.pool = ProcessPoolExecutor(workers or os.cpu_count())
+        self.batcher = PredictionBatcher(model, max_batch, max_wait, max_pending)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.max_pending = max_pending
+        self.served = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        # start the workers now, before the server threads are running
+        self.pool.submit(int).result()
+
+    def predict(self, data, timeout=60):
+        """
+        Features and predicted difficulty of the bytes of a midi file, raises
+        Overloaded when max_pending requests are already being processed. A
+        request that times out keeps its slot until its worker is done with
+        the file, so max_pending bounds the work in progress, not the waiting.
+        """
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise Overloaded("too many requests in progress")
+        start = time.perf_counter()
+        try:
+            extraction = self.pool.submit(extract_features, data)
+        except BaseException:
+            self.slots.release()
+            raise
+        try:
+            features = extraction.result(timeout)
+        except BaseException:
+            # a file still waiting for a worker is dropped, one being read holds the slot until it is done
+            extraction.cancel()
+            extraction.add_done_callback(self._release)
+            raise
+        try:
+            prediction = self.batcher.submit(features)
+        except BaseException:
+            self.slots.release()
+            raise
+        prediction.add_done_callback(self._release)
+        difficulty = prediction.result(timeout)
+        with self.lock:
+            self.served += 1
+        return {
+            'features': features,
+            'predicted_difficulty': difficulty,
+            'seconds': time.perf_counter() - start,
+        }
+
+    def _release(self, future):
+        self.slots.release()
+
+    def stats(self):
+        return {
+            'served': self.served,
+            'rejected': self.rejected,
+            'batches': self.batcher.batches,
+            'average_batch': self.batcher.rows / max(self.batcher.batches, 1),
+            'max_pending': self.max_pending,
+        }
+
+    def close(self):
+        self.batcher.close()
+        self.pool.shutdown(cancel_futures=True)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict with the midi file as the body (?name= for the file name),
+    GET /health for the counters of the service
+    """
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, status, body, headers=()):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/health":
+            self._reply(404, {'error': "not found"})
+            return
+        self._reply(200, {'status': "ok", **self.server.service.stats()})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/predict":
+            self._reply(404, {'error': "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        if length <= 0:
+            self._reply(400, {'error': "send the midi file as the request body"})
+            return
+        if length > self.server.max_bytes:
+            self.close_connection = True
+            self._reply(413, {'error': f"file larger than {self.server.max_bytes} bytes"})
+            return
+        data = self.rfile.read(length)
+        name = parse_qs(url.query).get("name", [""])[0]
+
+        try:
+            result = self.server.service.predict(data)
+        except UnreadableMidi as e:
+            self._reply(400, {'error': str(e)})
+            return
+        except (Overloaded, TimeoutError, BrokenProcessPool) as e:
+            self._reply(503, {'error': f"{type(e).__name__}: {e}"}, [("Retry-After", "1")])
+            return
+        except Exception as e:
+            self._reply(500, {'error': f"{type(e).__name__}: {e}"})
+            return
+        self._reply(200, {'file': name, **result})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(service, host="127.0.0.1", port=8000, max_bytes=MAX_BYTES, verbose=False):
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.max_bytes = max_bytes
+    server.verbose = verbose
+    print(f"Serving on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve difficulty predictions of midi files over HTTP")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--model", type=str, default=scoring.MODEL_PATH, help="Pickled AveragingModels")
+    parser.add_argument("--workers", type=int, help="Processes extracting features (one per core by default)")
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=64,
+        help="Requests processed at a time, more are answered with 503"
+    )
+    parser.add_argument("--max-batch", type=int, default=32, help="Most rows predicted in one call of the model")
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=5,
+        help="How long a batch waits for more rows after its first one"
+    )
+    parser.add_argument("--max-bytes", type=int, default=MAX_BYTES, help="Largest midi file accepted")
+    parser.add_argument("--verbose", "-v", action='store_true', help="Log every request")
+    args = parser.parse_args()
+
+    service = InferenceService(
+        scoring.load_model(args.model), args.workers, args.max_pending, args.max_batch, args.max_wait_ms / 1000,
+    )
+    serve(service, args.host, args.port, args.max_bytes, args.verbose)
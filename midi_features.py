@@ -0,0 +1,80 @@
+import heapq
+
+import numpy as np
+
+import feature_engine
+
+
+def _track_events(n_track, track):
+    tick = 0
+    for i, msg in enumerate(track):
+        tick += msg.time
+        yield tick, n_track, i, msg
+
+
+def iter_events(mid):
+    """
+    Yield (tick, track, message) for every message of every track in tick order,
+    events on the same tick are ordered by track.
+    """
+    tracks = [_track_events(n_track, track) for n_track, track in enumerate(mid.tracks)]
+    for tick, n_track, _, msg in heapq.merge(*tracks):
+        yield tick, n_track, msg
+
+
+def _reporting(events, progress, total, every=10_000):
+    for i, event in enumerate(events):
+        if i % every == 0:
+            progress(i, total)
+        yield event
+    progress(total, total)
+
+
+# columns of midi_events that blank values leave as NaN, like a CSV read with pandas
+_VALUE_COLUMNS = ["note", "velocity", "tempo", "numerator"]
+
+
+def _track_messages(mid):
+    for n_track, track in enumerate(mid.tracks):
+        for msg in track:
+            yield n_track, msg
+
+
+def midi_events(mid, progress=None):
+    """
+    The event arrays of feature_engine (EVENT_COLUMNS) of a midi file, in the
+    order of the rows of its CSV (convert_midi_to_csv.mid_to_csv): by tick,
+    then track, then position in the track. Sorted with
+    feature_engine.sort_events they are the events of that CSV, so a piece
+    gets the same features whether it comes as MIDI or as a CSV. progress is
+    called with the number of messages done and the total every 10000 messages.
+    """
+    total = sum(len(track) for track in mid.tracks)
+    tick = np.empty(total, dtype=np.int64)
+    time = np.empty(total, dtype=np.int64)
+    types = np.empty(total, dtype=np.int8)
+    tracks = np.empty(total, dtype=np.int64)
+    values = {col: np.full(total, np.nan) for col in _VALUE_COLUMNS}
+
+    messages = _track_messages(mid)
+    if progress is not None:
+        messages = _reporting(messages, progress, total)
+    current_track = None
+    for i, (n_track, msg) in enumerate(messages):
+        if n_track != current_track:
+            current_track = n_track
+            current_tick = 0
+        current_tick += msg.time
+        tick[i] = current_tick
+        time[i] = msg.time
+        types[i] = feature_engine.TYPE_CODES.get(msg.type, feature_engine.OTHER)
+        tracks[i] = n_track
+        for col in _VALUE_COLUMNS:
+            value = getattr(msg, col, None)
+            if value is not None:
+                values[col][i] = value
+
+    order = np.argsort(tick, kind="stable")
+    events = {"tick": tick, "type": types, "time": time, "track": tracks, **values}
+    return {col: column[order] for col, column in events.items()}
+
@@ -0,0 +1,120 @@
+import csv
+import functools
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# off by default, the stages and decorated functions cost a flag check when disabled
+_enabled = False
+_stack = []
+# name -> [calls, total seconds, peak bytes]
+_records = {}
+
+
+def enable():
+    """
+    Start recording wall time and peak memory of every stage in this process
+    """
+    global _enabled
+    _enabled = True
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def is_enabled():
+    return _enabled
+
+
+def _record(name, seconds, peak):
+    record = _records.setdefault(name, [0, 0.0, 0])
+    record[0] += 1
+    record[1] += seconds
+    record[2] = max(record[2], peak)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block of code and measure the memory it allocates at its peak
+    """
+    if not _enabled:
+        yield
+        return
+
+    # the peak is reset for this stage, hand the enclosing stage what it reached so far
+    if _stack:
+        _stack[-1][2] = max(_stack[-1][2], tracemalloc.get_traced_memory()[1])
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    frame = [name, current, current]
+    _stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _stack.pop()
+        peak = max(frame[2], tracemalloc.get_traced_memory()[1])
+        _record(name, seconds, peak - frame[1])
+        if _stack:
+            _stack[-1][2] = max(_stack[-1][2], peak)
+
+
+def profiled(func):
+    """
+    Decorator recording every call of a feature function as a stage
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        with stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def collect():
+    """
+    Return the records of this process and start over, used to send them back from pool workers
+    """
+    global _records
+    records, _records = _records, {}
+    return records
+
+
+def merge(records):
+    """
+    Add records collected in another process to this one
+    """
+    for name, (calls, seconds, peak) in records.items():
+        record = _records.setdefault(name, [0, 0.0, 0])
+        record[0] += calls
+        record[1] += seconds
+        record[2] = max(record[2], peak)
+
+
+def write_report(path, records=None):
+    """
+    Write the records as JSON or CSV (picked from the extension of path)
+    """
+    records = _records if records is None else records
+    rows = [
+        {
+            'stage': name,
+            'calls': calls,
+            'total_seconds': seconds,
+            'mean_ms': seconds / calls * 1000,
+            'peak_memory_kb': peak / 1024,
+        }
+        for name, (calls, seconds, peak) in sorted(records.items(), key=lambda item: -item[1][1])
+    ]
+    if str(path).endswith(".json"):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+    else:
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=['stage', 'calls', 'total_seconds', 'mean_ms', 'peak_memory_kb'])
+            writer.writeheader()
+            writer.writerows(rows)
+    return rows
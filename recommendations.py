@@ -0,0 +1,174 @@
+import random
+
+import numpy as np
+import pandas as pd
+
+from scoring import FEATURES_KEPT
+
+# window around the difficulty of the piece the recommendations are made for
+BELOW = 0.3
+ABOVE = 0.5
+
+# difficulty ranges browsed in the app, split at these difficulties: each range
+# holds the pieces from one bound up to (not including) the next, the first one
+# every piece below the first bound and the last one every piece from the last
+DIFFICULTY_BOUNDS = [2.0, 3.0, 3.5, 4.0, 5.0]
+PAGE_SIZE = 50
+
+
+def range_label(low, high):
+    """
+    Label of the range from low up to high, None for a range without that bound
+    """
+    if low is None:
+        return f"Difficulty < {high}"
+    if high is None:
+        return f"Difficulty ≥ {low}"
+    return f"Difficulty {low}–{high}"
+
+
+class RangeView:
+    """
+    The pieces of one difficulty range as a table, split into pages
+    """
+    def __init__(self, label, table, page_size=PAGE_SIZE):
+        self.label = label
+        self.table = table
+        self.page_size = page_size
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def page_count(self):
+        return max(-(-len(self.table) // self.page_size), 1)
+
+    def page(self, number):
+        """
+        Rows of the page, counted from 0
+        """
+        return self.table.iloc[number * self.page_size:(number + 1) * self.page_size]
+
+
+class DifficultyIndex:
+    """
+    Pieces sorted by predicted difficulty, built once from predictions.csv.
+    Difficulty ranges are found by binary search, and recommendations are
+    sampled (or ranked by how close their features are) inside the range
+    without scanning or re-reading the table.
+    """
+    def __init__(self, files, difficulties, features=None):
+        difficulties = np.asarray(difficulties, dtype=np.float64)
+        order = np.argsort(difficulties, kind="stable")
+        self.files = np.asarray(files, dtype=object)[order]
+        self.difficulties = difficulties[order]
+        self.position = {file: i for i, file in enumerate(self.files)}
+
+        # features scaled to [0, 1] over the corpus so every feature weighs the same in distances
+        self.features = None
+        if features is not None:
+            features = np.asarray(features, dtype=np.float64)[order]
+            self.low = np.nanmin(features, axis=0)
+            span = np.nanmax(features, axis=0) - self.low
+            self.span = np.where(span > 0, span, 1)
+            self.features = np.nan_to_num(self._scale(features))
+
+    @classmethod
+    def from_csv(cls, predictions_path, features_path=None):
+        """
+        Index predictions.csv, with the model features of every piece from features_path
+        (csv_processing output) when given, for similarity ranking
+        """
+        predictions = pd.read_csv(predictions_path)
+        features = None
+        if features_path is not None:
+            table = pd.read_csv(features_path, usecols=['file', *FEATURES_KEPT]).drop_duplicates('file')
+            table = table.set_index('file').reindex(predictions['file'])
+            features = table.loc[:, FEATURES_KEPT].to_numpy()
+        return cls(predictions['file'], predictions['predicted_difficulty'], features)
+
+    def __len__(self):
+        return len(self.files)
+
+    def _scale(self, features):
+        return (features - self.low) / self.span
+
+    def bounds(self, low, high, inclusive=True):
+        """
+        Start and end positions of the pieces with low <= difficulty <= high
+        (low < difficulty < high when inclusive is False)
+        """
+        if inclusive:
+            return (np.searchsorted(self.difficulties, low, side="left"),
+                    np.searchsorted(self.difficulties, high, side="right"))
+        return (np.searchsorted(self.difficulties, low, side="right"),
+                np.searchsorted(self.difficulties, high, side="left"))
+
+    def range_views(self, bounds=DIFFICULTY_BOUNDS, page_size=PAGE_SIZE):
+        """
+        One RangeView per range between bounds, easiest first. A range runs from
+        its low up to (not including) its high, the first one from the easiest
+        piece and the last one to the hardest, so no difficulty falls between
+        two ranges.
+        """
+        bounds = sorted(bounds)
+        cuts = list(np.searchsorted(self.difficulties, bounds, side="left"))
+        starts = [0, *cuts]
+        ends = [*cuts, len(self)]
+        edges = [None, *bounds, None]
+
+        views = []
+        for low, high, start, end in zip(edges[:-1], edges[1:], starts, ends):
+            table = pd.DataFrame({
+                'Piece': [file[:-4] for file in self.files[start:end]],
+                'Difficulty': self.difficulties[start:end],
+            })
+            views.append(RangeView(range_label(low, high), table, page_size))
+        return views
+
+    def pieces(self, low, high, inclusive=True):
+        """
+        (file, difficulty) of every piece in the range, easiest first
+        """
+        start, end = self.bounds(low, high, inclusive)
+        return list(zip(self.files[start:end], self.difficulties[start:end]))
+
+    def difficulty_of(self, file):
+        """
+        Predicted difficulty of an indexed piece, None when unknown
+        """
+        i = self.position.get(file)
+        return None if i is None else self.difficulties[i]
+
+    def features_of(self, file):
+        """
+        Unscaled model features of an indexed piece, None when unknown
+        """
+        if self.features is None or file not in self.position:
+            return None
+        return self.features[self.position[file]] * self.span + self.low
+
+    def recommend(self, difficulty, k=3, features=None, exclude=None, below=BELOW, above=ABOVE):
+        """
+        Up to k pieces with difficulty - below < difficulty < difficulty + above,
+        as dicts with file and predicted_difficulty. Sampled at random without
+        replacement, or the k closest by features when the piece's model features
+        are given and the index has features. exclude is a file left out.
+        """
+        difficulty = float(np.ravel(difficulty)[0])
+        start, end = self.bounds(difficulty - below, difficulty + above, inclusive=False)
+        skip = self.position.get(exclude)
+
+        if features is not None and self.features is not None:
+            query = np.nan_to_num(self._scale(np.asarray(features, dtype=np.float64)))
+            positions = np.arange(start, end)
+            positions = positions[positions != skip]
+            distances = np.linalg.norm(self.features[positions] - query, axis=1)
+            chosen = positions[np.argsort(distances, kind="stable")[:k]]
+        else:
+            # random.sample only draws k positions, whatever the size of the range;
+            # one extra in case the excluded piece is drawn
+            candidates = range(start, end)
+            chosen = [i for i in random.sample(candidates, min(k + 1, len(candidates))) if i != skip][:k]
+
+        return [{'file': self.files[i], 'predicted_difficulty': self.difficulties[i]} for i in chosen]
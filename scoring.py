@@ -0,0 +1,193 @@
+import argparse
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import compiled_model
+import csv_processing
+import feature_writer
+
+# AveragingModels lives next to the streamlit app
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit"))
+
+# features the model was trained on, in the order of its scaler
+FEATURES_KEPT = ['note_count', 'note_density', 'unique_note_count', 'notes_per_second',
+'pitch_range', 'tempo_change_count', 'note_to_note_transition',
+'note_to_chord_transition', 'chord_to_note_transition',
+'chord_to_chord_transition']
+
+MODEL_PATH = "models/averaged_models.pkl"
+
+
+class _ModelUnpickler(pickle.Unpickler):
+    # model.ipynb pickled AveragingModels from __main__
+    def find_class(self, module, name):
+        if module == "__main__" and name == "AveragingModels":
+            # imported here so loading a compiled model never imports sklearn
+            from AveragingModels import AveragingModels
+            return AveragingModels
+        return super().find_class(module, name)
+
+
+def compiled_path(path):
+    """
+    Where compiled_model.py writes the artifact of a pickled model
+    """
+    return os.path.splitext(path)[0] + ".npz"
+
+
+def model_mtime(path=MODEL_PATH):
+    """
+    Modification times of a pickled model and its compiled artifact, changes when either is replaced
+    """
+    compiled = compiled_path(path)
+    return os.path.getmtime(path), os.path.getmtime(compiled) if os.path.exists(compiled) else None
+
+
+def load_model(path=MODEL_PATH, compiled=True):
+    """
+    Load a pickled AveragingModels from any script, not only the notebook or the app.
+    The compiled artifact next to it is used instead when it was made from this
+    exact pickle (see compiled_model.py), a .npz path is always loaded as compiled.
+    """
+    if path.endswith(".npz"):
+        return compiled_model.load(path)
+    if compiled and os.path.exists(compiled_path(path)):
+        model = compiled_model.load(compiled_path(path))
+        if model.is_compiled_from(path):
+            return model
+        print(f"{compiled_path(path)} was not compiled from {path}, loading the pickle")
+
+    with open(path, "rb") as file:
+        return _ModelUnpickler(file).load()
+
+
+def predict_batch(model, features, executor=None):
+    """
+    Predicted difficulty (rounded to half steps like predictions.csv) of every
+    row of a features table, the base models run in executor when given
+    """
+    X = model.scaler.transform(features.loc[:, FEATURES_KEPT].to_numpy())
+    return np.round(model.predict(X, executor=executor) * 2) / 2
+
+
+def score_file(model, input_path, output_path, chunk_size=10_000, workers=None):
+    """
+    Score a features CSV chunk by chunk, so a whole library never has to fit in
+    memory, and write file,predicted_difficulty rows as each chunk is done.
+    Returns the number of rows scored.
+    """
+    workers = workers or len(model.models_)
+    scored = 0
+    with ThreadPoolExecutor(workers) as executor, open(output_path, "w", encoding="utf-8", newline="") as out:
+        for chunk in pd.read_csv(input_path, chunksize=chunk_size):
+            pd.DataFrame({
+                'file': chunk['file'],
+                'predicted_difficulty': predict_batch(model, chunk, executor),
+            }).to_csv(out, index=False, header=scored == 0)
+            scored += len(chunk)
+            print(f"Scored {scored} pieces")
+    return scored
+
+
+def score_midi(model, files, writer, cache_dir=None, rebuild=False, workers=None):
+    """
+    Score MIDI files, their features extracted in parallel across processes,
+    and write a file,predicted_difficulty row to writer (a FeatureWriter) as
+    soon as each file is done. Returns the number of files scored.
+    """
+    scored = 0
+    for filepath, features, error in csv_processing.iter_features(files, cache_dir, rebuild, workers, FEATURES_KEPT):
+        if error is not None:
+            print(f"Error processing {filepath}: {error}")
+            writer.log_error(filepath, error)
+            continue
+        row = None
+        if features is not None:
+            difficulty = predict_batch(model, pd.DataFrame([features]))[0]
+            row = {'file': features['file'], 'predicted_difficulty': difficulty}
+            scored += 1
+        writer.write(filepath, row)
+    return scored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predict the difficulty of every piece of a features CSV or a directory of MIDI files")
+    parser.add_argument(
+        "input",
+        type=str,
+        nargs="?",
+        default="data/all_song_features.csv",
+        help="CSV of features made by csv_processing.py, or a directory with --midi"
+    )
+    parser.add_argument("--output", "-o", type=str, default="predictions.csv", help="Output CSV of predictions")
+    parser.add_argument("--model", type=str, default=MODEL_PATH, help="Pickled AveragingModels")
+    parser.add_argument(
+        "--no-compiled",
+        action='store_true',
+        help="Unpickle the model even when a compiled artifact of it exists"
+    )
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="Number of rows scored at a time")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Threads running the base models (one per base model by default), "
+             "or with --midi processes extracting features (one per core by default)"
+    )
+    parser.add_argument(
+        "--midi",
+        action='store_true',
+        help="Score the MIDI files of the input directory, without converting them to CSV first"
+    )
+    parser.add_argument(
+        "--recursive",
+        "-r",
+        action='store_true',
+        help="With --midi, also score the MIDI files of subdirectories"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default="data/feature_cache",
+        help="Directory of the feature cache used with --midi",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action='store_true',
+        help="Do not read or write the feature cache"
+    )
+    parser.add_argument(
+        "--restart",
+        action='store_true',
+        help="With --midi, ignore the checkpoint of a previous run and score every file again"
+    )
+    args = parser.parse_args()
+
+    model = load_model(args.model, compiled=not args.no_compiled)
+    start = time.perf_counter()
+    if args.midi:
+        files = [
+            f for suffix in csv_processing.MIDI_SUFFIXES
+            for f in csv_processing.get_files_in_directory(args.input, args.recursive, f"*{suffix}")
+        ]
+        cache_dir = None if args.no_cache else args.cache_dir
+        with feature_writer.FeatureWriter(args.output, restart=args.restart) as writer:
+            remaining = [f for f in files if str(f) not in writer.completed]
+            if len(remaining) < len(files):
+                print(f"resuming, {len(files) - len(remaining)} files already done")
+            print(f"found {len(remaining)} files, scoring...")
+            count = score_midi(model, remaining, writer, cache_dir, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        print(f"Wrote {count} predictions to {args.output} in {elapsed:.2f}s, "
+              f"{len(remaining) / max(elapsed, 1e-9):.1f} files/sec")
+        if writer.errors:
+            print(f"{writer.errors} files failed, see {writer.error_path}")
+    else:
+        count = score_file(model, args.input, args.output, args.chunk_size, args.workers)
+        elapsed = time.perf_counter() - start
+        print(f"Wrote {count} predictions to {args.output} in {elapsed:.2f}s")
@@ -0,0 +1,397 @@
+import argparse
+import math
+import os
+import time
+from functools import partial
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from mido import MidiFile
+
+import csv_processing
+import feature_engine
+import feature_writer
+import midi_features
+from feature_engine import NOTE_ON, SET_TEMPO, TIME_SIGNATURE, _group_sizes, _group_starts
+from tempo_map import DEFAULT_TICKS_PER_BEAT, TempoMap
+
+CHUNK_SIZE = 65_536
+
+UNITS = ("bars", "beats", "seconds")
+# columns of the midi csv the windows are computed from
+COLUMNS = ["tick", "type", "track", "note", "velocity", "tempo", "numerator", "denominator"]
+# per hop counts the windows are summed from
+CELL_COUNTS = ["notes", "groups", "chords", "independent", "leaps"]
+SEGMENT_FEATURES = [
+    'notes_per_second', 'average_polyphony', 'max_polyphony', 'chord_share',
+    'hand_independence', 'pitch_range', 'leap_frequency',
+]
+PERCENTILE = 90
+
+
+class UnsortedEvents(ValueError):
+    pass
+
+
+class _Timeline:
+    """
+    Beats, bars and seconds elapsed at a tick: seconds from the tempo map,
+    bars piecewise linear between the time_signature events seen so far.
+    A change only moves the ticks after it, so positions computed before it
+    stay valid.
+    """
+    def __init__(self, ticks_per_beat):
+        self.ticks_per_beat = ticks_per_beat
+        self.tempo_map = TempoMap(ticks_per_beat)
+        self.ticks = [0]
+        self.bar_ticks = [4 * ticks_per_beat]
+        self.bars = [0.0]
+
+    def change_bar(self, tick, bar_ticks):
+        if tick != self.ticks[-1]:
+            self.bars.append(self.bars[-1] + (tick - self.ticks[-1]) / self.bar_ticks[-1])
+            self.ticks.append(tick)
+            self.bar_ticks.append(bar_ticks)
+        else:
+            self.bar_ticks[-1] = bar_ticks
+
+    def _pieces(self, unit):
+        # first tick, position at that tick and position per tick of every piece
+        ticks = np.array(self.ticks, dtype=np.float64)
+        if unit == "bars":
+            return ticks, np.array(self.bars), 1 / np.array(self.bar_ticks, dtype=np.float64)
+        return ticks[:1], ticks[:1], np.array([1 / self.ticks_per_beat])
+
+    def position(self, ticks, unit):
+        if unit == "seconds":
+            return self.tempo_map.seconds(ticks)
+        starts, at, rates = self._pieces(unit)
+        i = np.searchsorted(starts, ticks, side="right") - 1
+        return at[i] + (ticks - starts[i]) * rates[i]
+
+    def tick_at(self, positions, unit):
+        if unit == "seconds":
+            return self.tempo_map.ticks_at(positions)
+        starts, at, rates = self._pieces(unit)
+        i = np.searchsorted(at, positions, side="right") - 1
+        return starts[i] + (positions - at[i]) / rates[i]
+
+
+class SegmentAccumulator:
+    """
+    Features of windows of length bars, beats or seconds sliding by hop over
+    a piece, from chunks of tick ordered event arrays. Every chunk is reduced
+    at once to a few counts per hop (a cell), only the events of the cell
+    still open are kept for the next chunk, so memory depends on the chunk
+    and window size and not on the length of the piece. The windows are
+    rolling sums and maxima over the cells.
+    """
+    def __init__(self, ticks_per_beat, unit="bars", length=4, hop=None):
+        if unit not in UNITS:
+            raise ValueError(f"unit must be one of {UNITS}")
+        hop = hop or length
+        cells = length / hop
+        if cells < 1 or abs(cells - round(cells)) > 1e-9:
+            raise ValueError("the window length must be a multiple of the hop")
+        self.unit = unit
+        self.hop = hop
+        self.cells_per_window = int(round(cells))
+        self.timeline = _Timeline(ticks_per_beat)
+        self.pending = None
+        self.last_tick = 0
+        self.next_cell = 0
+        self.previous_centroid = np.nan
+        self.cells = {name: [] for name in [*CELL_COUNTS, "max_polyphony", "low", "high"]}
+
+    def add(self, events):
+        """
+        Add a chunk of event arrays (COLUMNS), ticks must never go down
+        """
+        ticks = events["tick"]
+        if len(ticks) == 0:
+            return
+        if ticks[0] < self.last_tick or (np.diff(ticks) < 0).any():
+            raise UnsortedEvents("events must be added in tick order")
+        self.last_tick = ticks[-1]
+        self._read_changes(events)
+
+        if self.pending is not None:
+            events = {col: np.concatenate((self.pending[col], events[col])) for col in self.pending}
+        cells = self._cells(events["tick"])
+        # the last cell can still get events from the next chunk
+        open_start = np.searchsorted(cells, cells[-1])
+        self._reduce({col: values[:open_start] for col, values in events.items()}, cells[:open_start])
+        self.pending = {col: values[open_start:] for col, values in events.items()}
+
+    def _read_changes(self, events):
+        types = events["type"]
+        for i in np.flatnonzero((types == SET_TEMPO) | (types == TIME_SIGNATURE)):
+            tick = int(events["tick"][i])
+            if types[i] == SET_TEMPO:
+                self.timeline.tempo_map.change(tick, int(events["tempo"][i]))
+            else:
+                denominator = events["denominator"][i] if "denominator" in events else 4
+                bar_ticks = events["numerator"][i] * 4 * self.timeline.ticks_per_beat / denominator
+                self.timeline.change_bar(tick, float(bar_ticks))
+
+    def _cells(self, ticks):
+        # a little slack so a boundary computed as 3.9999999 bars still starts the 4th bar
+        return np.floor(self.timeline.position(ticks, self.unit) / self.hop + 1e-9).astype(np.int64)
+
+    def _reduce(self, events, cells):
+        if len(cells) == 0:
+            return
+        count = cells[-1] + 1 - self.next_cell
+        sounding = (events["type"] == NOTE_ON) & (events["velocity"] > 0)
+        ticks = events["tick"][sounding]
+        notes = events["note"][sounding].astype(np.float64)
+        tracks = events["track"][sounding]
+        note_cells = cells[sounding] - self.next_cell
+
+        # notes played on the same tick are one onset group, a chord when there are several
+        starts = _group_starts(ticks)
+        sizes = _group_sizes(starts, len(ticks))
+        group_cells = note_cells[starts]
+        max_polyphony = np.zeros(count, dtype=np.int64)
+        low = np.full(count, np.inf)
+        high = np.full(count, -np.inf)
+        if len(starts):
+            independent = np.minimum.reduceat(tracks, starts) != np.maximum.reduceat(tracks, starts)
+            centroids = np.add.reduceat(notes, starts) / sizes
+            leaps = np.abs(np.diff(np.concatenate(([self.previous_centroid], centroids)))) > 12
+            self.previous_centroid = centroids[-1]
+            np.maximum.at(max_polyphony, group_cells, sizes)
+            np.minimum.at(low, note_cells, notes)
+            np.maximum.at(high, note_cells, notes)
+        else:
+            independent = leaps = np.zeros(0, dtype=bool)
+
+        counts = {
+            "notes": np.bincount(note_cells, minlength=count),
+            "groups": np.bincount(group_cells, minlength=count),
+            "chords": np.bincount(group_cells, weights=sizes > 1, minlength=count),
+            "independent": np.bincount(group_cells, weights=independent, minlength=count),
+            "leaps": np.bincount(group_cells, weights=leaps, minlength=count),
+            "max_polyphony": max_polyphony,
+            "low": low,
+            "high": high,
+        }
+        for name, values in counts.items():
+            self.cells[name].append(values)
+        self.next_cell += count
+
+    def segments(self):
+        """
+        Close the last cell and return one row per window: its bounds in
+        ticks and seconds, note count and SEGMENT_FEATURES
+        """
+        if self.pending is not None:
+            self._reduce(self.pending, self._cells(self.pending["tick"]))
+            self.pending = None
+        cells = {name: np.concatenate(parts) if parts else np.zeros(0) for name, parts in self.cells.items()}
+        n_cells = len(cells["notes"])
+        if n_cells == 0:
+            return pd.DataFrame(columns=['start_tick', 'end_tick', 'start_seconds', 'end_seconds',
+                                         'note_count', *SEGMENT_FEATURES])
+        # a piece shorter than a window is one shorter window
+        width = min(self.cells_per_window, n_cells)
+
+        def rolling_sum(values):
+            total = np.concatenate(([0], np.cumsum(values)))
+            return total[width:] - total[:-width]
+
+        def rolling(values, reduce):
+            return reduce(np.lib.stride_tricks.sliding_window_view(values, width), axis=1)
+
+        windows = {name: rolling_sum(cells[name]) for name in CELL_COUNTS}
+        start = np.arange(n_cells - width + 1) * self.hop
+        start_tick = self.timeline.tick_at(start, self.unit)
+        end_tick = self.timeline.tick_at(start + width * self.hop, self.unit)
+        start_seconds = self.timeline.position(start_tick, "seconds")
+        end_seconds = self.timeline.position(end_tick, "seconds")
+        groups = windows["groups"]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return pd.DataFrame({
+                'start_tick': np.ceil(start_tick - 1e-6).astype(np.int64),
+                'end_tick': np.ceil(end_tick - 1e-6).astype(np.int64),
+                'start_seconds': start_seconds,
+                'end_seconds': end_seconds,
+                'note_count': windows["notes"],
+                'notes_per_second': windows["notes"] / (end_seconds - start_seconds),
+                'average_polyphony': windows["notes"] / groups,
+                'max_polyphony': rolling(cells["max_polyphony"], np.max),
+                'chord_share': windows["chords"] / groups,
+                'hand_independence': windows["independent"] / groups,
+                'pitch_range': np.where(groups > 0, rolling(cells["high"], np.max) - rolling(cells["low"], np.min), np.nan),
+                'leap_frequency': windows["leaps"] / groups,
+            })
+
+
+def _arrays(rows):
+    return dict(zip(COLUMNS, np.array(rows, dtype=np.int64).reshape(-1, len(COLUMNS)).T))
+
+
+def _midi_chunks(mid, chunk_size):
+    """
+    Event arrays of the messages of a midi file, read chunk_size at a time
+    """
+    rows = []
+    for tick, track, msg in midi_features.iter_events(mid):
+        rows.append((
+            tick, feature_engine.TYPE_CODES.get(msg.type, feature_engine.OTHER), track, getattr(msg, "note", -1), getattr(msg, "velocity", 0), getattr(msg, "tempo", 0),
+            getattr(msg, "numerator", 0), getattr(msg, "denominator", 0),
+        ))
+        if len(rows) == chunk_size:
+            yield _arrays(rows)
+            rows = []
+    if rows:
+        yield _arrays(rows)
+
+
+def _read_csv(filepath, chunk_size=None):
+    return pd.read_csv(filepath, low_memory=False, usecols=lambda col: col in COLUMNS, chunksize=chunk_size)
+
+
+def _csv_chunks(filepath, chunk_size):
+    with _read_csv(filepath, chunk_size) as reader:
+        for df in reader:
+            yield feature_engine.events_from_dataframe(df, COLUMNS)
+
+
+def _slices(events, chunk_size):
+    for start in range(0, len(events["tick"]), chunk_size):
+        yield {col: values[start:start + chunk_size] for col, values in events.items()}
+
+
+def _accumulate(chunks, ticks_per_beat, unit, length, hop):
+    accumulator = SegmentAccumulator(ticks_per_beat, unit, length, hop)
+    for chunk in chunks:
+        accumulator.add(chunk)
+    return accumulator.segments()
+
+
+def get_segment_features(source, unit="bars", length=4, hop=None, ticks_per_beat=None, chunk_size=CHUNK_SIZE):
+    """
+    Features of every window of length bars, beats or seconds sliding by hop
+    (length by default, back to back windows) over a piece. source is the
+    path of a CSV or MIDI file, a mido MidiFile, a DataFrame of midi events
+    or event arrays. MIDI and tick ordered CSV files are read chunk_size
+    events at a time. ticks_per_beat is read from MIDI files, for the other
+    sources it defaults to DEFAULT_TICKS_PER_BEAT.
+    """
+    window = (unit, length, hop)
+    if isinstance(source, (str, os.PathLike)) and Path(source).suffix.lower() in csv_processing.MIDI_SUFFIXES:
+        source = MidiFile(source)
+    if isinstance(source, MidiFile):
+        return _accumulate(_midi_chunks(source, chunk_size), source.ticks_per_beat, *window)
+
+    ticks_per_beat = ticks_per_beat or DEFAULT_TICKS_PER_BEAT
+    if isinstance(source, (str, os.PathLike)):
+        try:
+            return _accumulate(_csv_chunks(source, chunk_size), ticks_per_beat, *window)
+        except UnsortedEvents:
+            # not written in tick order, it has to be read whole and sorted
+            source = _read_csv(source)
+    if isinstance(source, pd.DataFrame):
+        if 'tick' not in source.columns and source.index.name == 'tick':
+            source = source.reset_index()
+        source = feature_engine.events_from_dataframe(source, COLUMNS)
+    # events of a tick in track order like midi files are read, the last of
+    # several set_tempo on a tick is the one that lasts
+    order = np.lexsort((source["track"], source["tick"]))
+    events = {col: values[order] for col, values in source.items()}
+    return _accumulate(_slices(events, chunk_size), ticks_per_beat, *window)
+
+
+def summarize(segments, percentile=PERCENTILE):
+    """
+    Peak and percentile of every segment feature over the windows of a
+    piece, one row of features for the training table
+    """
+    features = {'segment_count': len(segments)}
+    for name in SEGMENT_FEATURES:
+        values = segments[name].to_numpy(dtype=np.float64)
+        values = values[~np.isnan(values)]
+        features[f"{name}_peak"] = values.max() if len(values) else math.nan
+        features[f"{name}_p{percentile}"] = np.percentile(values, percentile) if len(values) else math.nan
+    return features
+
+
+def _process_file(options, segments_dir, filepath):
+    try:
+        segments = get_segment_features(filepath, **options)
+    except Exception as e:
+        return filepath, None, f"{type(e).__name__}: {e}"
+    if segments_dir is not None:
+        segments.to_csv(os.path.join(segments_dir, Path(filepath).stem + ".csv"), index=False)
+    return filepath, {'file': Path(filepath).name, **summarize(segments)}, None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract windowed difficulty features from CSV or MIDI files")
+    parser.add_argument("directory", type=str, help="Directory containing CSV files")
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        default="data/segment_features.csv",
+        help="Output CSV file, one row of peak and percentile features per file"
+    )
+    parser.add_argument("--recursive", "-r", action='store_true', help="Whether to search recursively in subdirectories")
+    parser.add_argument("--midi", action='store_true', help="Process the MIDI files in the directory instead of CSV files")
+    parser.add_argument("--filepath", type=str, help="Path to a file that lists CSV files to process")
+    window = parser.add_mutually_exclusive_group()
+    window.add_argument("--bars", type=float, help="Window length in bars (4 bars by default)")
+    window.add_argument("--beats", type=float, help="Window length in beats")
+    window.add_argument("--seconds", type=float, help="Window length in seconds")
+    parser.add_argument("--hop", type=float, help="How far the window moves each step (its length by default)")
+    parser.add_argument(
+        "--ticks-per-beat",
+        type=int,
+        default=DEFAULT_TICKS_PER_BEAT,
+        help="Resolution of the midi files the CSVs were made from, MIDI files record their own"
+    )
+    parser.add_argument("--segments-dir", type=str, help="Also write the features of every window, one CSV per file")
+    parser.add_argument("--workers", type=int, help="Number of processes (one per core by default)")
+    parser.add_argument(
+        "--restart",
+        action='store_true',
+        help="Ignore the checkpoint of a previous run and write the output from scratch"
+    )
+    args = parser.parse_args()
+    if args.filepath:
+        with open(args.filepath, 'r', encoding="utf-8") as f:
+            file_list = [os.path.join(args.directory, line.strip()) for line in f.readlines()]
+    else:
+        pattern = "*.mid" if args.midi else "*.csv"
+        file_list = list(csv_processing.get_files_in_directory(args.directory, args.recursive, pattern))
+
+    unit, length = next(((unit, getattr(args, unit)) for unit in UNITS if getattr(args, unit)), ("bars", 4))
+    options = {'unit': unit, 'length': length, 'hop': args.hop, 'ticks_per_beat': args.ticks_per_beat}
+    if args.segments_dir:
+        os.makedirs(args.segments_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    with feature_writer.FeatureWriter(args.output, restart=args.restart) as writer:
+        remaining = [f for f in file_list if str(f) not in writer.completed]
+        if len(remaining) < len(file_list):
+            print(f"resuming, {len(file_list) - len(remaining)} files already done")
+
+        print(f'found {len(remaining)} files, {length:g} {unit} windows, processing...')
+        with Pool(args.workers or os.cpu_count()) as pool:
+            results = pool.imap_unordered(partial(_process_file, options, args.segments_dir), remaining)
+            for done, (filepath, features, error) in enumerate(results, 1):
+                if error is not None:
+                    print(f"Error processing {filepath}: {error}")
+                    writer.log_error(filepath, error)
+                else:
+                    writer.write(filepath, features)
+                if done % 100 == 0 or done == len(remaining):
+                    print(f"Processed {done} files of {len(remaining)} files")
+
+    print(f"{writer.written} files in {time.perf_counter() - start:.2f}s")
+    if writer.errors:
+        print(f"{writer.errors} files failed, see {writer.error_path}")
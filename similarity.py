@@ -0,0 +1,147 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import csv_processing
+import scoring
+from scoring import FEATURES_KEPT
+
+INDEX_PATH = "data/similarity_index.npz"
+FEATURES_PATH = "data/all_song_features.csv"
+
+
+class SimilarityIndex:
+    """
+    Model features of every piece scaled with the model's MinMaxScaler into a
+    float32 matrix, searched by brute force for the nearest pieces of a query.
+    The scaler's parameters are kept with the vectors so queries only need NumPy.
+    """
+    def __init__(self, files, features, vectors, scale, minimum):
+        self.files = np.asarray(files, dtype=str)
+        self.features = np.asarray(features, dtype=np.float64)
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.min = np.asarray(minimum, dtype=np.float64)
+        self.position = {file: i for i, file in enumerate(self.files)}
+
+    def __len__(self):
+        return len(self.files)
+
+    def transform(self, features):
+        """
+        Scale raw model features like the model does, missing values at the bottom of the range
+        """
+        return np.nan_to_num(np.asarray(features, dtype=np.float64) * self.scale + self.min).astype(np.float32)
+
+    def features_of(self, file):
+        """
+        Raw model features of an indexed piece, None when unknown
+        """
+        i = self.position.get(file)
+        return None if i is None else self.features[i]
+
+    def query(self, features, k=5, exclude=None):
+        """
+        The k pieces closest to the given raw model features as (file, distance),
+        closest first. exclude is a file left out, usually the piece itself.
+        """
+        distances = np.sum((self.vectors - self.transform(features)) ** 2, axis=1)
+        if exclude in self.position:
+            distances[self.position[exclude]] = np.inf
+        k = min(k, len(self) - (exclude in self.position))
+        if k <= 0:
+            return []
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+        return [(self.files[i], float(np.sqrt(distances[i]))) for i in nearest]
+
+    def save(self, path):
+        np.savez(path, files=self.files, features=self.features, vectors=self.vectors,
+                 scale=self.scale, min=self.min)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["files"], data["features"], data["vectors"], data["scale"], data["min"])
+
+
+def build_index(files, features, scaler, previous=None):
+    """
+    Index the pieces, reusing the vectors of a previous index for every piece
+    whose features have not changed (when the scaler is the same). Returns the
+    index and the number of pieces that had to be scaled.
+    """
+    features = np.asarray(features, dtype=np.float64)
+    scale = np.asarray(scaler.scale_, dtype=np.float64)
+    minimum = np.asarray(scaler.min_, dtype=np.float64)
+    index = SimilarityIndex(files, features, np.zeros(features.shape, dtype=np.float32), scale, minimum)
+
+    stale = np.ones(len(index), dtype=bool)
+    if previous is not None and np.array_equal(previous.scale, scale) and np.array_equal(previous.min, minimum):
+        for i, file in enumerate(index.files):
+            j = previous.position.get(file)
+            if j is not None and np.array_equal(previous.features[j], features[i], equal_nan=True):
+                index.vectors[i] = previous.vectors[j]
+                stale[i] = False
+    index.vectors[stale] = index.transform(features[stale])
+    return index, int(np.count_nonzero(stale))
+
+
+def read_features(path=FEATURES_PATH):
+    """
+    File names and model features of a csv_processing output, one row per file
+    """
+    # round_trip parses the floats exactly as written, so unchanged rows compare equal
+    table = pd.read_csv(path, usecols=['file', *FEATURES_KEPT], float_precision="round_trip")
+    table = table.drop_duplicates('file', keep='last')
+    return table['file'].to_numpy(), table.loc[:, FEATURES_KEPT].to_numpy()
+
+
+def update_index(index_path=INDEX_PATH, features_path=FEATURES_PATH, model_path=scoring.MODEL_PATH, rebuild=False):
+    """
+    Bring the index on disk up to date with the features CSV, only new and changed pieces are scaled again
+    """
+    previous = None
+    if not rebuild and os.path.exists(index_path):
+        previous = SimilarityIndex.load(index_path)
+    files, features = read_features(features_path)
+    index, scaled = build_index(files, features, scoring.load_model(model_path).scaler, previous)
+    index.save(index_path)
+    return index, scaled
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the pieces most similar to a piece in feature space")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Build or update the index from a features CSV")
+    build.add_argument("--features", type=str, default=FEATURES_PATH, help="CSV of features made by csv_processing.py")
+    build.add_argument("--output", "-o", type=str, default=INDEX_PATH, help="Index file")
+    build.add_argument("--model", type=str, default=scoring.MODEL_PATH, help="Model whose scaler is used")
+    build.add_argument("--rebuild", action='store_true', help="Scale every piece again instead of updating")
+
+    query = subparsers.add_parser("query", help="List the pieces closest to a piece")
+    query.add_argument("piece", type=str, help="MIDI or CSV file, or the name of an indexed piece")
+    query.add_argument("--index", type=str, default=INDEX_PATH, help="Index file")
+    query.add_argument("-k", type=int, default=5, help="Number of pieces")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        index, scaled = update_index(args.output, args.features, args.model, args.rebuild)
+        print(f"Indexed {len(index)} pieces ({scaled} scaled) to {args.output} in {time.perf_counter() - start:.2f}s")
+    else:
+        index = SimilarityIndex.load(args.index)
+        name = os.path.basename(args.piece)
+        features = index.features_of(name)
+        if features is None:
+            features = [csv_processing.get_features(args.piece, FEATURES_KEPT)[feature] for feature in FEATURES_KEPT]
+        start = time.perf_counter()
+        nearest = index.query(features, args.k, exclude=name)
+        elapsed = time.perf_counter() - start
+        for file, distance in nearest:
+            print(f"{distance:.4f}  {file}")
+        print(f"searched {len(index)} pieces in {elapsed * 1000:.2f}ms")
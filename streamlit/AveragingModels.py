@@ -2,6 +2,24 @@ from sklearn import clone
 from sklearn.base import RegressorMixin, TransformerMixin, BaseEstimator
 import numpy as np
 
+
+def _update_model(model, X, y, rounds, trees):
+    # boosting rounds are added to XGBoost and trees to RandomForest, the new
+    # ones fitted on every row, the old ones kept; other models are cheap to refit
+    name = type(model).__name__
+    if name == "XGBRegressor":
+        total = model.get_booster().num_boosted_rounds() + rounds
+        model.set_params(n_estimators=rounds)
+        model.fit(X, y, xgb_model=model.get_booster())
+        model.set_params(n_estimators=total)
+        return model
+    if name == "RandomForestRegressor":
+        model.set_params(warm_start=True, n_estimators=len(model.estimators_) + trees)
+        model.fit(X, y)
+        model.set_params(warm_start=False)
+        return model
+    return clone(model).fit(X, y)
+
 class AveragingModels(BaseEstimator, RegressorMixin, TransformerMixin):
     def __init__(self, models, scaler):
         self.models = models
@@ -17,9 +35,31 @@ class AveragingModels(BaseEstimator, RegressorMixin, TransformerMixin):
 
         return self
     
+    # new labeled pieces are added without starting over. X is the unscaled
+    # features of every training row (the new ones included) and y their
+    # difficulty. The scaler is only refitted when new rows fall outside its
+    # ranges by more than tolerance (a fraction of each range), the models are
+    # then fitted from scratch since they were trained on the old scaling.
+    # Returns True when the models were updated, False when they were refitted.
+    def update(self, X, y, rounds=50, trees=50, tolerance=0.1):
+        X = np.asarray(X, dtype=np.float64)
+        span = self.scaler.data_max_ - self.scaler.data_min_
+        margin = tolerance * span
+        if np.any(X < self.scaler.data_min_ - margin) or np.any(X > self.scaler.data_max_ + margin):
+            self.scaler = clone(self.scaler).fit(X)
+            self.fit(self.scaler.transform(X), y)
+            return False
+
+        X = self.scaler.transform(X)
+        self.models_ = [_update_model(model, X, y, rounds, trees) for model in self.models_]
+        return True
+
     #Now we do the predictions for cloned models and average them
-    def predict(self, X):
-        predictions = np.column_stack([
-            model.predict(X) for model in self.models_
-        ])
-        return np.mean(predictions, axis=1) 
\ No newline at end of file
+    # pass a concurrent.futures executor to run the base models at the same time,
+    # RandomForest, XGBoost and SVR release the GIL while predicting
+    def predict(self, X, executor=None):
+        if executor is None or len(self.models_) == 1:
+            predictions = [model.predict(X) for model in self.models_]
+        else:
+            predictions = list(executor.map(lambda model: model.predict(X), self.models_))
+        return np.mean(np.column_stack(predictions), axis=1) 
\ No newline at end of file
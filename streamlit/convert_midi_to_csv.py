@@ -1,50 +1,86 @@
 #Code retrieved from https://www.kaggle.com/datasets/vincentloos/classical-music-midi-as-csv
 
 import os
+import numpy as np
 import pandas as pd
 from mido import MidiFile, MetaMessage, Message, MidiTrack
 
-# Function to convert a MIDI file to a CSV file.
-def mid_to_csv(mid) -> None:
-    """Convert a midi file to a csv file"""
-    df = pd.DataFrame()
+# message attributes kept as integer columns, everything else (names, texts, sysex data) is dropped
+INT_FIELDS = [
+    "channel", "note", "velocity", "control", "value", "program", "pitch", "tempo",
+    "numerator", "denominator", "clocks_per_click", "notated_32nd_notes_per_beat",
+]
 
-    for n_track, track in enumerate(mid.tracks):
-        track_df = pd.DataFrame()
-        time = 0
+# attributes each message type has, filled in the first time a type is seen
+_fields_by_type = {}
+
+
+def _fields_of(msg):
+    fields = _fields_by_type.get(msg.type)
+    if fields is None:
+        fields = [field for field in INT_FIELDS if hasattr(msg, field)]
+        _fields_by_type[msg.type] = fields
+    return fields
 
-        # place all midi messages into a dataframe
-        for msg in track:
-            msg_dict = msg.__dict__
-            msg_dict["meta"] = int(isinstance(msg, MetaMessage))
-            msg_dict["track"] = n_track
 
-            if "time" not in msg_dict:
-                continue
+def mid_to_events(mid):
+    """
+    Walk the midi tracks once into preallocated typed column arrays.
+    Returns a dict of columns sorted by tick, with the same names as the csv files.
+    """
+    n_events = sum(len(track) for track in mid.tracks)
 
-            time += int(msg_dict["time"])
-            msg_dict["tick"] = time
+    tick = np.empty(n_events, dtype=np.int64)
+    time = np.empty(n_events, dtype=np.int64)
+    type_code = np.empty(n_events, dtype=np.int16)
+    meta = np.empty(n_events, dtype=np.int8)
+    track_number = np.empty(n_events, dtype=np.int16)
+    key = np.full(n_events, None, dtype=object)
+    values = {field: np.zeros(n_events, dtype=np.int32) for field in INT_FIELDS}
+    # pandas convention, True means the value is missing
+    missing = {field: np.ones(n_events, dtype=bool) for field in INT_FIELDS}
 
-            # delete redundant keys
-            for k in ["name", "text"]:
-                if k in msg_dict:
-                    del msg_dict[k]
+    type_names = {}
+    i = 0
+    for n_track, track in enumerate(mid.tracks):
+        current_tick = 0
+        for msg in track:
+            current_tick += msg.time
+            tick[i] = current_tick
+            time[i] = msg.time
+            type_code[i] = type_names.setdefault(msg.type, len(type_names))
+            meta[i] = isinstance(msg, MetaMessage)
+            track_number[i] = n_track
+
+            for field in _fields_of(msg):
+                values[field][i] = getattr(msg, field)
+                missing[field][i] = False
+            if msg.type == "key_signature":
+                key[i] = msg.key
+            i += 1
 
-            track_df = pd.concat(
-                [track_df, pd.DataFrame([msg_dict])], ignore_index=True
-            )
+    order = np.argsort(tick, kind="stable")
 
-        # merge song dataframe with track dataframe
-        if df.shape[0] > 0:
-            df = pd.merge(df, track_df, how="outer")
-        else:
-            df = track_df
+    events = {
+        "tick": tick[order],
+        "type": pd.Categorical.from_codes(type_code[order], categories=list(type_names)),
+        "time": time[order],
+        "meta": meta[order],
+        "track": track_number[order],
+    }
+    for field in INT_FIELDS:
+        if not missing[field].all():
+            events[field] = pd.arrays.IntegerArray(values[field][order], missing[field][order])
+    if "key_signature" in type_names:
+        events["key"] = key[order]
 
-    for col in df.columns:
-        if df[col].dtype == "float64":
-            df[col] = df[col].astype("Int64")
+    return events
 
+
+# Function to convert a MIDI file to a CSV file.
+def mid_to_csv(mid):
+    """Convert a midi file to a dataframe indexed by tick, in the csv format"""
+    df = pd.DataFrame(mid_to_events(mid))
     df.set_index("tick", inplace=True)
-    df.sort_index(inplace=True)
 
-    return df
\ No newline at end of file
+    return df
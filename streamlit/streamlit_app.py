@@ -1,26 +1,148 @@
-import pickle
-import random
+import sys
+import time
 
-import convert_midi_to_csv as convert
 import pandas as pd
-from AveragingModels import AveragingModels
-from mido import MidiFile
 # from sheetvision import main
-from sklearn.model_selection import cross_val_score, train_test_split
-from sklearn.preprocessing import MinMaxScaler
 
-import csv_processing
 import streamlit as st
 import os
 
+# the feature extraction shared with the batch cli lives in the root of the repo
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import recommendations
+import scoring
+import similarity
+import upload_processing
+from scoring import FEATURES_KEPT
+
+MODEL_PATH = './models/averaged_models.pkl'
+PREDICTIONS_PATH = 'predictions.csv'
+FEATURES_PATH = 'data/all_song_features.csv'
+SIMILARITY_INDEX_PATH = similarity.INDEX_PATH
+
+
+# one entry per server process shared by every session, keyed by the file's
+# mtime so a new pickle is loaded (and the old one dropped) once it is replaced
+@st.cache_resource(max_entries=1)
+def load_model(path, mtime):
+    """
+    Load the model (its compiled artifact when there is one) and run one
+    prediction so the first request does not pay for it
+    """
+    start = time.perf_counter()
+    averaged_models = scoring.load_model(path)
+    loaded = time.perf_counter()
+
+    warmup = pd.DataFrame([[0] * len(FEATURES_KEPT)], columns=FEATURES_KEPT)
+    averaged_models.predict(averaged_models.scaler.transform(warmup))
+
+    print(f"loaded {path} in {(loaded - start) * 1000:.0f}ms, warm-up prediction {(time.perf_counter() - loaded) * 1000:.0f}ms")
+    return averaged_models
+
+
+def get_model():
+    """
+    The loaded model, reloaded when the pickle or its compiled artifact on disk changes
+    """
+    return load_model(MODEL_PATH, scoring.model_mtime(MODEL_PATH))
+
+
+@st.cache_resource
+def get_upload_processor():
+    """
+    The worker processes uploads are processed in, with its cache of results, shared by every session
+    """
+    return upload_processing.UploadProcessor(workers=2, cache_size=128)
+
+
+@st.fragment(run_every=0.2)
+def show_progress(job):
+    """
+    Progress of an upload being processed, redrawn on its own every 0.2s so the
+    script thread is not held while it runs. The whole page runs again once it is done.
+    """
+    if job.done():
+        st.rerun()
+    st.progress(job.progress, text=f"Processing: {job.stage}")
+
+
+@st.cache_resource(max_entries=1)
+def load_predictions(path, mtime):
+    """
+    predictions.csv, shared by every session, do not modify it in place
+    """
+    return pd.read_csv(path)
+
+
+def get_predictions():
+    return load_predictions(PREDICTIONS_PATH, os.path.getmtime(PREDICTIONS_PATH))
+
+
+@st.cache_resource(max_entries=1)
+def load_recommender(predictions_path, features_path, mtimes):
+    """
+    The difficulty index recommendations are drawn from, built once per server process
+    """
+    start = time.perf_counter()
+    index = recommendations.DifficultyIndex.from_csv(predictions_path, features_path)
+    print(f"indexed {len(index)} pieces in {(time.perf_counter() - start) * 1000:.0f}ms")
+    return index
+
+
+def get_recommender():
+    features_path = FEATURES_PATH if os.path.exists(FEATURES_PATH) else None
+    mtimes = (os.path.getmtime(PREDICTIONS_PATH), features_path and os.path.getmtime(features_path))
+    return load_recommender(PREDICTIONS_PATH, features_path, mtimes)
+
+
+@st.cache_resource(max_entries=1)
+def load_range_views(predictions_path, mtime):
+    """
+    The pieces of every difficulty range, split into pages once per server process
+    """
+    return get_recommender().range_views(recommendations.DIFFICULTY_BOUNDS, recommendations.PAGE_SIZE)
+
+
+def get_range_views():
+    return load_range_views(PREDICTIONS_PATH, os.path.getmtime(PREDICTIONS_PATH))
+
+
+@st.cache_resource(max_entries=1)
+def load_similarity(index_path, features_path, mtimes):
+    """
+    The nearest neighbour index of the pieces, updated on disk for the pieces
+    added or changed in the features CSV since it was last saved
+    """
+    start = time.perf_counter()
+    if not os.path.exists(features_path):
+        return similarity.SimilarityIndex.load(index_path) if os.path.exists(index_path) else None
+    index, scaled = similarity.update_index(index_path, features_path, MODEL_PATH)
+    print(f"similarity index of {len(index)} pieces ({scaled} scaled) in {(time.perf_counter() - start) * 1000:.0f}ms")
+    return index
+
+
+def get_similarity():
+    mtimes = tuple(os.path.getmtime(path) if os.path.exists(path) else None
+                   for path in [FEATURES_PATH, MODEL_PATH])
+    return load_similarity(SIMILARITY_INDEX_PATH, FEATURES_PATH, mtimes)
+
 
 class streamlit:
     def __init__(self):
-        self.predcsv = pd.read_csv("predictions.csv")
-
         self.midi = None
         self.submit = False
         self.selected = "Select an option"
+        # model features of the submitted piece, recommendations are ranked by how close they are
+        self.features = None
+        self.exclude = None
+        # the upload being processed, kept across the runs of the page until it is done
+        self.job = None
+        self.upload_start = None
+
+    @property
+    def predcsv(self):
+        # read through the shared cache on every use so a new predictions.csv shows up in open sessions
+        return get_predictions()
 
 
 
@@ -72,47 +194,47 @@ class streamlit:
 
 
 
-    def process_midi_uploaded(self):
+    def submit_midi_uploaded(self):
         """
-        Process and output the difficulty level of the piece of the midi uploaded
+        Send the midi uploaded to the worker processes, the same file is only processed once
         """
+        self.upload_start = time.perf_counter()
+        self.job = get_upload_processor().submit(
+            self.midi.getvalue(), self.midi.name, get_model(), scoring.model_mtime(MODEL_PATH)
+        )
 
-        st.write("Filename:", self.midi.name)
-
-        # Rewind to start in case it was read already
-        self.midi.seek(0)
-
-        # Load MIDI directly from file-like object
-        mid = MidiFile(file=self.midi)
-
-        # Convert to CSV (as DataFrame)
-        csv = pd.DataFrame(convert.mid_to_csv(mid))
-        csv = csv.reset_index()
-
-        st.write(csv)
-        
-
-        df = pd.DataFrame(csv_processing.get_features(csv), index=[0])
-
+    def process_midi_uploaded(self):
+        """
+        Process and output the difficulty level of the piece of the midi uploaded.
+        Returns False while it is still being processed.
+        """
+        job = self.job
+        st.write("Filename:", job.name)
+        if not job.done():
+            show_progress(job)
+            return False
+        self.job = None
+
+        try:
+            result = job.result()
+        except Exception as e:
+            print(f"{job.name}: failed, {type(e).__name__}: {e}")
+            st.error(f"Could not read this midi file: {e}")
+            self.difficulty_predicted = None
+            return True
+
+        print(f"{job.name}: {'cached' if job.cached else 'processed'}, "
+              f"{(time.perf_counter() - self.upload_start) * 1000:.0f}ms (processing took {result['seconds'] * 1000:.0f}ms)")
+
+        df = pd.DataFrame(result['features'], index=[0])
         st.write("Features extracted:")
         st.write(df)
+        self.features = df.loc[0, FEATURES_KEPT].to_numpy()
+        self.exclude = None
 
-        features_kept = ['note_count', 'note_density', 'unique_note_count', 'notes_per_second',
-        'pitch_range', 'tempo_change_count', 'note_to_note_transition',
-        'note_to_chord_transition', 'chord_to_note_transition',
-        'chord_to_chord_transition']
-
-        df = df.loc[:, features_kept]
-        
-
-
-        with open('./models/averaged_models.pkl', 'rb') as file:
-            averaged_models = pickle.load(file)
-
-        df = averaged_models.scaler.transform(df)
-
-        self.difficulty_predicted = averaged_models.predict(df)
-        st.markdown(f"**Predicted difficult level: {round(self.difficulty_predicted[0] * 2) / 2}**")
+        self.difficulty_predicted = result['prediction']
+        st.markdown(f"**Predicted difficult level: {round(self.difficulty_predicted * 2) / 2}**")
+        return True
 
 
 
@@ -122,6 +244,9 @@ class streamlit:
         Process and output the difficulty level of the piece selected
         """
         st.write("Name of Piece:", self.selected)
+        self.exclude = self.selected + ".csv"
+        index = get_similarity()
+        self.features = index.features_of(self.exclude) if index is not None else None
         self.difficulty_predicted = self.predcsv.loc[self.predcsv['file'] == self.selected + ".csv", 'predicted_difficulty'].iloc[0]
         st.markdown(f"**Predicted difficult level: {self.difficulty_predicted}**")
 
@@ -130,51 +255,37 @@ class streamlit:
     def make_recommendations(self):
         """
         Make the recommendations of pieces based on the difficulty of the submitted piece
-        The recommendations comes from predictions.csv
+        The recommendations comes from predictions.csv, the pieces closest in features come first
         """
-        recommendations = pd.read_csv("predictions.csv")
-
-        self.recommendation_list = []
-        while len(self.recommendation_list) != 3:
-            piece = recommendations.iloc[random.randint(0,len(recommendations))]
-            if self.difficulty_predicted - 0.3 < piece["predicted_difficulty"] < self.difficulty_predicted + 0.5:
-                self.recommendation_list.append(piece)
+        self.recommendation_list = get_recommender().recommend(
+            self.difficulty_predicted, k=3, features=self.features, exclude=self.exclude
+        )
 
     def display_difficulty_ranges(self):
         """
         Display a list of songs grouped by difficulty ranges.
         """
+        start = time.perf_counter()
         st.markdown("### Browse Songs by Difficulty Range")
 
-        # Load predictions if not already loaded
-        df = self.predcsv.copy()
-
-        # Define ranges
-        difficulty_ranges = [
-            (1.0, 1.5),
-            (2.0, 2.5),
-            (3.0, 3.0),
-            (3.5, 3.5),
-            (4.0, 4.5),
-            (5.0, 5.0)
-        ]
-
-        for low, high in difficulty_ranges:
-            if low == high:
-                label = f"Difficulty {low}"
-            else:
-                label = f"Difficulty {low}-{high}"
-
-            filtered = df[(df["predicted_difficulty"] >= low) & (df["predicted_difficulty"] <= high)]
-            
-            if not filtered.empty:
-                with st.expander(label):
-                    for _, row in filtered.iterrows():
-                        st.write(f"{row['file'][:-4]} — Difficulty: {row['predicted_difficulty']:.2f}")
-            else:
-                with st.expander(label):
+        for view in get_range_views():
+            with st.expander(view.label):
+                if len(view) == 0:
                     st.write("No songs in this range.")
-                    
+                    continue
+                page = 1
+                if view.page_count > 1:
+                    page = st.number_input(
+                        f"Page (of {view.page_count})", min_value=1, max_value=view.page_count,
+                        key=f"page {view.label}",
+                    )
+                st.dataframe(
+                    view.page(page - 1), hide_index=True, use_container_width=True,
+                    column_config={"Difficulty": st.column_config.NumberColumn(format="%.2f")},
+                )
+
+        print(f"difficulty ranges rendered in {(time.perf_counter() - start) * 1000:.1f}ms")
+
     # def display_sheet_image_uploader(self):
     #     """
     #     Display uploader for sheet music image files
@@ -231,8 +342,26 @@ class streamlit:
         """
         st.write("")
         st.markdown("### Here are some pieces recommended for you")
+        if not self.recommendation_list:
+            st.write("No pieces of a similar difficulty were found.")
         for p in self.recommendation_list:
-            st.write(f"{p["file"][:-4]}, Difficulty: {p["predicted_difficulty"]:.2f}")
+            st.write(f"{p['file'][:-4]}, Difficulty: {p['predicted_difficulty']:.2f}")
+
+    def display_similar(self):
+        """
+        Display the pieces closest to the submitted piece in feature space, whatever their difficulty
+        """
+        index = get_similarity()
+        if index is None or self.features is None:
+            return
+        st.write("")
+        st.markdown("### Pieces like this one")
+        for file, _ in index.query(self.features, k=5, exclude=self.exclude):
+            difficulty = get_recommender().difficulty_of(file)
+            if difficulty is None:
+                st.write(f"{file[:-4]}")
+            else:
+                st.write(f"{file[:-4]}, Difficulty: {difficulty:.2f}")
 
 
     def display_everything(self):
@@ -246,22 +375,31 @@ class streamlit:
         self.display_button()
         
 
-        if self.submit:
+        if self.submit and self.midi is not None:
+            self.submit_midi_uploaded()
+
+        if self.job is not None:
+            # the page is run again once the upload is processed
+            # None when the file could not be read
+            if self.process_midi_uploaded() and self.difficulty_predicted is not None:
+                self.make_recommendations()
+                self.display_recommendations()
+                self.display_similar()
+
+            self.display_difficulty_ranges()
+
+        elif self.submit:
             # if self.sheet_image is not None:
             #     self.process_sheet_image()
                 
             #     self.make_recommendations()
             #     self.display_recommendations()
 
-            if self.midi is not None:
-                self.process_midi_uploaded()
-                self.make_recommendations()
-                self.display_recommendations()
-
-            elif self.selected !="Select an Option":
+            if self.selected !="Select an Option":
                 self.process_selected()
                 self.make_recommendations()
                 self.display_recommendations()
+                self.display_similar()
                 
             else:
                 self.submit = False
@@ -274,6 +412,12 @@ class streamlit:
 
 #run the stuff
 
+# load and warm up the model and build the recommendation index when the page is
+# first served instead of on the first submit
+get_model()
+get_recommender()
+get_similarity()
+
 if 'app' not in st.session_state:
     st.session_state.app = streamlit()
 
@@ -0,0 +1,110 @@
+import math
+
+import numpy as np
+
+# microseconds per beat until the first set_tempo, 120 bpm
+DEFAULT_TEMPO = 500_000
+# the CSVs do not record the resolution of the midi file, this is mido's default
+DEFAULT_TICKS_PER_BEAT = 480
+
+
+class TempoMap:
+    """
+    Seconds elapsed at a tick of a piece, piecewise linear between its
+    set_tempo events. Built once per piece from the tempo changes only, then
+    any number of ticks are converted with one searchsorted. Elapsed time is
+    summed exactly in ticks times microseconds per beat, so a map built from
+    event arrays and one built change by change while reading a midi file
+    give the same seconds. A change only moves the ticks after it.
+    """
+    def __init__(self, ticks_per_beat=DEFAULT_TICKS_PER_BEAT):
+        self.ticks_per_beat = ticks_per_beat
+        # (tick, tempo, ticks * microseconds per beat elapsed) where each piece starts
+        self.changes = [(0, DEFAULT_TEMPO, 0)]
+        self._arrays = None
+
+    @classmethod
+    def from_changes(cls, ticks, tempos, ticks_per_beat=DEFAULT_TICKS_PER_BEAT):
+        """
+        Tempo map of the set_tempo events of a piece (arrays of their ticks
+        and tempos, in tick order), built in one pass
+        """
+        ticks = np.asarray(ticks, dtype=np.int64)
+        if len(ticks) == 0:
+            # no set_tempo at all, DEFAULT_TEMPO throughout
+            return cls(ticks_per_beat)
+        tempos = np.asarray(tempos).astype(np.int64)
+        # several set_tempo on one tick, the last one lasts
+        last = np.append(ticks[1:] != ticks[:-1], True)
+        ticks, tempos = ticks[last], tempos[last]
+        if ticks[0] != 0:
+            ticks = np.insert(ticks, 0, 0)
+            tempos = np.insert(tempos, 0, DEFAULT_TEMPO)
+        elapsed = np.concatenate(([0], np.cumsum(np.diff(ticks) * tempos[:-1])))
+
+        tempo_map = cls(ticks_per_beat)
+        tempo_map.changes = None
+        tempo_map._arrays = (ticks, tempos, elapsed)
+        return tempo_map
+
+    def change(self, tick, tempo):
+        """
+        Set the tempo from tick on, ticks must never go down between calls
+        """
+        if self.changes is None:
+            self.changes = list(zip(*(values.tolist() for values in self._arrays)))
+        last_tick, last_tempo, elapsed = self.changes[-1]
+        if tick != last_tick:
+            self.changes.append((tick, tempo, elapsed + (tick - last_tick) * last_tempo))
+        else:
+            # several set_tempo on one tick, the last one lasts
+            self.changes[-1] = (tick, tempo, elapsed)
+        self._arrays = None
+
+    def _table(self):
+        if self._arrays is None:
+            self._arrays = tuple(np.array(values, dtype=np.int64) for values in zip(*self.changes))
+        return self._arrays
+
+    def seconds(self, ticks):
+        """
+        Seconds elapsed at each of ticks (an array or a single tick)
+        """
+        starts, tempos, elapsed = self._table()
+        i = np.searchsorted(starts, ticks, side="right") - 1
+        return (elapsed[i] + (ticks - starts[i]) * tempos[i]) / (self.ticks_per_beat * 1e6)
+
+    def seconds_at(self, tick):
+        """
+        seconds() of one tick, without numpy when it is past the last change
+        like it always is for code reading a piece event by event
+        """
+        if self.changes is not None and tick >= self.changes[-1][0]:
+            start, tempo, elapsed = self.changes[-1]
+        else:
+            starts, tempos, elapsed = self._table()
+            i = int(np.searchsorted(starts, tick, side="right")) - 1
+            start, tempo, elapsed = int(starts[i]), int(tempos[i]), int(elapsed[i])
+        return (elapsed + (tick - start) * tempo) / (self.ticks_per_beat * 1e6)
+
+    def ticks_at(self, seconds):
+        """
+        Tick (not rounded) at which each of seconds have elapsed
+        """
+        starts, tempos, elapsed = self._table()
+        micro = np.asarray(seconds, dtype=np.float64) * (self.ticks_per_beat * 1e6)
+        i = np.searchsorted(elapsed, micro, side="right") - 1
+        return starts[i] + (micro - elapsed[i]) / tempos[i]
+
+    def tempo_stats(self, end_tick):
+        """
+        Mean and standard deviation of the tempo from the start of the piece
+        to end_tick, each tempo weighted by the number of beats it lasts
+        """
+        starts, tempos, _ = self._table()
+        ticks = np.diff(np.minimum(np.append(starts, end_tick), end_tick)).astype(np.float64)
+        total = ticks.sum()
+        if total <= 0:
+            return math.nan, math.nan
+        mean = (ticks * tempos).sum() / total
+        return mean, math.sqrt((ticks * (tempos - mean) ** 2).sum() / total)
@@ -1,20 +1,23 @@
+"""
+csv_processing.get_features as it was before the NumPy feature engine, kept
+unchanged as the reference the engine is checked against (see
+test_feature_parity.py). The only change is 'file', which split the path on
+backslashes and only worked on Windows.
+"""
 import pandas as pd
 import numpy as np
-import argparse
-import os
-from multiprocessing import Pool
 from pathlib import Path
 
-def get_features(df):
+def get_features(filepath):
     """
     Extract features from a CSV file containing music data.
     """
-    # # Load CSV file
-    # df = pd.read_csv(filepath, low_memory=False)
+    # Load CSV file
+    df = pd.read_csv(filepath, low_memory=False)
      
-    # if 'tempo' not in df.columns:
-    #     print('file does not contain tempo column', filepath)
-    #     return None
+    if 'tempo' not in df.columns:
+        print('file does not contain tempo column', filepath)
+        return None
         
     
     df = df.sort_values(by="tick")
@@ -62,8 +65,25 @@ def get_features(df):
     max_polyphony = df[df['type'] == 'note_on'].groupby('tick').size().max()
     
     note_transitions =  note_transition(df)
+    
+    average_polyphony = get_average_polyphony(df)
+    consecutive_notes_std = get_consecutive_note_std(df)
+    hand_independence_score = get_hand_independence_score(df)
+    
+    high_difficulty_df = pd.DataFrame({
+        'note_density': [note_density],
+        'tempo_change_count': [tempo_change_count],
+        'max_polyphony': [max_polyphony],
+        'pitch_range': [pitch_range],
+        'consecutive_note_std': [consecutive_notes_std],
+        'hand_independence': [hand_independence_score],
+        'note_to_chord_transition': [note_transitions[1]],
+        'chord_to_note_transition': [note_transitions[2]],
+        'average_polyphony': [average_polyphony]
+    })
+    
     return {
-    #   'file': str(filepath).split('\\')[1],
+      'file': Path(filepath).name,
       'average_tempo': average_tempo,
       'average_bpm': average_bpm,
       'note_count': note_on_count,
@@ -77,19 +97,31 @@ def get_features(df):
       'duration_per_note': duration_per_note,
       'tempo_complexity': tempo_complexity,
       'notes_per_second': notes_per_second,
-      'hand_independence': get_hand_independence_score(df),
+      'hand_independence': hand_independence_score,
       'odd_time_signature_count': odd_time_signature_count,
-      'consecutive_note_std': get_consecutive_note_std(df),
+      'consecutive_note_std': consecutive_notes_std,
       'pitch_range': pitch_range,
-      'average_polyphony': get_average_polyphony(df),
+      'average_polyphony': average_polyphony,
       'tempo_change_count': tempo_change_count,
       'max_polyphony': max_polyphony,
       'note_to_note_transition': note_transitions[0],
       'note_to_chord_transition': note_transitions[1],
       'chord_to_note_transition': note_transitions[2],
-      'chord_to_chord_transition': note_transitions[3]
+      'chord_to_chord_transition': note_transitions[3],
+      'leap_frequency': get_leap_frequency(df),
     }
-
+    
+    
+def get_leap_frequency(df):
+    leap_count = 0
+    note_count = len(df[df['type'] == 'note_on'])
+    for i in range(1, len(df)):
+        current_row = df.iloc[i-1]
+        next_row = df.iloc[i]
+        if abs(current_row['note'] - next_row['note']) > 12:
+            leap_count += 1
+    return leap_count / note_count
+    
 
 def get_overlapping_notes(df):
     overlapping_notes = 0
@@ -128,34 +160,6 @@ def get_average_polyphony(df):
     grouped = note_ons.groupby('tick').size()
     return grouped.mean()
     
-def process_directory(file_list):
-    """
-    Process all CSV files in the given directory and extract features.
-    """
-    print('getting files...')
-    files = list(file_list)
-    total_files = len(files)
-    results = []
-    print(f'found {total_files} files, processing...')
-    with Pool() as pool:
-        for i in range(0, total_files, 100):
-            chunk = files[i:i+100]
-            chunk_results = pool.map(get_features, chunk)
-            print(f"Processed {i} files of {total_files} files")
-            results.extend(chunk_results)
-    
-    #remove None values from results
-    return [result for result in results if result is not None]
-
-def get_files_in_directory(directory, recursive=False):
-    """
-    Get all CSV files in the given directory
-    """
-    if recursive:
-        return Path(directory).rglob("*.csv")
-    else:
-        return Path(directory).glob("*.csv")
-    
 def note_transition(df):
 
 
@@ -204,45 +208,3 @@ def note_transition(df):
 
 
     return note_to_note, note_to_chord, chord_to_note, chord_to_chord
-
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Extract features from CSV files present in a directory")
-    parser.add_argument("directory", type=str, help="Directory containing CSV files")
-    parser.add_argument(
-        "--output", 
-        "-o", 
-        type=str, 
-        default="data/features.csv", 
-        help="Output CSV file for features"
-    )
-    parser.add_argument(
-        "--recursive",
-        "-r",
-        action='store_true',
-        help="Whether to search recursively in subdirectories"
-    )
-    parser.add_argument(
-        "--filepath",
-        type=str,
-        help="Path to a file that lists CSV files to process",
-    )
-    args = parser.parse_args()
-    features = []
-    if args.filepath:
-        with open(args.filepath, 'r', encoding="utf-8") as f:
-            file_list = [os.path.join(args.directory, line.strip()) for line in f.readlines()]
-    else:
-        file_list = list(get_files_in_directory(args.directory, args.recursive))
-    
-    try:
-        features = process_directory(file_list)
-    except Exception as e:
-        print(f"Error processing files: {e}")
-    finally:
-        if features:
-            df = pd.DataFrame(features)
-            df.to_csv(f"{args.output}", index=False)
-        else:
-            print("No features found")
-            
@@ -0,0 +1,48 @@
+"""
+csv_processing.get_features gives exactly the features of the original
+pandas implementation (reference_csv_processing.py) on every CSV of
+data/liszt and data/Handel HMV15/csv. The reference walks the events row by
+row, the whole run takes about a minute.
+
+python -m pytest tests/test_feature_parity.py
+"""
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import csv_processing
+import reference_csv_processing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRECTORIES = ["data/liszt", "data/Handel HMV15/csv"]
+FILES = sorted(path for directory in DIRECTORIES for path in Path(ROOT, directory).glob("*.csv"))
+
+
+def same(expected, actual):
+    if isinstance(expected, float) and math.isnan(expected):
+        return isinstance(actual, float) and math.isnan(actual)
+    return expected == actual
+
+
+def test_files_found():
+    assert len(FILES) == 68
+
+
+@pytest.mark.parametrize("path", FILES, ids=lambda path: path.name)
+def test_same_features_as_reference(path):
+    expected = reference_csv_processing.get_features(path)
+    actual = csv_processing.get_features(path)
+    if expected is None:
+        assert actual is None
+        return
+
+    # the features added since keep the reference's in front, in its order
+    assert list(actual)[:len(expected)] == list(expected)
+    different = {name: (value, actual[name]) for name, value in expected.items() if not same(value, actual[name])}
+    assert not different
+    # counts stay integers like pandas returns them
+    integers = [name for name, value in expected.items() if isinstance(value, (int, np.integer))]
+    assert all(isinstance(actual[name], (int, np.integer)) for name in integers)
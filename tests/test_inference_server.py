@@ -0,0 +1,81 @@
+"""
+The inference server answers 400 only for files that are not midi, 503 when
+it is busy or times out and 500 when the model fails, and a request that
+times out keeps its slot until its worker is done with the file.
+"""
+import http.client
+import json
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+import inference_server
+import scoring
+
+ROOT = Path(__file__).resolve().parent.parent
+DATA = sorted(ROOT.glob("data/test/*.mid"))[0].read_bytes()
+
+
+class FailingModel:
+    def __init__(self, scaler):
+        self.scaler = scaler
+
+    def predict(self, rows):
+        raise RuntimeError("model failed")
+
+
+@pytest.fixture(scope="module")
+def model():
+    return scoring.load_model()
+
+
+def start(service):
+    server = inference_server.ThreadingHTTPServer(("127.0.0.1", 0), inference_server.RequestHandler)
+    server.service = service
+    server.max_bytes = inference_server.MAX_BYTES
+    server.verbose = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def post(server, data):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+    connection.request("POST", "/predict?name=test.mid", data)
+    response = connection.getresponse()
+    body = json.loads(response.read())
+    connection.close()
+    return response.status, body
+
+
+@pytest.mark.parametrize("failing", [False, True], ids=["model", "failing model"])
+def test_status_codes(model, failing):
+    service = inference_server.InferenceService(FailingModel(model.scaler) if failing else model, workers=1)
+    server = start(service)
+    try:
+        status, body = post(server, b"not a midi file")
+        assert (status, body['error']) == (400, "OSError: MThd not found. Probably not a MIDI file")
+        status, body = post(server, DATA)
+        assert (status, body.get('file')) == ((500, None) if failing else (200, "test.mid"))
+    finally:
+        server.shutdown()
+        service.close()
+
+
+def test_timed_out_request_holds_its_slot(model):
+    service = inference_server.InferenceService(model, workers=1, max_pending=1)
+    try:
+        with pytest.raises(TimeoutError):
+            service.predict(DATA, timeout=0.001)
+        # the worker is still reading the file
+        with pytest.raises(inference_server.Overloaded):
+            service.predict(DATA)
+        deadline = time.perf_counter() + 30
+        while not service.slots.acquire(blocking=False):
+            assert time.perf_counter() < deadline
+            time.sleep(0.01)
+        service.slots.release()
+        assert service.predict(DATA)['features']
+    finally:
+        service.close()
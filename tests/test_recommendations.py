@@ -0,0 +1,117 @@
+"""
+DifficultyIndex against a brute force scan of predictions.csv and of small
+hand made tables.
+"""
+import os
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import recommendations
+from recommendations import DifficultyIndex
+from scoring import FEATURES_KEPT
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PREDICTIONS_PATH = os.path.join(ROOT, "predictions.csv")
+FEATURES_PATH = os.path.join(ROOT, "data/all_song_features.csv")
+
+
+@pytest.fixture(scope="module")
+def predictions():
+    return pd.read_csv(PREDICTIONS_PATH)
+
+
+@pytest.fixture(scope="module")
+def index():
+    return DifficultyIndex.from_csv(PREDICTIONS_PATH, FEATURES_PATH)
+
+
+def window(predictions, difficulty, exclude=None):
+    difficulties = predictions['predicted_difficulty']
+    inside = (difficulty - recommendations.BELOW < difficulties) & (difficulties < difficulty + recommendations.ABOVE)
+    return set(predictions['file'][inside]) - {exclude}
+
+
+def test_range_bounds_match_a_scan(index, predictions):
+    difficulties = predictions['predicted_difficulty'].to_numpy()
+    for low in np.arange(0.5, 5.5, 0.25):
+        for high in [low, low + 0.25, low + 0.5, low + 1.3]:
+            inclusive = predictions['file'][(difficulties >= low) & (difficulties <= high)]
+            exclusive = predictions['file'][(difficulties > low) & (difficulties < high)]
+            assert sorted(file for file, _ in index.pieces(low, high)) == sorted(inclusive), (low, high)
+            assert sorted(file for file, _ in index.pieces(low, high, inclusive=False)) == sorted(exclusive), (low, high)
+
+
+def test_bounds_on_ties_and_edges():
+    index = DifficultyIndex(["a", "b", "c", "d", "e"], [2.0, 1.0, 2.0, 3.0, 2.0])
+    assert index.bounds(2.0, 2.0) == (1, 4)
+    assert index.pieces(2.0, 2.0, inclusive=False) == []
+    assert [file for file, _ in index.pieces(1.0, 3.0, inclusive=False)] == ["a", "c", "e"]
+    assert index.pieces(0.0, 0.5) == []
+    assert index.pieces(3.0, 9.0) == [("d", 3.0)]
+    assert [file for file, _ in index.pieces(0.0, 9.0)] == ["b", "a", "c", "e", "d"]
+
+
+def test_samples_without_replacement_inside_the_window(index, predictions):
+    random.seed(0)
+    for difficulty in np.arange(1.0, 5.5, 0.5):
+        expected = window(predictions, difficulty)
+        for _ in range(20):
+            found = [piece['file'] for piece in index.recommend(difficulty, k=3)]
+            assert len(found) == len(set(found)) == min(3, len(expected)), difficulty
+            assert set(found) <= expected, difficulty
+
+
+def test_sparse_window_returns_fewer_than_k():
+    index = DifficultyIndex(["a", "b", "c", "d"], [1.0, 3.0, 3.2, 5.0])
+    for _ in range(20):
+        found = index.recommend(3.0, k=3)
+        assert sorted(piece['file'] for piece in found) == ["b", "c"]
+    assert index.recommend(9.0, k=3) == []
+    assert index.recommend(3.0, k=0) == []
+
+
+def test_exclusion():
+    index = DifficultyIndex(["a", "b", "c", "d"], [3.0, 3.1, 3.2, 5.0])
+    for _ in range(50):
+        found = [piece['file'] for piece in index.recommend(3.0, k=2, exclude="b")]
+        assert len(found) == 2 and "b" not in found
+    assert sorted(piece['file'] for piece in index.recommend(3.0, k=5, exclude="b")) == ["a", "c"]
+    # a file that is not indexed excludes nothing
+    assert len(index.recommend(3.0, k=5, exclude="unknown")) == 3
+
+
+def test_similarity_ranks_the_closest_of_the_window(index, predictions):
+    features = pd.read_csv(FEATURES_PATH).drop_duplicates('file').set_index('file').loc[:, FEATURES_KEPT]
+    for difficulty in np.arange(1.0, 5.5, 0.5):
+        file = predictions['file'].iloc[int(difficulty * 97) % len(predictions)]
+        query = index.features_of(file)
+        found = [piece['file'] for piece in index.recommend(difficulty, k=3, features=query, exclude=file)]
+
+        candidates = sorted(window(predictions, difficulty, exclude=file))
+        scaled = np.nan_to_num((features.loc[candidates].to_numpy() - index.low) / index.span)
+        distances = np.linalg.norm(scaled - np.nan_to_num((query - index.low) / index.span), axis=1)
+        assert file not in found
+        assert sorted(distances[[candidates.index(f) for f in found]]) == sorted(distances)[:min(3, len(candidates))]
+
+
+def test_lookups():
+    index = DifficultyIndex(["a", "b"], [2.0, 1.0], [[1.0, 10.0], [3.0, 30.0]])
+    assert index.difficulty_of("a") == 2.0
+    assert index.difficulty_of("unknown") is None
+    assert list(index.features_of("b")) == [3.0, 30.0]
+    assert index.features_of("unknown") is None
+    assert DifficultyIndex(["a"], [1.0]).features_of("a") is None
+
+
+def test_range_views_hold_what_their_labels_say():
+    index = DifficultyIndex(["a.mid", "b.mid", "c.mid", "d.mid", "e.mid", "f.mid"], [0.5, 1.99, 2.0, 3.4, 5.0, 5.5])
+    views = index.range_views([2.0, 3.0, 5.0], page_size=10)
+    assert {view.label: list(view.table['Piece']) for view in views} == {
+        "Difficulty < 2.0": ["a", "b"],
+        "Difficulty 2.0–3.0": ["c"],
+        "Difficulty 3.0–5.0": ["d"],
+        "Difficulty ≥ 5.0": ["e", "f"],
+    }
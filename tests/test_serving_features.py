@@ -0,0 +1,82 @@
+"""
+A piece gets exactly the same features whichever way it comes in: the
+training path (the midi file converted to a CSV file, read by
+csv_processing.get_features) and the serving paths (a DataFrame, event
+arrays, the midi file or a MidiFile, the app's uploads, the inference server
+and the event store), for every midi file of data/test.
+"""
+import math
+import os
+from pathlib import Path
+
+import pytest
+from mido import MidiFile
+
+import convert_midi_to_csv as convert
+import csv_processing
+import event_store
+import feature_engine
+import inference_server
+import scoring
+import upload_processing
+from scoring import FEATURES_KEPT
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FILES = sorted(Path(ROOT, "data/test").glob("*.mid"))
+
+
+@pytest.fixture(scope="module")
+def model():
+    return scoring.load_model()
+
+
+@pytest.fixture(scope="module")
+def uploads():
+    processor = upload_processing.UploadProcessor(workers=1)
+    yield processor
+    processor.shutdown()
+
+
+def differences(expected, actual):
+    return {
+        name: (value, actual[name]) for name, value in expected.items()
+        if not (value == actual[name] or (isinstance(value, float) and math.isnan(value) and math.isnan(actual[name])))
+    }
+
+
+@pytest.mark.parametrize("path", FILES, ids=lambda path: path.name)
+def test_training_and_serving_features_are_the_same(path, model, uploads, tmp_path):
+    mid = MidiFile(path)
+    df = convert.mid_to_csv(mid)
+    csv_path = tmp_path / (path.stem + ".csv")
+    df.to_csv(csv_path)
+    # the CSV does not record the resolution of the midi file
+    ticks_per_beat = mid.ticks_per_beat
+    training = csv_processing.get_features(csv_path, ticks_per_beat=ticks_per_beat)
+    training.pop('file')
+
+    event_store.ingest([path], tmp_path / "events")
+    store = event_store.EventStore(tmp_path / "events")
+    serving = {
+        'DataFrame': csv_processing.get_features(df, ticks_per_beat=ticks_per_beat),
+        'event arrays': csv_processing.get_features(
+            feature_engine.events_from_dataframe(df.reset_index()), ticks_per_beat=ticks_per_beat,
+        ),
+        'midi path': csv_processing.get_features(str(path)),
+        'MidiFile': csv_processing.get_features(MidiFile(path)),
+        'event store': event_store.get_stored_features(store, path.name),
+    }
+    for features in serving.values():
+        features.pop('file', None)
+    # the app and the server only extract the model features
+    data = path.read_bytes()
+    serving['app upload'] = uploads.submit(data, path.name, model).result()['features']
+    serving['inference server'] = inference_server.extract_features(data)
+
+    assert {name: list(features) for name, features in serving.items()} == {
+        name: list(training) if name not in ('app upload', 'inference server') else FEATURES_KEPT
+        for name in serving
+    }
+    found = {name: differences({key: training[key] for key in features}, features)
+             for name, features in serving.items()}
+    assert found == {name: {} for name in serving}
@@ -0,0 +1,52 @@
+import math
+
+import numpy as np
+from mido import MetaMessage, Message, MidiFile, MidiTrack
+
+import csv_processing
+import feature_engine
+from tempo_map import DEFAULT_TEMPO, TempoMap
+
+
+def test_no_tempo_changes_is_default_tempo():
+    tempo_map = TempoMap.from_changes(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), 480)
+    assert tempo_map.seconds_at(960) == 1.0
+    assert list(tempo_map.seconds(np.array([0, 480, 960]))) == [0.0, 0.5, 1.0]
+    assert tempo_map.tempo_stats(960) == (DEFAULT_TEMPO, 0.0)
+
+
+def test_same_as_built_change_by_change():
+    ticks = np.array([0, 0, 480, 1000, 1000])
+    tempos = np.array([600_000, 400_000, 300_000, 700_000, 500_000])
+    built = TempoMap(240)
+    for tick, tempo in zip(ticks, tempos):
+        built.change(int(tick), int(tempo))
+    at = np.array([0, 100, 480, 999, 1000, 5000])
+    assert list(TempoMap.from_changes(ticks, tempos, 240).seconds(at)) == list(built.seconds(at))
+
+
+def test_piece_without_set_tempo():
+    track = MidiTrack([
+        Message("note_on", note=60, velocity=64, time=0),
+        Message("note_on", note=64, velocity=64, time=480),
+        Message("note_off", note=60, velocity=0, time=480),
+        MetaMessage("end_of_track", time=0),
+    ])
+    mid = MidiFile(ticks_per_beat=480)
+    mid.tracks.append(track)
+
+    features = csv_processing.get_features(mid)
+    assert features['duration_seconds'] == 1.0
+    assert features['weighted_average_tempo'] == DEFAULT_TEMPO
+    assert math.isnan(features['average_tempo'])
+
+    events = {
+        "tick": np.array([0, 480, 960]),
+        "type": np.array([feature_engine.NOTE_ON, feature_engine.NOTE_ON, feature_engine.NOTE_OFF], dtype=np.int8),
+        "time": np.array([0, 480, 480]),
+        "track": np.zeros(3, dtype=np.int64),
+        "note": np.array([60, 64, 60]),
+        "velocity": np.array([64, 64, 0]),
+        "tempo": np.full(3, np.nan),
+    }
+    assert feature_engine.compute_features(events)['duration_seconds'] == 1.0
@@ -0,0 +1,340 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import pickle
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.feature_selection import SelectPercentile, r_regression
+from sklearn.linear_model import ElasticNet, Lasso, LinearRegression, Ridge
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.model_selection import KFold, ParameterGrid, train_test_split
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.svm import SVR
+from xgboost import XGBRegressor
+
+import compiled_model
+import dataset
+import scoring
+# scoring puts the streamlit directory, where AveragingModels lives, on the path
+from AveragingModels import AveragingModels
+
+PARAMS_PATH = "model_params.json"
+DATA_PATH = "data/training.npz"
+MODELS_DIR = "models"
+CACHE_PATH = "models/search_cache.json"
+SMOGN_CACHE_PATH = "models/smogn_cache.pkl"
+SEED = 42
+
+# base models searched by model.ipynb, single threaded since the search runs one fit per core
+ESTIMATORS = {
+    'XGB': lambda: XGBRegressor(random_state=SEED, n_jobs=1),
+    'RandomForest': lambda: RandomForestRegressor(random_state=SEED, n_jobs=1),
+    'SVR': lambda: SVR(),
+    'LinearRegression': lambda: LinearRegression(),
+    'Ridge': lambda: Ridge(random_state=SEED),
+    'Lasso': lambda: Lasso(random_state=SEED),
+    'ElasticNet': lambda: ElasticNet(random_state=SEED),
+}
+
+# relevance of each difficulty for smogn, 2, 4 and 5 are oversampled
+SMOGN_CONTROL_POINTS = [
+    [0, 1, 0], [0.5, 1, 0], [1, 1, 0], [1.5, 1, 0], [2, 0, 0], [2.5, 1, 0],
+    [3, 1, 0], [3.5, 1, 0], [4, 0, 0], [4.5, 1, 0], [5, 0, 0],
+]
+
+
+def read_table(path=DATA_PATH):
+    """
+    Labeled pieces, the training table built by dataset.py or a CSV like processed.csv
+    """
+    if path.endswith(".npz"):
+        return dataset.load_dataset(path)
+    return pd.read_csv(path)
+
+
+def smogn_table(df, cache_path=SMOGN_CACHE_PATH):
+    """
+    df with the rare difficulties oversampled by smogn like the notebook. smogn
+    weights the difficulty of some synthetic rows with memory it never set, so
+    even seeded it does not give the same rows twice: the oversampled table is
+    kept in cache_path and reused while df is the same, so every run trains on
+    the same rows and the search cache, keyed by them, is read.
+    """
+    key = hashlib.sha256(
+        pd.util.hash_pandas_object(df).to_numpy().tobytes()
+        + json.dumps([list(df.columns), SMOGN_CONTROL_POINTS, SEED]).encode()
+    ).hexdigest()
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+        if cached['key'] == key:
+            return cached['table']
+
+    # only needed for training, so imported here
+    import smogn
+    random.seed(SEED)
+    np.random.seed(SEED)
+    table = smogn.smoter(data=df, y="difficulty", samp_method="extreme", rel_method="manual",
+                         rel_ctrl_pts_rg=SMOGN_CONTROL_POINTS)
+    if cache_path:
+        with open(cache_path, "wb") as f:
+            pickle.dump({'key': key, 'table': table}, f)
+    return table
+
+
+def load_training_data(path=DATA_PATH, oversample=True, smogn_cache=SMOGN_CACHE_PATH):
+    """
+    Read the labeled pieces, oversample the rare difficulties with smogn like the
+    notebook, keep the best 40% of the features and scale them. Returns
+    X_train, X_test, y_train, y_test, the names of the features kept and the scaler.
+    """
+    df = read_table(path).drop(columns=['file'], errors="ignore")
+    if oversample:
+        df = smogn_table(df, smogn_cache)
+
+    X = df.drop(columns=['difficulty'])
+    y = df['difficulty']
+    selector = SelectPercentile(r_regression, percentile=40)
+    features_kept = list(X.columns[selector.fit(X, y).get_support()])
+    X = selector.transform(X)
+    scaler = MinMaxScaler()
+    X = scaler.fit_transform(X)
+    X_train, X_test, y_train, y_test = train_test_split(X, y.to_numpy(), test_size=0.2, random_state=SEED)
+    return X_train, X_test, y_train, y_test, features_kept, scaler
+
+
+def halving_rounds(cv, exhaustive=False):
+    """
+    Folds scored in every round of the search. Successive halving scores
+    every candidate on the first fold and only the best of them on each
+    next fold, exhaustive scores every candidate on every fold at once.
+    """
+    return [list(range(cv))] if exhaustive else [[fold] for fold in range(cv)]
+
+
+# training data of the worker processes, set once by _init_worker
+_data = {}
+
+
+def _init_worker(X, y, cv):
+    _data.update(X=X, y=y, cv=cv)
+
+
+def _fold_score(name, params, fold):
+    """
+    r2 of one fold of the cross validation, run in a worker
+    """
+    X, y = _data['X'], _data['y']
+    train, test = list(KFold(_data['cv'], shuffle=True, random_state=SEED).split(X))[fold]
+    model = ESTIMATORS[name]().set_params(**params)
+    # a candidate that cannot be fitted scores nan and is ranked last, like GridSearchCV's error_score
+    try:
+        model.fit(X[train], y[train])
+        return r2_score(y[test], model.predict(X[test]))
+    except Exception as e:
+        print(f"{name} {params} failed: {type(e).__name__}: {e}")
+        return float("nan")
+
+
+def _task_key(data_hash, name, params, cv, fold):
+    key = json.dumps([data_hash, name, params, cv, fold], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class SearchCache:
+    """
+    r2 of every fold already fitted, keyed by the data, the model, its
+    parameters and the fold, kept in a json file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.scores = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.scores = json.load(f)
+
+    def save(self):
+        if self.path:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.scores, f)
+
+
+def search(spaces, X, y, cv=3, factor=3, exhaustive=False, workers=None, cache=None):
+    """
+    Cross validated search of every model's parameter grid at the same time,
+    one fold per task across a pool of processes. With successive halving only
+    the best 1/factor of the candidates (by their mean r2 so far) are scored
+    on the next fold, the others stop early. Folds found in cache are not
+    fitted again. Returns {name: {best_params, best_score}} and the number of
+    folds fitted and read from the cache.
+    """
+    cache = cache or SearchCache(None)
+    data_hash = hashlib.sha256(X.tobytes() + y.tobytes()).hexdigest()
+    grids = {name: list(ParameterGrid(space)) for name, space in spaces.items()}
+    survivors = {name: list(range(len(grid))) for name, grid in grids.items()}
+    fold_scores = {}
+    rounds = halving_rounds(cv, exhaustive)
+    fitted = cached = 0
+
+    with ProcessPoolExecutor(workers or os.cpu_count(), initializer=_init_worker, initargs=(X, y, cv)) as pool:
+        for number, folds in enumerate(rounds):
+            # the candidates of every model are fitted in the same round
+            futures = {}
+            for name, grid in grids.items():
+                for i in survivors[name]:
+                    for fold in folds:
+                        key = _task_key(data_hash, name, grid[i], cv, fold)
+                        if key in cache.scores:
+                            fold_scores.setdefault((name, i), []).append(cache.scores[key])
+                            cached += 1
+                        else:
+                            futures[pool.submit(_fold_score, name, grid[i], fold)] = (name, i, key)
+            for future in as_completed(futures):
+                name, i, key = futures[future]
+                cache.scores[key] = future.result()
+                fold_scores.setdefault((name, i), []).append(cache.scores[key])
+            fitted += len(futures)
+            cache.save()
+
+            for name in grids:
+                # stable sort so ties go to the first candidate like GridSearchCV, failed ones last
+                means = {i: np.mean(fold_scores[(name, i)]) for i in survivors[name]}
+                survivors[name] = sorted(survivors[name], key=lambda i: -means[i] if not np.isnan(means[i]) else np.inf)
+                if number + 1 < len(rounds):
+                    survivors[name] = survivors[name][:max(math.ceil(len(survivors[name]) / factor), 1)]
+            print(f"round {number + 1} of {len(rounds)}: {len(futures)} folds fitted, "
+                  f"{sum(map(len, survivors.values()))} candidates left")
+
+    results = {}
+    for name, grid in grids.items():
+        best = survivors[name][0]
+        results[name] = {'best_params': grid[best], 'best_score': float(np.mean(fold_scores[(name, best)]))}
+    return results, fitted, cached
+
+
+def save_models(best_params, X_train, X_test, y_train, y_test, scaler, averaged, models_dir=MODELS_DIR):
+    """
+    Fit every model of best_params ({name: parameters}) and pickle it like
+    model.ipynb, then the AveragingModels of the averaged ones and its
+    compiled artifact
+    """
+    models = {}
+    for name, params in best_params.items():
+        model = ESTIMATORS[name]().set_params(**params)
+        model.fit(X_train, y_train)
+        models[name] = model
+        y_pred = np.round(model.predict(X_test) * 2) / 2
+        print(f"{name}: test MAE {mean_absolute_error(y_test, y_pred):.4f}, "
+              f"MSE {mean_squared_error(y_test, y_pred):.4f}, R^2 {r2_score(y_test, y_pred):.4f}")
+        with open(os.path.join(models_dir, f"{name}_saved_model.pkl"), "wb") as file:
+            pickle.dump(model, file)
+
+    averaged_models = AveragingModels(models=[models[name] for name in averaged], scaler=scaler)
+    averaged_models.fit(X_train, y_train)
+    y_pred = np.round(averaged_models.predict(X_test) * 2) / 2
+    print(f"averaged ({', '.join(averaged)}): test MAE {mean_absolute_error(y_test, y_pred):.4f}, "
+          f"R^2 {r2_score(y_test, y_pred):.4f}")
+    path = os.path.join(models_dir, "averaged_models.pkl")
+    with open(path, "wb") as file:
+        pickle.dump(averaged_models, file)
+    compiled_model.export(averaged_models, scoring.compiled_path(path), source=path)
+    return averaged_models
+
+
+def update_models(path, data_path=DATA_PATH, rounds=50, trees=50):
+    """
+    Add the labeled pieces of data_path to a trained AveragingModels with
+    AveragingModels.update instead of training from scratch, then write it
+    and its compiled artifact back. Returns whether the models were updated
+    (False when the scaler's ranges changed and they were refitted).
+    """
+    model = scoring.load_model(path, compiled=False)
+    df = read_table(data_path)
+    updated = model.update(df.loc[:, scoring.FEATURES_KEPT].to_numpy(), df['difficulty'].to_numpy(), rounds, trees)
+    with open(path, "wb") as file:
+        pickle.dump(model, file)
+    compiled_model.export(model, scoring.compiled_path(path), source=path)
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune and train the models of model.ipynb")
+    parser.add_argument("--params", type=str, default=PARAMS_PATH,
+                        help="JSON with the search space of every model, the best parameters are written back to it")
+    parser.add_argument("--data", type=str, default=DATA_PATH, help="Labeled pieces, made by dataset.py (or a CSV like processed.csv)")
+    parser.add_argument("--models-dir", type=str, default=MODELS_DIR, help="Directory the model pickles are written to")
+    parser.add_argument("--models", type=str, help="Comma separated models to tune (all of them by default)")
+    parser.add_argument("--average", type=str, default="RandomForest",
+                        help="Comma separated models averaged into averaged_models.pkl")
+    parser.add_argument("--cv", type=int, default=3, help="Number of cross validation folds")
+    parser.add_argument("--factor", type=int, default=3, help="Only the best 1/factor candidates go on to the next fold")
+    parser.add_argument("--exhaustive", action='store_true',
+                        help="Score every candidate on every fold like GridSearchCV")
+    parser.add_argument("--workers", type=int, help="Processes fitting folds (one per core by default)")
+    parser.add_argument("--cache", type=str, default=CACHE_PATH, help="Cache of fold results")
+    parser.add_argument("--no-cache", action='store_true',
+                        help="Do not read or write the cache of fold results nor the oversampled table")
+    parser.add_argument("--no-smogn", action='store_true', help="Train on the table as is, without oversampling")
+    parser.add_argument("--search-only", action='store_true', help="Only write the best parameters, fit no models")
+    parser.add_argument(
+        "--update",
+        action='store_true',
+        help="Add the rows of --data (every labeled piece, new ones included) to the trained "
+             "averaged_models.pkl with more boosting rounds and trees instead of tuning and training from scratch"
+    )
+    parser.add_argument("--rounds", type=int, default=50, help="Boosting rounds added to XGBoost by --update")
+    parser.add_argument("--trees", type=int, default=50, help="Trees added to RandomForest by --update")
+    args = parser.parse_args()
+
+    if args.update:
+        path = os.path.join(args.models_dir, "averaged_models.pkl")
+        start = time.perf_counter()
+        updated = update_models(path, args.data, args.rounds, args.trees)
+        action = "updated" if updated else "refitted from scratch, the feature ranges changed"
+        print(f"{path} {action} in {time.perf_counter() - start:.2f}s")
+    else:
+        with open(args.params, encoding="utf-8") as f:
+            config = json.load(f)
+        names = [name.strip() for name in args.models.split(",")] if args.models else list(config)
+        for name in names:
+            if name not in ESTIMATORS:
+                raise ValueError(f"unknown model {name}, expected one of {', '.join(ESTIMATORS)}")
+            if 'params' not in config.get(name, {}):
+                raise ValueError(f"no search space (params) for {name} in {args.params}")
+
+        X_train, X_test, y_train, y_test, features_kept, scaler = load_training_data(
+            args.data, not args.no_smogn, None if args.no_cache else SMOGN_CACHE_PATH,
+        )
+        print(f"{len(y_train)} training rows, features kept: {', '.join(features_kept)}")
+        if features_kept != scoring.FEATURES_KEPT:
+            print("warning: the features kept differ from scoring.FEATURES_KEPT, update it before serving the model")
+
+        grid_fits = sum(len(ParameterGrid(config[name]['params'])) for name in names) * args.cv
+        start = time.perf_counter()
+        cache = SearchCache(None if args.no_cache else args.cache)
+        results, fitted, cached = search(
+            {name: config[name]['params'] for name in names}, X_train, y_train, args.cv, args.factor,
+            args.exhaustive, args.workers, cache,
+        )
+        elapsed = time.perf_counter() - start
+        for name, result in results.items():
+            print(f"{name}: {result['best_params']} r2 {result['best_score']:.4f}")
+            config[name].update(result)
+        with open(args.params, "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2)
+            f.write("\n")
+        print(f"searched in {elapsed:.2f}s: {fitted} folds fitted, {cached} from the cache, "
+              f"the exhaustive grid is {grid_fits} folds")
+
+        if not args.search_only:
+            averaged = [name.strip() for name in args.average.split(",")]
+            # models averaged but not tuned in this run keep their previous best parameters
+            best_params = {name: config[name]['best_params'] for name in [*names, *averaged]}
+            save_models(best_params, X_train, X_test, y_train, y_test, scaler, averaged, args.models_dir)
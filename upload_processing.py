@@ -0,0 +1,179 @@
+import hashlib
+import io
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import pandas as pd
+from mido import MidiFile
+
+import csv_processing
+from scoring import FEATURES_KEPT
+
+
+class UploadJob:
+    """
+    One uploaded midi file going through the pool. Its stage and progress
+    (0 to 1) are written by the worker to status, a dict shared with the
+    worker process when it runs in one.
+    """
+    def __init__(self, name, key, status=None):
+        self.name = name
+        self.key = key
+        self.status = {} if status is None else status
+        self.cached = False
+        self.future = None
+
+    @property
+    def stage(self):
+        return self.status.get(self.key, ("waiting", 0.0))[0]
+
+    @property
+    def progress(self):
+        return self.status.get(self.key, ("waiting", 0.0))[1]
+
+    def report(self, stage, progress):
+        self.status[self.key] = (stage, progress)
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """
+        The result dict (summary, features, prediction, seconds), raises what the worker raised
+        """
+        return self.future.result(timeout)
+
+
+def read_upload(data, report=None):
+    """
+    Read an uploaded midi file and extract the model features, as a dict of
+    summary, features and seconds. report is called with the stage and its
+    progress (0 to 0.9) as it goes.
+    """
+    report = report or (lambda stage, progress: None)
+    start = time.perf_counter()
+    report("reading midi", 0.0)
+    mid = MidiFile(file=io.BytesIO(data))
+
+    # the messages are most of the work, reported from 10% to 90%
+    report("extracting features", 0.1)
+    features = csv_processing.get_features(
+        mid, FEATURES_KEPT, progress=lambda done, total: report("extracting features", 0.1 + 0.8 * done / max(total, 1)),
+    )
+    return {
+        'summary': {
+            'tracks': len(mid.tracks),
+            'messages': sum(len(track) for track in mid.tracks),
+            'ticks_per_beat': mid.ticks_per_beat,
+            'notes': features['note_count'],
+        },
+        'features': features,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def _read_in_worker(data, status, key):
+    return read_upload(data, lambda stage, progress: status.__setitem__(key, (stage, progress)))
+
+
+def _predict(model, upload):
+    """
+    The result of process_midi from the result of read_upload
+    """
+    start = time.perf_counter()
+    df = pd.DataFrame(upload['features'], index=[0])
+    prediction = float(model.predict(model.scaler.transform(df))[0])
+    return {**upload, 'prediction': prediction, 'seconds': upload['seconds'] + time.perf_counter() - start}
+
+
+def process_midi(data, model, job=None):
+    """
+    Read an uploaded midi file, extract the model features and predict its
+    difficulty, in this process. Updates the stage and progress of job when given.
+    """
+    upload = read_upload(data, job.report if job is not None else None)
+    if job is not None:
+        job.report("predicting", 0.9)
+    result = _predict(model, upload)
+    if job is not None:
+        job.report("done", 1.0)
+    return result
+
+
+class UploadProcessor:
+    """
+    Processes uploads in a pool of worker processes, so reading the midi and
+    extracting its features (pure Python, holding the GIL) neither blocks
+    the app's script thread nor shares one core between uploads. The worker
+    reports its progress through a dict held by a multiprocessing manager,
+    the prediction is made here once the features are back, so the model
+    is never sent to the workers. Results are kept in an LRU cache keyed by
+    the hash of the file's content (and the model's version), and an upload
+    already in progress is joined instead of started again.
+    """
+    def __init__(self, workers=2, cache_size=128):
+        # spawned, forking the threads of a running app server is not safe
+        context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(workers, mp_context=context)
+        self.manager = context.Manager()
+        self.status = self.manager.dict()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.running = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def submit(self, data, name, model, model_version=None):
+        """
+        Start processing an upload (bytes of a midi file) and return its UploadJob
+        """
+        key = (hashlib.sha256(data).hexdigest(), model_version)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                job = UploadJob(name, key, {key: ("done", 1.0)})
+                job.cached = True
+                # already finished, not queued behind the uploads being processed
+                job.future = Future()
+                job.future.set_result(self.cache[key])
+                return job
+            if key in self.running:
+                self.hits += 1
+                return self.running[key]
+            self.misses += 1
+            job = UploadJob(name, key, self.status)
+            job.future = Future()
+            self.running[key] = job
+            reading = self.executor.submit(_read_in_worker, data, self.status, key)
+        reading.add_done_callback(lambda future: self._finish(job, future, model))
+        return job
+
+    def _finish(self, job, reading, model):
+        try:
+            result = _predict(model, reading.result())
+        except BaseException as e:
+            result = e
+        # the shared entry is not needed once the job is over
+        job.status = {job.key: ("done", 1.0)}
+        self.status.pop(job.key, None)
+        with self.lock:
+            self.running.pop(job.key, None)
+            # failed uploads are not cached so they can be retried
+            if not isinstance(result, BaseException):
+                self.cache[job.key] = result
+                self.cache.move_to_end(job.key)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        if isinstance(result, BaseException):
+            job.future.set_exception(result)
+        else:
+            job.future.set_result(result)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.manager.shutdown()